@@ -1,13 +1,15 @@
+import json
 import logging
 import uuid
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, AsyncIterator, List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 # from pydantic import BaseModel # No longer directly needed here
 
 # Import the refactored process_chat_message
-from app.langchain.agent import process_chat_message
+from app.langchain.agent import process_chat_message, stream_chat_message
 # Remove old memory imports
 # from app.langchain.memory import add_messages_to_memory, get_memory_for_session
 # Import schemas directly
@@ -66,3 +68,52 @@ async def chat(request: ChatRequest):
         #     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         #     detail=error_response.dict() # Send the structured error as detail
         # )
+
+
+def _format_sse(event: str, data: Any) -> str:
+    """Formats a single Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@router.post("/chat/stream", tags=["chat"])
+async def chat_stream(request: ChatRequest):
+    """Processes a chat message like /chat, streaming progress as Server-Sent Events.
+
+    Events: `node` (graph node finished), `text_delta` (final answer text as it is generated),
+    `table` (sql_query result), `visualization` (rendered chart) and a terminating `final` event
+    whose data is a ChatResponse.
+    """
+    logger.info(f"Received streaming chat request for org {request.organization_id} with session_id: {request.session_id}")
+
+    async def event_generator() -> AsyncIterator[str]:
+        try:
+            async for event in stream_chat_message(
+                organization_id=request.organization_id,
+                message=request.message,
+                session_id=request.session_id,
+            ):
+                if event["event"] == "final":
+                    # Validate the final payload against the same schema as the /chat endpoint
+                    final_response = ChatResponse(**event["data"])
+                    yield _format_sse("final", final_response.model_dump(mode="json"))
+                else:
+                    yield _format_sse(event["event"], event["data"])
+        except Exception as e:
+            logger.error(f"Unexpected error in chat stream endpoint: {str(e)}", exc_info=True)
+            error_response = ChatResponse(
+                status="error",
+                data=None,
+                error={
+                    "code": "API_ENDPOINT_ERROR",
+                    "message": "An unexpected error occurred handling your request.",
+                    "details": {"error": str(e)}
+                },
+                timestamp=datetime.now()
+            )
+            yield _format_sse("final", error_response.model_dump(mode="json"))
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,12 +1,26 @@
 import logging
+import secrets
 import time
-from fastapi import APIRouter, Response, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
 from pydantic import BaseModel
-from typing import Dict, Optional
+from sqlalchemy import text
+from typing import Any, Dict, Optional
 
 from app.core.config import settings
-from app.db.connection import db_engines
-from app.langchain.agent import test_azure_openai_connection
+from app.db.connection import async_db_engines
+from app.db.partitions import partition_maintainer
+from app.db.rollups import rollup_manager
+from app.langchain.agent import graph_registry, invalidate_graph_app, test_azure_openai_connection
+from app.langchain.tools.chart_inference import chart_inference_stats
+from app.langchain.tools.chart_pool import chart_pool
+from app.langchain.tools.chart_store import chart_store
+from app.langchain.tools.hierarchy_index import hierarchy_index
+from app.langchain.tools.hierarchy_trigram import hierarchy_trigram_search
+from app.langchain.tools.schema_prompt import schema_prompt_builder
+from app.langchain.tools.sql_cache import sql_template_cache
+from app.langchain.tools.sql_examples import sql_example_library
+from app.langchain.tools.sql_query_log import sql_query_log
+from app.langchain.tools.sql_result_cache import sql_result_cache
 
 logger = logging.getLogger(__name__)
 
@@ -28,14 +42,14 @@ async def health_check(response: Response):
     logger.debug("Health check requested")
 
     # Check database connections
-    db_status = "connected" if db_engines else "disconnected"
-    if db_engines:
+    db_status = "connected" if async_db_engines else "disconnected"
+    if async_db_engines:
         # Check if any database is connected
         db_status = "disconnected"
-        for db_name, engine in db_engines.items():
+        for db_name, engine in async_db_engines.items():
             try:
-                with engine.connect() as conn:
-                    conn.execute("SELECT 1")
+                async with engine.connect() as conn:
+                    await conn.execute(text("SELECT 1"))
                 db_status = "connected"
                 break
             except Exception as e:
@@ -75,3 +89,45 @@ async def health_check(response: Response):
         },
         uptime=uptime
     )
+
+@router.get("/health/metrics", tags=["health"])
+async def cache_metrics() -> Dict[str, Any]:
+    """Cache and registry counters for monitoring."""
+    return {
+        "graph_cache": graph_registry.stats(),
+        "schema_prompts": schema_prompt_builder.stats(),
+        "sql_template_cache": sql_template_cache.stats(),
+        "sql_examples": sql_example_library.stats(),
+        "sql_result_cache": sql_result_cache.stats(),
+        "chart_pool": chart_pool.stats(),
+        "chart_store": chart_store.stats(),
+        "chart_inference": chart_inference_stats.stats(),
+        "hierarchy_index": hierarchy_index.stats(),
+        "hierarchy_trigram_search": hierarchy_trigram_search.stats(),
+        "rollups": rollup_manager.stats(),
+        "partitions": partition_maintainer.stats(),
+        "sql_query_log": sql_query_log.stats(),
+    }
+
+def require_admin_key(x_admin_key: Optional[str] = Header(None)) -> None:
+    """Allow the request only with the configured ADMIN_API_KEY in the X-Admin-Key header."""
+    if not settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin endpoints are disabled (ADMIN_API_KEY is not set)")
+    if not x_admin_key or not secrets.compare_digest(x_admin_key, settings.ADMIN_API_KEY):
+        logger.warning("Rejected admin request with a missing or invalid X-Admin-Key")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or missing X-Admin-Key header")
+
+@router.post("/health/graph-cache/invalidate", tags=["health"], dependencies=[Depends(require_admin_key)])
+async def invalidate_graph_cache(organization_id: Optional[str] = None) -> Dict[str, Any]:
+    """Drop cached compiled graphs for one organization (or all if none is given)."""
+    removed = invalidate_graph_app(organization_id)
+    return {"invalidated": removed, "organization_id": organization_id}
+
+@router.post("/health/sql-result-cache/invalidate", tags=["health"], dependencies=[Depends(require_admin_key)])
+async def invalidate_sql_result_cache(table: Optional[str] = None, organization_id: Optional[str] = None) -> Dict[str, Any]:
+    """Drop cached query results that read a table (all results if no table is given)."""
+    if table is None:
+        sql_result_cache.clear()
+        return {"invalidated": "all", "table": None, "organization_id": organization_id}
+    removed = sql_result_cache.invalidate_table(table, organization_id)
+    return {"invalidated": removed, "table": table, "organization_id": organization_id}
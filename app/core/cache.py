@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Hashable, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+V = TypeVar("V")
+
+# Sentinel used to distinguish "not cached" from a cached None value
+_MISSING = object()
+
+
+class TTLCache(Generic[V]):
+    """Thread-safe, bounded LRU cache with optional per-entry time-to-live.
+
+    Entries are evicted least-recently-used first once ``max_size`` is reached,
+    and lazily expired on access once older than ``ttl_seconds``.
+    Hit/miss/eviction counters are kept for metrics.
+    """
+
+    def __init__(self, name: str, max_size: int = 128, ttl_seconds: Optional[float] = None):
+        """Create a cache.
+
+        Args:
+            name: Name used in logs and metrics
+            max_size: Maximum number of entries (must be >= 1)
+            ttl_seconds: Entry lifetime in seconds, or None/0 for no expiry
+        """
+        self.name = name
+        self.max_size = max(1, int(max_size))
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._build_locks: Dict[Hashable, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _is_expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds is not None and (time.monotonic() - stored_at) > self.ttl_seconds
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key (refreshing its LRU position) or default."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, stored_at = entry
+            if self._is_expired(stored_at):
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                logger.debug(f"Cache '{self.name}': entry {key!r} expired")
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: V) -> None:
+        """Store value under key, evicting least-recently-used entries if full."""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+            self._data[key] = (value, time.monotonic())
+            while len(self._data) > self.max_size:
+                evicted_key, _ = self._data.popitem(last=False)
+                self.evictions += 1
+                logger.debug(f"Cache '{self.name}': evicted {evicted_key!r} (max_size={self.max_size})")
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], V]) -> V:
+        """Return the cached value for key, building and storing it with factory on a miss.
+
+        The factory runs outside the cache lock, under a lock for this key only: concurrent misses
+        on one key build it once, while lookups and builds of other keys are not blocked.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        try:
+            with build_lock:
+                # Built by another thread while this one waited
+                value = self.peek(key, _MISSING)
+                if value is _MISSING:
+                    value = factory()
+                    self.set(key, value)
+                return value
+        finally:
+            with self._lock:
+                if self._build_locks.get(key) is build_lock:
+                    del self._build_locks[key]
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Remove a single entry. Returns True if it was present."""
+        with self._lock:
+            return self._data.pop(key, _MISSING) is not _MISSING
+
+    def invalidate_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Remove all entries for which predicate(key, value) is true. Returns the number removed."""
+        with self._lock:
+            doomed = [key for key, (value, _) in self._data.items() if predicate(key, value)]
+            for key in doomed:
+                del self._data[key]
+            return len(doomed)
+
+    def clear(self) -> None:
+        """Remove all entries (counters are kept)."""
+        with self._lock:
+            self._data.clear()
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key or default, without touching LRU order or counters."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or self._is_expired(entry[1]):
+                return default
+            return entry[0]
+
+    def keys(self) -> List[Hashable]:
+        """Keys of all unexpired entries, least recently used first (does not touch LRU order or counters)."""
+        with self._lock:
+            return [key for key, (_, stored_at) in self._data.items() if not self._is_expired(stored_at)]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            return entry is not _MISSING and not self._is_expired(entry[1])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
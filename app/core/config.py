@@ -27,8 +27,81 @@ class Settings(BaseSettings):
     LLM_MODEL_NAME: str = "gpt-4o"
     VERBOSE_LLM: bool = False
     
+    # Pooled LLM HTTP clients (shared by the agent and all tools)
+    LLM_POOL_MAX_CONNECTIONS: int = 50
+    LLM_POOL_MAX_KEEPALIVE: int = 20
+    LLM_POOL_KEEPALIVE_EXPIRY_SECONDS: float = 60.0
+    LLM_POOL_WARM_CONNECTIONS: int = 2  # Connections opened to the Azure endpoint during startup
+    LLM_REQUEST_TIMEOUT_SECONDS: float = 60.0
+    LLM_CONNECT_TIMEOUT_SECONDS: float = 10.0
+    LLM_MAX_RETRIES: int = 2
+    
+    # Compiled agent graph cache (per organization)
+    GRAPH_CACHE_MAX_SIZE: int = 128  # Maximum number of organizations with a cached compiled graph
+    GRAPH_CACHE_TTL_SECONDS: int = 3600  # Rebuild cached graphs after this many seconds (0 = never expire)
+    
+    # Generated SQL template cache (shared across organizations)
+    SQL_CACHE_MAX_SIZE: int = 1024
+    SQL_CACHE_TTL_SECONDS: int = 86400  # 0 = never expire
+    SQL_CACHE_DB_PATH: str = ""  # SQLite file for the on-disk tier, empty = in-memory only
+    
+    # Executed SQL result cache (per organization, invalidated by data watermarks)
+    SQL_RESULT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    SQL_RESULT_CACHE_TTL_SECONDS: int = 300  # Only invalidation for results not reading "5"/"8" (e.g. hierarchyCaches only); 0 = watermarks only, such results are not cached
+    SQL_RESULT_CACHE_WATERMARK_TTL_SECONDS: int = 15  # Reuse a probed watermark for this long before probing again
+    SQL_ESTIMATE_TRUNCATED_ROWS: bool = True  # Report a planner (EXPLAIN) row estimate when results are truncated
+    SQL_STATEMENT_TIMEOUT_MS: int = 15000  # SET LOCAL statement_timeout for generated SQL (0 = no timeout)
+    SQL_MAX_PLAN_COST: float = 5_000_000  # Reject generated SQL whose EXPLAIN total cost is higher (0 = no limit)
+    SQL_MAX_PLAN_ROWS: int = 20_000_000  # Reject generated SQL if any plan node expects more rows (0 = no limit)
+    SQL_QUERY_LOG_PATH: str = ""  # JSONL workload log read by app.db.index_advisor, e.g. "logs/sql_queries.jsonl" (empty = off)
+    SQL_QUERY_LOG_PARAMS: bool = False  # Also log raw SQL and bind values (organization/location IDs, user filter values) so the advisor can EXPLAIN real queries
+    SQL_QUERY_LOG_MAX_BYTES: int = 50 * 1024 * 1024
+    
+    # Schema text sent with SQL generation prompts (only the tables a description needs)
+    SQL_SCHEMA_PRUNING_ENABLED: bool = True
+    SQL_SCHEMA_PRUNING_MIN_SCORE: float = 0.5  # Send the full schema when no table matches the description this well (BM25)
+    SQL_SCHEMA_PRUNING_RELATIVE_SCORE: float = 0.4  # Keep tables scoring at least this fraction of the best match
+    SQL_SCHEMA_ALWAYS_INCLUDE: List[str] = ["hierarchyCaches"]  # Sent with every pruned schema (location names -> ids)
+    
+    # Few-shot (question, SQL) examples retrieved per query description (BM25, in-process)
+    SQL_EXAMPLES_PATH: str = "app/db/sql_examples.jsonl"  # Curated examples
+    SQL_EXAMPLES_LEARNED_PATH: str = ""  # Append successful generated queries here and reuse them as examples (empty = off)
+    SQL_EXAMPLES_MAX_LEARNED: int = 5000
+    SQL_EXAMPLES_TOP_K: int = 3
+    SQL_EXAMPLES_MIN_SCORE: float = 0.5
+    
+    # Time zones used to resolve relative dates ("last week", "this month") into :start_ts/:end_ts
+    ORG_DEFAULT_TIMEZONE: str = "UTC"
+    ORG_TIMEZONES: Dict[str, str] = {}  # organization_id -> IANA time zone, e.g. {"<uuid>": "Europe/London"}
+    
+    # In-memory hierarchy index used to resolve location names (per organization)
+    HIERARCHY_INDEX_TTL_SECONDS: int = 3600  # Reload an organization's hierarchy at least this often (0 = only on change)
+    HIERARCHY_INDEX_REFRESH_INTERVAL_SECONDS: int = 60  # Probe cached organizations for changes (max updatedAt/deletedAt)
+    HIERARCHY_INDEX_MAX_ORGS: int = 1000
+    HIERARCHY_INDEX_WARM_ACTIVE_DAYS: int = 7  # At startup, load organizations with events in this many days (0 = no warm-up)
+    HIERARCHY_MATCH_TOP_K: int = 3  # Close matches returned per name so the agent can disambiguate
+    HIERARCHY_MATCH_MIN_SUGGESTION_SCORE: int = 70  # Fuzzy score (0-100) below which a name is not suggested
+    HIERARCHY_MATCH_AMBIGUITY_MARGIN: int = 5  # A match is ambiguous if another entry scores within this many points (0 = only ties)
+    HIERARCHY_RESOLVE_SUBTREE: bool = False  # Use "hierarchyClosure" (needs migration 0003) for name resolution anywhere under the organization and in generated SQL; False = org and direct children
+    HIERARCHY_SERVER_MATCH_MIN_ENTRIES: int = 20000  # Match larger hierarchies in Postgres with pg_trgm (needs migration 0002, 0 = never)
+    
+    # Hourly/daily rollups of event tables "5" and "8" (needs CREATE/INSERT rights on report_management)
+    ROLLUPS_ENABLED: bool = False
+    ROLLUP_REFRESH_INTERVAL_SECONDS: int = 60
+    ROLLUP_REFRESH_LAG_SECONDS: int = 60  # Only roll up rows whose updatedAt is at least this old
+    ROLLUP_MAX_STALENESS_SECONDS: int = 600  # Stop routing queries to rollups whose watermark is older than this
+    
+    # Monthly partitions of event tables "5" and "8" (created by the alembic migrations)
+    PARTITION_MAINTENANCE_ENABLED: bool = False
+    PARTITION_MAINTENANCE_INTERVAL_SECONDS: int = 6 * 3600
+    PARTITION_MONTHS_AHEAD: int = 3  # Future months that always have a partition
+    PARTITION_RETENTION_MONTHS: int = 0  # Detach monthly partitions older than this (0 = keep all)
+    PARTITION_ARCHIVE_SCHEMA: str = "archive"  # Detached partitions move here; empty = drop them
+    SQL_DEFAULT_TIME_WINDOW_DAYS: int = 365  # Lower eventTimestamp bound added to queries with no eventTimestamp bound at all (0 = never)
+    
     # Security
     SECRET_KEY: str = ""
+    ADMIN_API_KEY: str = ""  # Required in the X-Admin-Key header by admin endpoints (cache invalidation); empty = admin endpoints disabled
     
     # Logging
     LOG_LEVEL: str = "INFO"
@@ -36,6 +109,13 @@ class Settings(BaseSettings):
     # Chart generation
     CHART_DIR: str = "static/charts"
     CHART_URL_BASE: str = "/static/charts"
+    CHART_POOL_SIZE: int = 0  # Chart render worker processes (0 = min(4, CPU count))
+    CHART_RENDER_TIMEOUT_SECONDS: float = 30.0
+    CHART_POOL_MAX_QUEUE: int = 32  # Renders allowed to wait or run at once before new ones are rejected
+    CHART_STORE_MAX_BYTES: int = 512 * 1024 * 1024  # Disk budget for rendered charts (0 = unbounded)
+    CHART_STORE_MAX_AGE_SECONDS: int = 7 * 24 * 3600  # Delete charts not accessed for this long (0 = never)
+    CHART_STORE_SWEEP_INTERVAL_SECONDS: int = 300
+    CHART_INFERENCE_MIN_CONFIDENCE: float = 0.7  # Below this, chart metadata is generated by the LLM
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from langchain_openai import AzureChatOpenAI
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Temperature profiles used across the application
+AGENT_TEMPERATURE = 0.1
+SQL_TEMPERATURE = 0.0
+CHART_TEMPERATURE = 0.1
+SUMMARY_DECOMPOSE_TEMPERATURE = 0.1
+SUMMARY_SYNTHESIS_TEMPERATURE = 0.3
+
+# Shared HTTP transports (one connection pool per process, reused by every LLM client)
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional[httpx.AsyncClient] = None
+
+# LLM clients keyed by (deployment, temperature)
+_llm_clients: Dict[Tuple[str, float], AzureChatOpenAI] = {}
+_lock = threading.Lock()
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=settings.LLM_POOL_KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def _pool_timeout() -> httpx.Timeout:
+    return httpx.Timeout(settings.LLM_REQUEST_TIMEOUT_SECONDS, connect=settings.LLM_CONNECT_TIMEOUT_SECONDS)
+
+
+def _get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """Create the shared keep-alive HTTP clients on first use."""
+    global _http_client, _http_async_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.Client(limits=_pool_limits(), timeout=_pool_timeout())
+    if _http_async_client is None or _http_async_client.is_closed:
+        _http_async_client = httpx.AsyncClient(limits=_pool_limits(), timeout=_pool_timeout())
+    return _http_client, _http_async_client
+
+
+def get_chat_llm(temperature: float = AGENT_TEMPERATURE, deployment_name: Optional[str] = None) -> AzureChatOpenAI:
+    """Get the shared Azure OpenAI chat client for a (deployment, temperature) profile.
+
+    Clients are created once per profile and share a single pooled, keep-alive
+    HTTP transport, so repeated calls do not pay client setup or TLS handshakes.
+
+    Args:
+        temperature: Sampling temperature of the profile
+        deployment_name: Azure deployment, defaults to AZURE_OPENAI_DEPLOYMENT_NAME
+
+    Returns:
+        Pooled AzureChatOpenAI instance
+    """
+    deployment = deployment_name or settings.AZURE_OPENAI_DEPLOYMENT_NAME
+    key = (deployment, float(temperature))
+    with _lock:
+        llm = _llm_clients.get(key)
+        if llm is None:
+            http_client, http_async_client = _get_http_clients()
+            logger.info(f"Initializing pooled Azure OpenAI client for deployment {deployment} (temperature={temperature})")
+            llm = AzureChatOpenAI(
+                openai_api_key=settings.AZURE_OPENAI_API_KEY,
+                azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+                openai_api_version=settings.AZURE_OPENAI_API_VERSION,
+                deployment_name=deployment,
+                model_name=settings.LLM_MODEL_NAME,
+                temperature=temperature,
+                verbose=settings.VERBOSE_LLM,
+                timeout=settings.LLM_REQUEST_TIMEOUT_SECONDS,
+                max_retries=settings.LLM_MAX_RETRIES,
+                http_client=http_client,
+                http_async_client=http_async_client,
+            )
+            _llm_clients[key] = llm
+        return llm
+
+
+async def warm_llm_clients() -> None:
+    """Create the standard client profiles and open connections to the Azure endpoint.
+
+    Any HTTP response counts as success; the goal is only to complete DNS, TCP and
+    TLS setup so the first chat request finds a warm keep-alive connection.
+    """
+    try:
+        for temperature in {AGENT_TEMPERATURE, SQL_TEMPERATURE, CHART_TEMPERATURE,
+                            SUMMARY_DECOMPOSE_TEMPERATURE, SUMMARY_SYNTHESIS_TEMPERATURE}:
+            get_chat_llm(temperature)
+    except Exception as e:
+        # Misconfiguration must not stop startup; requests needing a client will report it
+        logger.warning(f"LLM client initialization failed, skipping connection warm-up: {str(e)}")
+        return
+
+    if not settings.AZURE_OPENAI_ENDPOINT:
+        logger.warning("AZURE_OPENAI_ENDPOINT not configured, skipping LLM connection warm-up.")
+        return
+
+    warm_count = max(1, settings.LLM_POOL_WARM_CONNECTIONS)
+    try:
+        http_client, http_async_client = _get_http_clients()
+        await asyncio.gather(*[http_async_client.get(settings.AZURE_OPENAI_ENDPOINT) for _ in range(warm_count)])
+        # Tools that still run synchronously use the sync transport, warm one connection there too
+        await asyncio.to_thread(http_client.get, settings.AZURE_OPENAI_ENDPOINT)
+        logger.info(f"Warmed {warm_count} Azure OpenAI connection(s).")
+    except Exception as e:
+        logger.warning(f"Azure OpenAI connection warm-up failed: {str(e)}")
+
+
+async def close_llm_clients() -> None:
+    """Close the shared HTTP transports and forget the cached clients."""
+    global _http_client, _http_async_client
+    with _lock:
+        _llm_clients.clear()
+    if _http_async_client is not None:
+        await _http_async_client.aclose()
+        _http_async_client = None
+    if _http_client is not None:
+        _http_client.close()
+        _http_client = None
+    logger.info("Closed pooled Azure OpenAI HTTP clients.")
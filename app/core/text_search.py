@@ -0,0 +1,119 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+_WORD = re.compile(r"[A-Za-z]+|\d+")
+_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z])(?=[A-Z])")
+
+# Words that carry no meaning for matching questions against schema or example text
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how i in is it me of on or per show the their there this to was "
+    "what which with all any each many much give list get tell last past previous next current "
+    # Aggregation words appear in almost every question and say nothing about which data is meant
+    "total number count sum average avg".split()
+)
+
+
+def _stem(word: str) -> str:
+    """Very light suffix stripping, so "borrows"/"borrowed"/"borrowing" all match "borrow"."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("ches", "shes", "sses", "xes")):
+        return word[:-2]
+    for suffix in ("ing", "ed"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            word = word[: -len(suffix)]
+            # "logged" -> "logg" -> "log"
+            if len(word) > 2 and word[-1] == word[-2] and word[-1] not in "aeiouls":
+                word = word[:-1]
+            return word
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    # "compare" -> "compar", to match "compared"/"comparing"
+    if len(word) > 4 and word.endswith("e"):
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lower-case, stemmed terms (camelCase identifiers are split into words)."""
+    terms = []
+    for word in _WORD.findall(_CAMEL_BOUNDARY.sub(" ", text)):
+        word = word.lower()
+        if word not in STOPWORDS:
+            terms.append(_stem(word))
+    return terms
+
+
+class BM25Index(Generic[K]):
+    """Small in-memory Okapi BM25 index over short documents (schema descriptions, example questions).
+
+    Built once and queried many times; adding a document invalidates the cached document frequencies.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """Create an empty index.
+
+        Args:
+            k1: Term frequency saturation
+            b: Document length normalization (0 = none, 1 = full)
+        """
+        self.k1 = k1
+        self.b = b
+        self._documents: Dict[K, Counter] = {}
+        self._lengths: Dict[K, int] = {}
+        self._idf: Optional[Dict[str, float]] = None
+        self._average_length = 0.0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def add(self, key: K, text: str) -> None:
+        """Index (or re-index) a document under key."""
+        terms = tokenize(text)
+        self._documents[key] = Counter(terms)
+        self._lengths[key] = len(terms)
+        self._idf = None
+
+    def _prepare(self) -> Dict[str, float]:
+        if self._idf is None:
+            document_frequency: Counter = Counter()
+            for terms in self._documents.values():
+                document_frequency.update(terms.keys())
+            count = len(self._documents)
+            self._idf = {
+                term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+                for term, frequency in document_frequency.items()
+            }
+            self._average_length = (sum(self._lengths.values()) / count) if count else 0.0
+        return self._idf
+
+    def search(self, query: str, top_k: Optional[int] = None) -> List[Tuple[K, float]]:
+        """Score every document against query.
+
+        Args:
+            query: Free text
+            top_k: Return at most this many results (None = all matching documents)
+
+        Returns:
+            (key, score) pairs with score > 0, best first
+        """
+        idf = self._prepare()
+        query_terms = [term for term in set(tokenize(query)) if term in idf]
+        if not query_terms:
+            return []
+        scores = []
+        for key, terms in self._documents.items():
+            length_norm = self.k1 * (1 - self.b + self.b * self._lengths[key] / (self._average_length or 1))
+            score = 0.0
+            for term in query_terms:
+                frequency = terms.get(term)
+                if frequency:
+                    score += idf[term] * frequency * (self.k1 + 1) / (frequency + length_norm)
+            if score > 0:
+                scores.append((key, score))
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores[:top_k] if top_k else scores
@@ -1,7 +1,8 @@
 import logging
 from typing import Dict, List, Optional
 from sqlalchemy import create_engine, MetaData, inspect, text
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Engine, URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
@@ -14,6 +15,9 @@ logger = logging.getLogger(__name__)
 # Dictionary to store database engines
 db_engines: Dict[str, Engine] = {}
 
+# Dictionary to store asyncio (asyncpg) database engines, keyed like db_engines
+async_db_engines: Dict[str, AsyncEngine] = {}
+
 # Create Base for SQLAlchemy models
 Base = declarative_base()
 
@@ -32,6 +36,30 @@ def get_db_engine(db_name: str) -> Optional[Engine]:
     
     return db_engines[db_name]
 
+def get_async_db_engine(db_name: str) -> Optional[AsyncEngine]:
+    """Get SQLAlchemy AsyncEngine (asyncpg driver) for a specific database.
+    
+    Args:
+        db_name: Name of the database to connect to
+        
+    Returns:
+        Async database engine or None if not found
+    """
+    if db_name not in async_db_engines:
+        logger.warning(f"Async database engine for '{db_name}' not found")
+        return None
+    
+    return async_db_engines[db_name]
+
+def _to_async_url(db_url: str) -> URL:
+    """Convert a configured (sync) PostgreSQL URL to its asyncpg equivalent."""
+    url = make_url(db_url).set(drivername="postgresql+asyncpg")
+    # asyncpg does not understand libpq's sslmode; it takes the same values as 'ssl'
+    if "sslmode" in url.query:
+        sslmode = url.query["sslmode"]
+        url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": sslmode})
+    return url
+
 def create_db_engines():
     """Create database engines for all configured databases."""
     global db_engines
@@ -65,6 +93,31 @@ def create_db_engines():
             
         except Exception as e:
             logger.error(f"Failed to create database engine for '{db_name}': {str(e)}")
+            continue
+        
+        # Async engine for request-path queries. Connections are opened lazily on first use.
+        try:
+            async_db_engines[db_name] = create_async_engine(
+                _to_async_url(db_url),
+                pool_size=5,
+                max_overflow=10,
+                pool_timeout=30,
+                pool_recycle=1800,
+                pool_pre_ping=True,
+                echo=settings.DEBUG,
+            )
+            logger.info(f"Created async database engine for '{db_name}'")
+        except Exception as e:
+            logger.error(f"Failed to create async database engine for '{db_name}': {str(e)}")
+
+async def dispose_async_engines():
+    """Close all pooled connections of the async engines (called on application shutdown)."""
+    for db_name, engine in async_db_engines.items():
+        try:
+            await engine.dispose()
+            logger.info(f"Disposed async database engine for '{db_name}'")
+        except Exception as e:
+            logger.warning(f"Error disposing async database engine for '{db_name}': {str(e)}")
 
 def get_table_metadata(db_name: str) -> Dict[str, List[Dict]]:
     """Get metadata about tables in a database.
@@ -0,0 +1,389 @@
+"""
+Offline index advisor for the SQL tool's workload log (SQL_QUERY_LOG_PATH).
+
+Aggregates logged executions into composite index candidates per table (equality columns first,
+then join/GROUP BY columns, then one range column), drops candidates already covered by an existing
+index, estimates each one's benefit with hypothetical indexes (HypoPG) when the extension is
+installed, and can write an Alembic migration that builds the chosen indexes concurrently.
+
+Usage:
+    python -m app.db.index_advisor [--log logs/sql_queries.jsonl] [--db report_management]
+                                   [--top 5] [--min-calls 5] [--no-explain] [--write-migration]
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import re
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MAX_INDEX_COLUMNS = 4
+# Columns that lead every candidate when filtered on: all queries are scoped to one organization
+LEADING_COLUMNS = ("organizationId",)
+# Executions with these outcomes reflect real (or attempted) database work
+COUNTED_STATUSES = ("ok", "timeout", "rejected")
+SAMPLES_PER_CANDIDATE = 5
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / "migrations" / "versions"
+
+
+# --- Workload aggregation ---
+
+def load_records(path: str) -> List[Dict[str, Any]]:
+    """Read a JSONL query log and its rotated siblings (path.1, path.2, ...)."""
+    records = []
+    for file_path in sorted(glob.glob(path) + glob.glob(f"{path}.[0-9]*")):
+        with open(file_path, encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+
+def _split(column: str) -> Tuple[str, str]:
+    table, _, name = column.partition(".")
+    return table, name
+
+
+def candidates_for(record: Dict[str, Any]) -> List[Tuple[str, Tuple[str, ...]]]:
+    """Composite index candidates (table, columns) that would serve one logged query."""
+    by_table: Dict[str, Dict[str, List[str]]] = {}
+    for kind in ("where_eq", "join", "group_by", "where_range"):
+        for column in record.get(kind) or []:
+            table, name = _split(column)
+            columns = by_table.setdefault(table, {"where_eq": [], "join": [], "group_by": [], "where_range": []})[kind]
+            if name not in columns:
+                columns.append(name)
+
+    candidates = []
+    for table, usage in by_table.items():
+        if not usage["where_eq"] and not usage["where_range"]:
+            continue  # Without a filter on this table an index only helps joins; leave those to primary keys
+        equality = sorted(usage["where_eq"], key=lambda name: (name not in LEADING_COLUMNS, usage["where_eq"].index(name)))
+        columns = list(equality)
+        for name in usage["join"] + usage["group_by"]:
+            if name not in columns:
+                columns.append(name)
+        range_columns = [name for name in usage["where_range"] if name not in columns]
+        if range_columns:
+            columns = columns[:MAX_INDEX_COLUMNS - 1] + range_columns[:1]
+        candidates.append((table, tuple(columns[:MAX_INDEX_COLUMNS])))
+    return candidates
+
+
+def aggregate(records: Iterable[Dict[str, Any]], db_name: str, min_calls: int) -> List[Dict[str, Any]]:
+    """Group logged executions by index candidate, ranked by total latency.
+
+    A candidate whose columns are a prefix of another candidate on the same table is merged into
+    the longer one, since that index serves both.
+    """
+    candidates: Dict[Tuple[str, Tuple[str, ...]], Dict[str, Any]] = {}
+    for record in records:
+        if record.get("db") != db_name or record.get("status") not in COUNTED_STATUSES:
+            continue
+        for table, columns in candidates_for(record):
+            entry = candidates.setdefault((table, columns), {
+                "table": table, "columns": columns, "calls": 0, "total_ms": 0.0, "fingerprints": set(), "samples": [],
+            })
+            entry["calls"] += 1
+            entry["total_ms"] += float(record.get("latency_ms") or 0)
+            entry["fingerprints"].add(record.get("fingerprint"))
+            if record.get("template") and record.get("fingerprint") not in {s["fingerprint"] for s in entry["samples"]}:
+                entry["samples"].append(record)
+
+    merged = sorted(candidates.values(), key=lambda c: len(c["columns"]), reverse=True)
+    result: List[Dict[str, Any]] = []
+    for candidate in merged:
+        covering = next((
+            c for c in result
+            if c["table"] == candidate["table"] and c["columns"][:len(candidate["columns"])] == candidate["columns"]
+        ), None)
+        if covering is None:
+            result.append(candidate)
+            continue
+        covering["calls"] += candidate["calls"]
+        covering["total_ms"] += candidate["total_ms"]
+        covering["fingerprints"] |= candidate["fingerprints"]
+        covering["samples"].extend(candidate["samples"])
+
+    for candidate in result:
+        candidate["samples"] = sorted(candidate["samples"], key=lambda r: float(r.get("latency_ms") or 0), reverse=True)[:SAMPLES_PER_CANDIDATE]
+    return sorted((c for c in result if c["calls"] >= min_calls), key=lambda c: c["total_ms"], reverse=True)
+
+
+# --- Database checks ---
+
+def existing_indexes(conn: Connection, table: str) -> List[Tuple[str, ...]]:
+    """Key columns of every index on a table, in index order."""
+    rows = conn.execute(text(
+        "SELECT array_agg(a.attname ORDER BY k.ord) FROM pg_index i "
+        "CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord) "
+        "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum "
+        "WHERE i.indrelid = to_regclass(:table) GROUP BY i.indexrelid"
+    ), {"table": f'"{table}"'}).scalars().all()
+    return [tuple(columns) for columns in rows]
+
+
+def _leaf_relations(conn: Connection, table: str) -> List[str]:
+    kind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": f'"{table}"'}).scalar()
+    if kind != "p":
+        return [f'"{table}"']
+    return conn.execute(text(
+        "SELECT relid::regclass::text FROM pg_partition_tree(to_regclass(:table)) WHERE isleaf"
+    ), {"table": f'"{table}"'}).scalars().all()
+
+
+def _plan_cost(conn: Connection, record: Dict[str, Any]) -> Optional[float]:
+    try:
+        with conn.begin_nested():
+            plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {record['template']}"), record.get("params") or {}).scalar()
+    except Exception as e:
+        logger.debug(f"Could not EXPLAIN sample {record.get('fingerprint')}: {str(e)}")
+        return None
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return float(plan[0]["Plan"]["Total Cost"])
+
+
+def hypopg_available(conn: Connection) -> bool:
+    return bool(conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'")).scalar())
+
+
+def estimate_benefit(conn: Connection, candidate: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Planner cost of the candidate's sample queries without and with a hypothetical index.
+
+    Partitioned tables get one hypothetical index per leaf partition, which is what the planner
+    would use once the real partitioned index exists.
+    """
+    samples = candidate["samples"]
+    before = [_plan_cost(conn, record) for record in samples]
+    if not any(cost is not None for cost in before):
+        return None
+    column_list = ", ".join(f'"{c}"' for c in candidate["columns"])
+    try:
+        with conn.begin_nested():
+            for relation in _leaf_relations(conn, candidate["table"]):
+                conn.execute(text("SELECT * FROM hypopg_create_index(:statement)"), {"statement": f"CREATE INDEX ON {relation} ({column_list})"})
+            after = [_plan_cost(conn, record) for record in samples]
+            conn.execute(text("SELECT hypopg_reset()"))
+    except Exception as e:
+        logger.warning(f"Hypothetical index on \"{candidate['table']}\" failed: {str(e)}")
+        return None
+    pairs = [(b, a) for b, a in zip(before, after) if b is not None and a is not None]
+    cost_before = sum(b for b, _ in pairs)
+    cost_after = sum(a for _, a in pairs)
+    return {
+        "samples": len(pairs),
+        "cost_before": round(cost_before, 2),
+        "cost_after": round(cost_after, 2),
+        "improvement": round(1 - cost_after / cost_before, 4) if cost_before else 0.0,
+    }
+
+
+# --- Migration output ---
+
+def index_name(table: str, columns: Tuple[str, ...]) -> str:
+    """Deterministic index name within PostgreSQL's 63-character limit."""
+    name = f"{table}_{'_'.join(columns)}_idx"
+    if len(name) <= 63:
+        return name
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+    return f"{name[:50]}_{digest}_idx"
+
+
+def _revisions(versions_dir: Path) -> Tuple[str, Optional[str]]:
+    """Next numeric revision id and the current head revision."""
+    revisions, parents = set(), set()
+    for path in versions_dir.glob("*.py"):
+        source = path.read_text(encoding="utf-8")
+        revision = re.search(r'^revision = "(\w+)"', source, re.MULTILINE)
+        parent = re.search(r'^down_revision = "(\w+)"', source, re.MULTILINE)
+        if revision:
+            revisions.add(revision.group(1))
+        if parent:
+            parents.add(parent.group(1))
+    heads = sorted(revisions - parents)
+    numbers = [int(r) for r in revisions if r.isdigit()]
+    return f"{max(numbers, default=0) + 1:04d}", (heads[-1] if heads else None)
+
+
+MIGRATION_TEMPLATE = '''"""Indexes proposed by app.db.index_advisor
+
+{report}
+
+Revision ID: {revision}
+Revises: {down_revision}
+Create Date: {created}
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = {revision!r}
+down_revision = {down_revision!r}
+branch_labels = None
+depends_on = None
+
+# (index name, table, columns)
+INDEXES = [
+{indexes}
+]
+
+
+def _is_partitioned(conn, table: str) -> bool:
+    kind = conn.execute(sa.text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {{"table": f'"{{table}}"'}}).scalar()
+    return kind == "p"
+
+
+def _create(conn, name: str, table: str, columns) -> None:
+    column_list = ", ".join(f'"{{c}}"' for c in columns)
+    if not _is_partitioned(conn, table):
+        op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{{name}}" ON "{{table}}" ({{column_list}})')
+        return
+    # CONCURRENTLY is not supported on a partitioned parent: create it invalid ON ONLY the parent,
+    # build each partition's index concurrently and attach it; the parent becomes valid once all are attached
+    op.execute(f'CREATE INDEX IF NOT EXISTS "{{name}}" ON ONLY "{{table}}" ({{column_list}})')
+    partitions = conn.execute(sa.text(
+        "SELECT relid::regclass::text FROM pg_partition_tree(to_regclass(:table)) WHERE isleaf"
+    ), {{"table": f'"{{table}}"'}}).scalars().all()
+    for partition in partitions:
+        suffix = hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+        partition_index = f'{{partition.strip(chr(34))[:50]}}_{{suffix}}_idx'
+        op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{{partition_index}}" ON {{partition}} ({{column_list}})')
+        op.execute(f'ALTER INDEX "{{name}}" ATTACH PARTITION "{{partition_index}}"')
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            _create(conn, name, table, columns)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            # Dropping a partitioned index drops its attached partition indexes; that cannot be concurrent
+            concurrently = "" if _is_partitioned(conn, table) else "CONCURRENTLY "
+            op.execute(f'DROP INDEX {{concurrently}}IF EXISTS "{{name}}"')
+'''
+
+
+def render_migration(candidates: List[Dict[str, Any]], revision: str, down_revision: Optional[str]) -> str:
+    """Source of an Alembic migration creating the candidates' indexes."""
+    report = "\n".join(
+        f"- {index_name(c['table'], c['columns'])}: {c['calls']} calls, {c['total_ms']:.0f} ms total"
+        + (f", estimated plan cost -{c['benefit']['improvement']:.0%}" if c.get("benefit") else "")
+        for c in candidates
+    )
+    indexes = "\n".join(
+        f"    ({index_name(c['table'], c['columns'])!r}, {c['table']!r}, {tuple(c['columns'])!r}),"
+        for c in candidates
+    )
+    return MIGRATION_TEMPLATE.format(
+        report=report,
+        revision=revision,
+        down_revision=down_revision,
+        created=datetime.now(timezone.utc).date().isoformat(),
+        indexes=indexes,
+    )
+
+
+# --- CLI ---
+
+def _database_url(db_name: str) -> Optional[str]:
+    for server in settings.POSTGRES_SERVERS:
+        if server["name"] == db_name:
+            return server["url"]
+    return None
+
+
+def advise(log_path: str, db_name: str, top: int, min_calls: int, explain: bool) -> List[Dict[str, Any]]:
+    """Build the ranked list of index proposals for a database."""
+    records = load_records(log_path)
+    candidates = aggregate(records, db_name, min_calls)
+    logger.info(f"Read {len(records)} logged queries, {len(candidates)} index candidates for '{db_name}'")
+
+    url = _database_url(db_name)
+    if not url:
+        logger.warning(f"Database '{db_name}' is not configured in DATABASE_URLS; skipping existing-index checks and EXPLAIN")
+        return candidates[:top]
+
+    engine = create_engine(url)
+    proposals = []
+    try:
+        with engine.connect() as conn:
+            use_hypopg = explain and hypopg_available(conn)
+            if explain and not use_hypopg:
+                logger.warning("HypoPG is not installed (CREATE EXTENSION hypopg); benefits will not be estimated")
+            for candidate in candidates:
+                existing = existing_indexes(conn, candidate["table"])
+                if any(columns[:len(candidate["columns"])] == candidate["columns"] for columns in existing):
+                    continue
+                if use_hypopg:
+                    candidate["benefit"] = estimate_benefit(conn, candidate)
+                    if candidate["benefit"] and candidate["benefit"]["improvement"] <= 0:
+                        continue  # The planner would not use it
+                proposals.append(candidate)
+                if len(proposals) >= top:
+                    break
+            conn.rollback()
+    finally:
+        engine.dispose()
+    return proposals
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Propose indexes from the SQL tool's query log.")
+    parser.add_argument("--log", default=settings.SQL_QUERY_LOG_PATH, help="JSONL query log (rotated files are included)")
+    parser.add_argument("--db", default="report_management", help="Database name from DATABASE_URLS")
+    parser.add_argument("--top", type=int, default=5, help="Maximum number of indexes to propose")
+    parser.add_argument("--min-calls", type=int, default=5, help="Ignore candidates used by fewer logged executions")
+    parser.add_argument("--no-explain", action="store_true", help="Do not estimate benefits with HypoPG")
+    parser.add_argument("--write-migration", action="store_true", help="Write an Alembic migration for the proposals")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    if not args.log:
+        parser.error("No query log configured (SQL_QUERY_LOG_PATH is empty); pass --log")
+
+    proposals = advise(args.log, args.db, args.top, args.min_calls, explain=not args.no_explain)
+    if not proposals:
+        print("No index proposals.")
+        return 0
+
+    for candidate in proposals:
+        benefit = candidate.get("benefit")
+        estimate = (
+            f"plan cost {benefit['cost_before']} -> {benefit['cost_after']} ({benefit['improvement']:.0%} lower, {benefit['samples']} samples)"
+            if benefit else "benefit not estimated"
+        )
+        columns = ", ".join(f'"{c}"' for c in candidate["columns"])
+        print(f'"{candidate["table"]}" ({columns}): {candidate["calls"]} calls, {len(candidate["fingerprints"])} query shapes, '
+              f'{candidate["total_ms"]:.0f} ms total; {estimate}')
+
+    if args.write_migration:
+        revision, down_revision = _revisions(MIGRATIONS_DIR)
+        path = MIGRATIONS_DIR / f"{revision}_advisor_indexes.py"
+        path.write_text(render_migration(proposals, revision, down_revision), encoding="utf-8")
+        print(f"Wrote {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""
+Monthly range partitions of the event tables "5" and "8" (see migrations/versions/0001).
+
+`PartitionMaintainer` keeps PARTITION_MONTHS_AHEAD future months created and detaches months older
+than PARTITION_RETENTION_MONTHS (moving them to PARTITION_ARCHIVE_SCHEMA, or dropping them); the
+pre-migration "<table>_legacy" partition is detached once all of it is older.
+`apply_default_time_window` makes sure generated SQL against these tables always carries an
+"eventTimestamp" bound, so the planner can prune old partitions.
+"""
+import asyncio
+import logging
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import sqlparse
+from sqlparse import sql as sql_tokens
+from sqlparse import tokens as token_types
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.config import settings
+from app.db.connection import get_async_db_engine
+from app.db.sql_parsing import table_references, walk
+
+logger = logging.getLogger(__name__)
+
+PARTITION_DATABASE = "report_management"
+PARTITIONED_TABLES = ("5", "8")
+PARTITION_KEY = "eventTimestamp"
+
+# Bind parameter added by apply_default_time_window
+WINDOW_START_PARAM = "partition_window_start"
+
+# Arbitrary application-wide key for pg_try_advisory_xact_lock, so only one worker maintains partitions
+_ADVISORY_LOCK_KEY = 716_504_202
+
+_BOUNDS = re.compile(r"FOR VALUES FROM \((?P<lower>[^)]*)\) TO \((?P<upper>[^)]*)\)")
+
+
+# --- Partition maintenance ---
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _add_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + (day.month - 1) + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    """Name of a monthly partition, e.g. "5_p202501"."""
+    return f"{table}_p{month:%Y%m}"
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    value = value.strip().strip("'")
+    if value.upper() in ("MINVALUE", "MAXVALUE"):
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+class PartitionMaintainer:
+    """Creates upcoming monthly partitions and retires expired ones in the background."""
+
+    def __init__(self, interval_seconds: float, months_ahead: int, retention_months: int, archive_schema: str):
+        """Create the maintainer.
+
+        Args:
+            interval_seconds: Time between maintenance runs
+            months_ahead: Number of future months that must always have a partition
+            retention_months: Detach monthly partitions that ended more than this many months ago (0 = keep all)
+            archive_schema: Schema detached partitions are moved to, or "" to drop them
+        """
+        self.interval_seconds = interval_seconds
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.archive_schema = archive_schema
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.failures = 0
+        self.created: List[str] = []
+        self.retired: List[str] = []
+
+    async def _partitions(self, conn: AsyncConnection, table: str) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+        rows = (await conn.execute(
+            text(
+                "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = CAST(:table AS regclass)"
+            ),
+            {"table": f'"{table}"'},
+        )).fetchall()
+        partitions = []
+        for name, bound in rows:
+            match = _BOUNDS.search(bound or "")
+            if match:  # The DEFAULT partition has no range
+                partitions.append((name, _parse_bound(match.group("lower")), _parse_bound(match.group("upper"))))
+        return partitions
+
+    async def _is_partitioned(self, conn: AsyncConnection, table: str) -> bool:
+        kind = (await conn.execute(
+            text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": f'"{table}"'}
+        )).scalar()
+        return kind == "p"
+
+    async def _create_future_partitions(self, conn: AsyncConnection, table: str, today: date) -> None:
+        existing = await self._partitions(conn, table)
+        for offset in range(self.months_ahead + 1):
+            start = _add_months(_month_start(today), offset)
+            end = _add_months(start, 1)
+            lower = datetime.combine(start, datetime.min.time(), tzinfo=timezone.utc)
+            upper = datetime.combine(end, datetime.min.time(), tzinfo=timezone.utc)
+            # Skip months already covered, e.g. by the legacy partition that ends at the migration cutover
+            if any((low is None or low < upper) and (high is None or high > lower) for _, low, high in existing):
+                continue
+            name = partition_name(table, start)
+            try:
+                async with conn.begin_nested():
+                    await conn.execute(text(
+                        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" '
+                        f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+                    ))
+                self.created.append(name)
+                logger.info(f"Created partition {name}")
+            except Exception as e:
+                # Usually rows for that month already landed in the DEFAULT partition
+                logger.error(f"Could not create partition {name}: {str(e)}")
+
+    async def _retire_old_partitions(self, conn: AsyncConnection, table: str, today: date) -> None:
+        if self.retention_months <= 0:
+            return
+        cutoff = datetime.combine(_add_months(_month_start(today), -self.retention_months), datetime.min.time(), tzinfo=timezone.utc)
+        # The legacy partition of migration 0001 holds all older history and is retired as a whole
+        retirable = re.compile(rf"^{re.escape(table)}_(?:p\d{{6}}|legacy)$")
+        for name, _, upper in await self._partitions(conn, table):
+            if not retirable.match(name) or upper is None or upper > cutoff:
+                continue
+            await conn.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+            if self.archive_schema:
+                await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{self.archive_schema}"'))
+                await conn.execute(text(f'ALTER TABLE "{name}" SET SCHEMA "{self.archive_schema}"'))
+                logger.info(f"Detached partition {name} into schema {self.archive_schema}")
+            else:
+                await conn.execute(text(f'DROP TABLE "{name}"'))
+                logger.info(f"Detached and dropped partition {name}")
+            self.retired.append(name)
+
+    async def run_once(self) -> None:
+        """Create and retire partitions of every partitioned table (one transaction per table)."""
+        engine = get_async_db_engine(PARTITION_DATABASE)
+        if not engine:
+            return
+        today = datetime.now(timezone.utc).date()
+        for table in PARTITIONED_TABLES:
+            async with engine.begin() as conn:
+                if not await self._is_partitioned(conn, table):
+                    logger.warning(f"Table \"{table}\" is not partitioned, run the alembic migrations first")
+                    continue
+                locked = (await conn.execute(text("SELECT pg_try_advisory_xact_lock(:key, :table)"),
+                                             {"key": _ADVISORY_LOCK_KEY, "table": int(table)})).scalar()
+                if not locked:
+                    continue
+                await self._create_future_partitions(conn, table, today)
+                await self._retire_old_partitions(conn, table, today)
+        self.runs += 1
+
+    async def _run_periodically(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Partition maintenance failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.interval_seconds)
+
+    async def start(self) -> None:
+        """Start the background maintenance task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_periodically())
+
+    async def stop(self) -> None:
+        """Stop the background maintenance task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the maintenance counters."""
+        return {
+            "enabled": settings.PARTITION_MAINTENANCE_ENABLED,
+            "runs": self.runs,
+            "failures": self.failures,
+            "created": self.created[-10:],
+            "retired": self.retired[-10:],
+        }
+
+
+# --- Partition pruning enforcement ---
+
+def _is_partition_key(token: Any) -> bool:
+    return isinstance(token, sql_tokens.Identifier) and token.get_real_name() == PARTITION_KEY
+
+
+def _conjuncts(tokens: List[sql_tokens.Token]) -> List[sql_tokens.Token]:
+    """Conditions AND-ed at this level, descending into parenthesized groups of AND-ed conditions.
+
+    A level that contains OR yields nothing (none of its conditions restricts the rows on its own),
+    and neither does a group negated with NOT or a subquery.
+    """
+    conditions = [token for token in tokens if not token.is_whitespace and token.ttype is not token_types.Punctuation]
+    if any(token.ttype is token_types.Keyword and token.normalized == "OR" for token in conditions):
+        return []
+    flattened: List[sql_tokens.Token] = []
+    for index, token in enumerate(conditions):
+        if isinstance(token, sql_tokens.Parenthesis):
+            negated = index > 0 and conditions[index - 1].normalized == "NOT"
+            if not negated and not any(t.ttype is token_types.DML for t in token.tokens):
+                flattened.extend(_conjuncts(token.tokens))
+        else:
+            flattened.append(token)
+    return flattened
+
+
+def _bound_qualifiers(statement: sql_tokens.Statement) -> List[Optional[str]]:
+    """Qualifiers (alias or None) of "eventTimestamp" columns with a lower or upper bound in a WHERE clause.
+
+    Only AND-ed conditions of a WHERE count, also inside parentheses; a bound inside OR, NOT, CASE or
+    the SELECT list does not restrict the rows scanned. An upper bound alone ("before 2024") counts
+    too: adding a default lower bound would change the answer to the question asked.
+    """
+    qualifiers: List[Optional[str]] = []
+    wheres = [token for token in walk(statement) if isinstance(token, sql_tokens.Where)]
+    for where in wheres:
+        conditions = _conjuncts(where.tokens)
+        for index, token in enumerate(conditions):
+            if isinstance(token, sql_tokens.Comparison):
+                operator = next((t.value for t in token.tokens if t.ttype is token_types.Operator.Comparison), None)
+                if operator not in ("<", "<=", ">", ">=", "="):
+                    continue
+                if _is_partition_key(token.left):
+                    qualifiers.append(token.left.get_parent_name())
+                elif _is_partition_key(token.right):
+                    qualifiers.append(token.right.get_parent_name())
+            elif _is_partition_key(token) and index + 1 < len(conditions) and conditions[index + 1].normalized == "BETWEEN":
+                qualifiers.append(token.get_parent_name())
+    return qualifiers
+
+
+def apply_default_time_window(sql: str, parameters: Dict[str, Any], window_days: int, now: Optional[datetime] = None) -> Tuple[str, Dict[str, Any], Optional[datetime]]:
+    """Restrict partitioned tables that have no "eventTimestamp" bound to a default window.
+
+    Each unbounded reference such as `FROM "5" e` becomes
+    `FROM (SELECT * FROM "5" WHERE "eventTimestamp" >= :partition_window_start) e`, which PostgreSQL
+    flattens, so the bound reaches the partition pruner without touching the rest of the query.
+
+    Args:
+        sql: Validated SQL
+        parameters: Its bind parameters
+        window_days: Size of the default window in days (0 disables it)
+        now: Current time, defaults to datetime.now(timezone.utc)
+
+    Returns:
+        Tuple of (sql, parameters, window start or None if nothing was added)
+    """
+    if window_days <= 0:
+        return sql, parameters, None
+    statements = sqlparse.parse(sql)
+    if len(statements) != 1:
+        return sql, parameters, None
+    statement = statements[0]
+
+    bounded = _bound_qualifiers(statement)
+    unbounded = [
+        reference for reference in table_references(statement, PARTITIONED_TABLES)
+        if None not in bounded and (reference.get_alias() or reference.get_real_name()) not in bounded
+    ]
+    if not unbounded:
+        return sql, parameters, None
+
+    # Midnight-aligned so repeated queries within a day share plans and cache entries
+    current = now or datetime.now(timezone.utc)
+    window_start = datetime.combine(current.date() - timedelta(days=window_days), datetime.min.time(), tzinfo=timezone.utc)
+    for reference in unbounded:
+        table = reference.get_real_name()
+        name_token = next(t for t in reference.tokens if not t.is_whitespace)
+        subquery = f'(SELECT * FROM "{table}" WHERE "{PARTITION_KEY}" >= :{WINDOW_START_PARAM})'
+        name_token.value = subquery if reference.get_alias() else f'{subquery} AS "{table}"'
+    rewritten = "".join(token.value for token in statement.flatten())
+    return rewritten, {**parameters, WINDOW_START_PARAM: window_start}, window_start
+
+
+partition_maintainer = PartitionMaintainer(
+    interval_seconds=settings.PARTITION_MAINTENANCE_INTERVAL_SECONDS,
+    months_ahead=settings.PARTITION_MONTHS_AHEAD,
+    retention_months=settings.PARTITION_RETENTION_MONTHS,
+    archive_schema=settings.PARTITION_ARCHIVE_SCHEMA,
+)
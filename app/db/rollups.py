@@ -0,0 +1,399 @@
+"""
+Hourly and daily rollups of the event tables "5" and "8".
+
+Each rollup table holds, per (organizationId, hierarchyId, UTC bucket), the SUM of every numeric
+event column plus the number of raw rows. Rollups are refreshed incrementally: raw rows whose
+"updatedAt" is newer than the stored watermark mark their (organization, hour) buckets as changed,
+and only those buckets are recomputed. Daily rollups are recomputed from the hourly ones.
+
+`rewrite_for_rollups` transparently routes generated SUM queries to a rollup table when the rewrite
+is provably equivalent (see its docstring); everything else keeps reading the raw tables.
+"""
+import asyncio
+import logging
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.config import settings
+from app.db.connection import get_async_db_engine
+from app.db.schema_definitions import (
+    ROLLUP_DATABASE,
+    ROLLUP_GRANULARITIES,
+    ROLLUP_SOURCE_TABLES,
+    SCHEMA_DEFINITIONS,
+    rollup_metric_columns,
+    rollup_table_name,
+)
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_TABLE = "rollupWatermarks"
+
+# Arbitrary application-wide key for pg_try_advisory_xact_lock, so only one worker refreshes at a time
+_ADVISORY_LOCK_KEY = 716_504_201
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _utc_bucket(expression: str, unit: str) -> str:
+    # Buckets are aligned in UTC regardless of the session time zone
+    return f"date_trunc('{unit}', {expression} AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+
+
+# --- DDL ---
+
+def rollup_ddl() -> List[str]:
+    """CREATE statements for the rollup tables, their indexes and the watermark table (idempotent)."""
+    statements = [
+        f'CREATE TABLE IF NOT EXISTS {_quote(WATERMARK_TABLE)} ('
+        f'"sourceTable" text PRIMARY KEY, "watermark" timestamptz NOT NULL, "refreshedAt" timestamptz NOT NULL)'
+    ]
+    for source in ROLLUP_SOURCE_TABLES:
+        metrics = ", ".join(f"{_quote(name)} bigint" for name in rollup_metric_columns(source))
+        for granularity in ROLLUP_GRANULARITIES:
+            table = rollup_table_name(source, granularity)
+            statements.append(
+                f'CREATE TABLE IF NOT EXISTS {_quote(table)} ('
+                f'"organizationId" uuid NOT NULL, "hierarchyId" uuid, "bucket" timestamptz NOT NULL, {metrics}, '
+                f'"eventCount" bigint NOT NULL DEFAULT 0, "refreshedAt" timestamptz NOT NULL DEFAULT now())'
+            )
+            statements.append(
+                f'CREATE INDEX IF NOT EXISTS {_quote(table + "_org_bucket_idx")} '
+                f'ON {_quote(table)} ("organizationId", "bucket", "hierarchyId")'
+            )
+    return statements
+
+
+# --- Incremental refresh ---
+
+def refresh_statements(source: str) -> List[str]:
+    """Statements that recompute the changed buckets of one source table.
+
+    They expect the bind parameters :since and :until (the updatedAt window) and must run in one
+    transaction, since they share the temporary table of changed buckets.
+    """
+    metrics = rollup_metric_columns(source)
+    metric_list = ", ".join(_quote(name) for name in metrics)
+    hourly = _quote(rollup_table_name(source, "hourly"))
+    daily = _quote(rollup_table_name(source, "daily"))
+    changed_at = 'COALESCE("updatedAt", "createdAt", "eventTimestamp")'
+    return [
+        # Buckets touched by rows written since the last refresh
+        f'CREATE TEMP TABLE rollup_changed ON COMMIT DROP AS '
+        f'SELECT DISTINCT "organizationId", {_utc_bucket(chr(34) + "eventTimestamp" + chr(34), "hour")} AS "bucket" '
+        f'FROM {_quote(source)} WHERE {changed_at} > :since AND {changed_at} <= :until AND "organizationId" IS NOT NULL',
+        f'DELETE FROM {hourly} r USING rollup_changed c WHERE r."organizationId" = c."organizationId" AND r."bucket" = c."bucket"',
+        f'INSERT INTO {hourly} ("organizationId", "hierarchyId", "bucket", {metric_list}, "eventCount", "refreshedAt") '
+        f'SELECT s."organizationId", s."hierarchyId", c."bucket", '
+        + ", ".join(f'SUM(s.{_quote(name)})' for name in metrics)
+        + f', COUNT(*), now() FROM {_quote(source)} s JOIN rollup_changed c '
+        f'ON s."organizationId" = c."organizationId" AND s."eventTimestamp" >= c."bucket" '
+        f'AND s."eventTimestamp" < c."bucket" + INTERVAL \'1 hour\' '
+        f'GROUP BY s."organizationId", s."hierarchyId", c."bucket"',
+        f'CREATE TEMP TABLE rollup_changed_days ON COMMIT DROP AS '
+        f'SELECT DISTINCT "organizationId", {_utc_bucket(chr(34) + "bucket" + chr(34), "day")} AS "bucket" FROM rollup_changed',
+        f'DELETE FROM {daily} r USING rollup_changed_days c WHERE r."organizationId" = c."organizationId" AND r."bucket" = c."bucket"',
+        f'INSERT INTO {daily} ("organizationId", "hierarchyId", "bucket", {metric_list}, "eventCount", "refreshedAt") '
+        f'SELECT h."organizationId", h."hierarchyId", c."bucket", '
+        + ", ".join(f'SUM(h.{_quote(name)})' for name in metrics)
+        + f', SUM(h."eventCount"), now() FROM {hourly} h JOIN rollup_changed_days c '
+        f'ON h."organizationId" = c."organizationId" AND h."bucket" >= c."bucket" '
+        f'AND h."bucket" < c."bucket" + INTERVAL \'1 day\' '
+        f'GROUP BY h."organizationId", h."hierarchyId", c."bucket"',
+    ]
+
+
+# --- Query rewriting ---
+
+_EVENT_TABLE_REF = re.compile(
+    r'\b(?P<kw>FROM|JOIN)\s+"(?P<table>5|8)"(?!\s*\.)'
+    r'(?:\s+(?:AS\s+)?(?P<alias>"[^"]+"|(?!(?:WHERE|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|ON|GROUP|ORDER|LIMIT|USING)\b)[A-Za-z_]\w*))?',
+    re.IGNORECASE,
+)
+_TABLE_REF = re.compile(r'\b(?:FROM|JOIN)\s+("[^"]+"|[A-Za-z_][\w.]*)', re.IGNORECASE)
+_UNSUPPORTED = re.compile(
+    r"\b(WITH|UNION|INTERSECT|EXCEPT|OVER|DISTINCT|COUNT|AVG|MIN|MAX|STDDEV\w*|VARIANCE|VAR_\w+|ARRAY_AGG|STRING_AGG|JSON\w*_AGG|PERCENTILE_\w+|MODE)\b",
+    re.IGNORECASE,
+)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_OUTPUT_ALIAS = re.compile(r'\bAS\s+"[^"]*"', re.IGNORECASE)
+_BOUND_PREDICATE = re.compile(r'(?:(?P<q>"[^"]+"|\w+)\.)?"eventTimestamp"\s*(?P<op>>=|<)\s*:(?P<param>\w+)')
+_DATE_TRUNC = re.compile(r"\bDATE_TRUNC\s*\(\s*'(?P<unit>\w+)'\s*,\s*(?:(?:\"[^\"]+\"|\w+)\.)?\"eventTimestamp\"\s*\)", re.IGNORECASE)
+_QUALIFIED_IDENTIFIER = re.compile(r'(?P<q>"[^"]+"|\b[A-Za-z_]\w*)\s*\.\s*(?P<col>"[^"]+"|[A-Za-z_]\w*)')
+_QUOTED_IDENTIFIER = re.compile(r'"([^"]+)"')
+
+# Event-table columns a rollup can stand in for (besides SUMs of metrics and the eventTimestamp bounds)
+_ROLLUP_KEY_COLUMNS = {"organizationId", "hierarchyId"}
+_HOURLY_TRUNC_UNITS = {"hour", "day", "week", "month", "quarter", "year"}
+
+
+# Tables a routed query may join besides the event table (hierarchy names and the closure of the tree)
+_HIERARCHY_TABLES = ("hierarchyCaches", "hierarchyClosure")
+
+
+def _hierarchy_columns() -> set:
+    tables = SCHEMA_DEFINITIONS[ROLLUP_DATABASE]["tables"]
+    return {column["name"] for table in _HIERARCHY_TABLES if table in tables for column in tables[table]["columns"]}
+
+
+def _is_aligned(value: Any, unit: str) -> bool:
+    if not isinstance(value, datetime) or value.tzinfo is None:
+        return False
+    utc = value.astimezone(timezone.utc)
+    if utc.minute or utc.second or utc.microsecond:
+        return False
+    return unit == "hour" or utc.hour == 0
+
+
+def rewrite_for_rollups(sql: str, parameters: Dict[str, Any], fresh_sources: Iterable[str] = ROLLUP_SOURCE_TABLES) -> Optional[str]:
+    """Route a SUM aggregate over "5" or "8" to the matching rollup table, or return None.
+
+    The rewrite is deliberately conservative. It applies only when:
+      * the query reads exactly one event table (optionally joined to "hierarchyCaches" and/or
+        "hierarchyClosure", e.g. for everything under a library system) and no CTEs,
+        set operations, window functions or non-SUM aggregates,
+      * every numeric event column is used only inside SUM(...), and the only other event-table
+        columns are "organizationId" and "hierarchyId",
+      * "eventTimestamp" is used only as `>= :param` / `< :param` bounds (whose bound values are
+        UTC day- or hour-aligned) or inside DATE_TRUNC('hour'..'year', ...), which is exact on hourly
+        buckets as long as the session time zone has a whole-hour UTC offset.
+    The daily rollup is used when there is no DATE_TRUNC and all bounds are UTC-midnight aligned,
+    otherwise the hourly rollup if all bounds are hour-aligned.
+
+    Args:
+        sql: Generated SQL
+        parameters: Bind parameters of the SQL
+        fresh_sources: Source tables whose rollups are currently up to date
+
+    Returns:
+        Rewritten SQL, or None if the query is not eligible
+    """
+    statement = sql.strip().rstrip(";").strip()
+    references = list(_EVENT_TABLE_REF.finditer(statement))
+    if len(references) != 1:
+        return None
+    reference = references[0]
+    source = reference.group("table")
+    if source not in fresh_sources:
+        return None
+
+    # Any other table must be one of the hierarchy tables
+    other_tables = [t for t in _TABLE_REF.findall(statement) if t.strip('"') not in (source,)]
+    if any(t.strip('"') not in _HIERARCHY_TABLES or not t.startswith('"') for t in other_tables):
+        return None
+    if len(re.findall(r"\bSELECT\b", statement, re.IGNORECASE)) != 1 or _UNSUPPORTED.search(statement) or "*" in statement:
+        return None
+
+    event_alias = reference.group("alias") or f'"{source}"'
+    event_qualifiers = {event_alias.strip('"'), source}
+
+    # Work on a copy without literals and output aliases, removing every construct we can translate
+    probe = statement.replace(reference.group(0), f"{reference.group('kw')} ", 1)
+    trunc_units = {match.group("unit").lower() for match in _DATE_TRUNC.finditer(probe)}
+    if not trunc_units <= _HOURLY_TRUNC_UNITS:
+        return None
+    probe = _OUTPUT_ALIAS.sub(" ", _STRING_LITERAL.sub("''", _DATE_TRUNC.sub(" NULL ", probe)))
+
+    metrics = set(rollup_metric_columns(source))
+    sum_pattern = re.compile(r'\bSUM\s*\(\s*(?:(?P<q>"[^"]+"|\w+)\.)?"(?P<col>[^"]+)"\s*\)', re.IGNORECASE)
+    for match in sum_pattern.finditer(probe):
+        if match.group("col") not in metrics or (match.group("q") and match.group("q").strip('"') not in event_qualifiers):
+            return None
+    probe = sum_pattern.sub(" 0 ", probe)
+
+    bound_params = []
+    for match in _BOUND_PREDICATE.finditer(probe):
+        if match.group("q") and match.group("q").strip('"') not in event_qualifiers:
+            return None
+        bound_params.append(match.group("param"))
+    probe = _BOUND_PREDICATE.sub(" TRUE ", probe)
+
+
+    # Remaining column references must be rollup keys or hierarchy table columns
+    hierarchy_columns = _hierarchy_columns()
+    for match in _QUALIFIED_IDENTIFIER.finditer(probe):
+        qualifier, column = match.group("q").strip('"'), match.group("col").strip('"')
+        if qualifier in event_qualifiers:
+            if column not in _ROLLUP_KEY_COLUMNS:
+                return None
+        elif column not in hierarchy_columns:
+            return None
+    probe = _QUALIFIED_IDENTIFIER.sub(" ", probe)
+    for column in _QUOTED_IDENTIFIER.findall(probe):
+        if column in _HIERARCHY_TABLES:
+            continue
+        if column not in _ROLLUP_KEY_COLUMNS and (column not in hierarchy_columns or column in ("id", "createdAt", "updatedAt")):
+            return None
+    if re.search(r"(?<![.\w])id\b", probe):
+        return None
+
+    # Pick the coarsest rollup whose buckets align with the bounds
+    bounds = [parameters.get(name) for name in bound_params]
+    if not trunc_units and all(_is_aligned(value, "day") for value in bounds):
+        granularity = "daily"
+    elif all(_is_aligned(value, "hour") for value in bounds):
+        granularity = "hourly"
+    else:
+        return None
+
+    rollup = _quote(rollup_table_name(source, granularity))
+    rewritten = (
+        statement[:reference.start()]
+        + f"{reference.group('kw')} {rollup} AS {event_alias}"
+        + statement[reference.end():]
+    )
+    # Output aliases named "eventTimestamp" keep their name
+    return re.sub(r'(?<![Aa][Ss] )"eventTimestamp"', '"bucket"', rewritten)
+
+
+class RollupManager:
+    """Creates and refreshes the rollup tables, tracks their freshness and routes queries to them."""
+
+    def __init__(self, refresh_interval_seconds: float, lag_seconds: float, max_staleness_seconds: float):
+        """Create the manager.
+
+        Args:
+            refresh_interval_seconds: Time between incremental refreshes
+            lag_seconds: Rows are only rolled up once their updatedAt is this old (lets in-flight writes commit)
+            max_staleness_seconds: Queries are only routed to rollups refreshed at most this long ago
+        """
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.lag_seconds = lag_seconds
+        self.max_staleness_seconds = max_staleness_seconds
+        self.watermarks: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.last_refresh_seconds: Optional[float] = None
+        self.rewrites = 0
+        self.rewrite_skips = 0
+
+    async def ensure_tables(self, conn: AsyncConnection) -> None:
+        for statement in rollup_ddl():
+            await conn.execute(text(statement))
+
+    async def _refresh_source(self, conn: AsyncConnection, source: str) -> None:
+        row = (await conn.execute(
+            text(f'SELECT "watermark" FROM {_quote(WATERMARK_TABLE)} WHERE "sourceTable" = :source'), {"source": source}
+        )).first()
+        since = row[0] if row else datetime(1970, 1, 1, tzinfo=timezone.utc)
+        until = (await conn.execute(text("SELECT now() - make_interval(secs => :lag)"), {"lag": self.lag_seconds})).scalar()
+        if until <= since:
+            return
+        for statement in refresh_statements(source):
+            await conn.execute(text(statement), {"since": since, "until": until})
+        await conn.execute(
+            text(
+                f'INSERT INTO {_quote(WATERMARK_TABLE)} ("sourceTable", "watermark", "refreshedAt") VALUES (:source, :until, now()) '
+                f'ON CONFLICT ("sourceTable") DO UPDATE SET "watermark" = EXCLUDED."watermark", "refreshedAt" = EXCLUDED."refreshedAt"'
+            ),
+            {"source": source, "until": until},
+        )
+
+    async def _load_watermarks(self, conn: AsyncConnection) -> None:
+        rows = (await conn.execute(text(f'SELECT "sourceTable", "watermark" FROM {_quote(WATERMARK_TABLE)}'))).fetchall()
+        self.watermarks = {source: watermark for source, watermark in rows}
+
+    async def refresh(self) -> None:
+        """Refresh every source's rollups (one transaction per source) and reload the watermarks."""
+        engine = get_async_db_engine(ROLLUP_DATABASE)
+        if not engine:
+            return
+        started = time.perf_counter()
+        for source in ROLLUP_SOURCE_TABLES:
+            async with engine.begin() as conn:
+                locked = (await conn.execute(text("SELECT pg_try_advisory_xact_lock(:key, :source)"),
+                                             {"key": _ADVISORY_LOCK_KEY, "source": int(source)})).scalar()
+                if not locked:
+                    logger.debug(f"Rollup refresh of \"{source}\" is running in another worker, skipping")
+                    continue
+                await self._refresh_source(conn, source)
+        async with engine.connect() as conn:
+            await self._load_watermarks(conn)
+        self.refreshes += 1
+        self.last_refresh_seconds = round(time.perf_counter() - started, 3)
+        logger.info(f"Refreshed rollups in {self.last_refresh_seconds}s")
+
+    async def _refresh_periodically(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.refresh_failures += 1
+                logger.error(f"Rollup refresh failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.refresh_interval_seconds)
+
+    async def start(self) -> None:
+        """Create the rollup tables if needed and start the background refresher."""
+        engine = get_async_db_engine(ROLLUP_DATABASE)
+        if not engine:
+            logger.warning(f"No async engine for '{ROLLUP_DATABASE}', rollups disabled.")
+            return
+        try:
+            async with engine.begin() as conn:
+                await self.ensure_tables(conn)
+        except Exception as e:
+            logger.error(f"Could not create rollup tables, rollups disabled: {str(e)}")
+            return
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_periodically())
+
+    async def stop(self) -> None:
+        """Stop the background refresher."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def fresh_sources(self) -> List[str]:
+        """Source tables whose rollups cover data up to at most max_staleness_seconds ago."""
+        now = datetime.now(timezone.utc)
+        return [
+            source for source, watermark in self.watermarks.items()
+            if (now - watermark).total_seconds() <= self.max_staleness_seconds
+        ]
+
+    def rewrite(self, sql: str, parameters: Dict[str, Any], db_name: str) -> str:
+        """Return the SQL to execute: routed to a rollup if eligible, otherwise unchanged."""
+        if db_name != ROLLUP_DATABASE:
+            return sql
+        fresh = self.fresh_sources()
+        if not fresh:
+            return sql
+        rewritten = rewrite_for_rollups(sql, parameters, fresh)
+        if rewritten is None:
+            self.rewrite_skips += 1
+            return sql
+        self.rewrites += 1
+        logger.info(f"Routed query to rollup table: {rewritten}")
+        return rewritten
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the rollup counters."""
+        return {
+            "enabled": settings.ROLLUPS_ENABLED,
+            "watermarks": {source: watermark.isoformat() for source, watermark in self.watermarks.items()},
+            "fresh_sources": self.fresh_sources(),
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "last_refresh_seconds": self.last_refresh_seconds,
+            "rewrites": self.rewrites,
+            "rewrite_skips": self.rewrite_skips,
+        }
+
+
+rollup_manager = RollupManager(
+    refresh_interval_seconds=settings.ROLLUP_REFRESH_INTERVAL_SECONDS,
+    lag_seconds=settings.ROLLUP_REFRESH_LAG_SECONDS,
+    max_staleness_seconds=settings.ROLLUP_MAX_STALENESS_SECONDS,
+)
@@ -2,6 +2,10 @@
 Comprehensive database schema definitions for the organization_management database in the Bibliotheca system.
 This file provides detailed schema information to help the LLM generate accurate SQL queries.
 """
+import hashlib
+import json
+
+from app.core.config import settings
 
 SCHEMA_DEFINITIONS = {
     "report_management": {
@@ -9,6 +13,7 @@ SCHEMA_DEFINITIONS = {
         "tables": {
             "5": {
                 "description": "Stores aggregated event counts for a library system or location at specific timestamps.",
+                "keywords": "borrows loans checkouts returns logins renewals payments recommendations circulation activity usage events",
                 "columns": [
                     {"name": "id", "type": "bigint", "primary_key": False, "description": "Unique identifier for the log entry"},
                     {"name": "eventTimestamp", "type": "timestamp with time zone", "description": "Timestamp for when the event counts were recorded or aggregated"},
@@ -28,11 +33,11 @@ SCHEMA_DEFINITIONS = {
                     {"name": "32", "type": "integer", "description": "Total payment(s) made successfully in this period"},
                     {"name": "33", "type": "integer", "description": "Total payment(s) made unsuccessfully in this period"},
                     {"name": "38", "type": "integer", "description": "Total recommendation actions taken in this period"}
-                ],
-                "example_queries": []
+                ]
             },
             "hierarchyCaches": {
                 "description": "Stores cached organizational hierarchy data (Library Systems, Libraries, Sub-Locations). Provides IDs, names, parentage, and path information. Used for joining event data (table '5') with hierarchy context.",
+                "keywords": "locations branches libraries library systems sub-locations sites hierarchy names parent children",
                 "columns": [
                     {"name": "id", "type": "uuid", "primary_key": True, "description": "Unique identifier for the hierarchy (library system, library, or sub-location)"},
                     {"name": "name", "type": "VARCHAR(255)", "description": "Name of the library system, library, or sub-location"},
@@ -43,15 +48,11 @@ SCHEMA_DEFINITIONS = {
                     {"name": "updatedAt", "type": "TIMESTAMP WITH TIME ZONE", "description": "Timestamp when record was last updated"},
                     {"name": "deletedAt", "type": "TIMESTAMP WITH TIME ZONE", "description": "Timestamp when record was deleted (soft delete) (Nullable)", "nullable": True},
                     {"name": "lchierarchyId", "type": "uuid", "description": "Legacy hierarchy ID for migration purposes (Nullable)", "nullable": True}
-                ],
-                "example_queries": [
-                    "SELECT hc.\"id\", hc.\"name\" FROM \"hierarchyCaches\" hc WHERE hc.\"deletedAt\" IS NULL",
-                    "SELECT hc_loc.\"name\" FROM \"hierarchyCaches\" hc_loc JOIN \"hierarchyCaches\" hc_org ON hc_loc.\"parentId\" = hc_org.\"id\" WHERE hc_org.\"name\" = 'Example Library System' AND hc_loc.\"deletedAt\" IS NULL",
-                    "SELECT hc.\"name\" FROM \"hierarchyCaches\" hc WHERE hc.\"parentId\" IS NULL AND hc.\"deletedAt\" IS NULL"
                 ]
             },
             "8": {
                 "description": "Stores footfall data (people entering/leaving) associated with specific device parts (e.g., gates) within a library location. Queries about general 'footfall' or 'visitors' should typically involve summing both column \"39\" (entries) and column \"40\" (exits).",
+                "keywords": "footfall visitors visits people entries exits entering leaving gates traffic occupancy",
                 "columns": [
                     {"name": "id", "type": "bigint", "primary_key": True, "description": "Unique identifier for the footfall log entry (Primary Key)"},
                     {"name": "eventTimestamp", "type": "timestamp with time zone", "description": "Timestamp when the footfall count was recorded"},
@@ -66,12 +67,79 @@ SCHEMA_DEFINITIONS = {
                     {"name": "40", "type": "bigint", "description": "Cumulative count of people exiting through this part at this timestamp (Default: 0)", "nullable": True, "default": "0"},
                     {"name": "41", "type": "bigint", "description": "Unknown/Unused footfall count? (Default: 0)", "nullable": True, "default": "0"},
                     {"name": "info", "type": "jsonb", "description": "Additional JSON details related to the footfall event", "nullable": True}
-                ],
-                "example_queries": [
-                    "SELECT SUM(\"39\") AS total_entries FROM \"8\" WHERE \"hierarchyId\" = 'some-location-uuid' AND \"eventTimestamp\" >= NOW() - INTERVAL '1 day'",
-                    "SELECT \"partName\", SUM(\"39\") AS entries, SUM(\"40\") AS exits FROM \"8\" WHERE \"hierarchyId\" = 'some-location-uuid' GROUP BY \"partName\""
                 ]
             }
         }
     }
-} 
\ No newline at end of file
+} 
+
+
+# --- Rollup tables ---
+# Pre-aggregated SUMs of the event tables per (organizationId, hierarchyId, bucket), maintained by app.db.rollups
+
+ROLLUP_DATABASE = "report_management"
+ROLLUP_SOURCE_TABLES = ("5", "8")
+ROLLUP_GRANULARITIES = {"hourly": "hour", "daily": "day"}  # table suffix -> bucket width (UTC-aligned)
+
+
+def rollup_table_name(source_table: str, granularity: str) -> str:
+    """Name of the rollup table of a source event table, e.g. "5_rollup_daily"."""
+    return f"{source_table}_rollup_{granularity}"
+
+
+def rollup_metric_columns(source_table: str) -> list:
+    """Numeric event columns ("1", "2", ..., "41") of a source table that rollups store as sums."""
+    columns = SCHEMA_DEFINITIONS[ROLLUP_DATABASE]["tables"][source_table]["columns"]
+    return [column["name"] for column in columns if column["name"].isdigit()]
+
+
+def _rollup_table_definition(source_table: str, granularity: str, bucket: str) -> dict:
+    source_columns = {column["name"]: column for column in SCHEMA_DEFINITIONS[ROLLUP_DATABASE]["tables"][source_table]["columns"]}
+    columns = [
+        {"name": "organizationId", "type": "uuid", "foreign_key": "hierarchyCaches.id", "description": "Identifier for the library's parent organization"},
+        {"name": "hierarchyId", "type": "uuid", "foreign_key": "hierarchyCaches.id", "description": "Identifier for the specific library location", "nullable": True},
+        {"name": "bucket", "type": "timestamp with time zone", "description": f"Start of the UTC {bucket} this row aggregates (replaces \"eventTimestamp\")"},
+    ]
+    for name in rollup_metric_columns(source_table):
+        columns.append({"name": name, "type": "bigint", "description": f"SUM over the {bucket} of: {source_columns[name]['description']}"})
+    columns.append({"name": "eventCount", "type": "bigint", "description": f"Number of raw \"{source_table}\" rows aggregated into this row"})
+    columns.append({"name": "refreshedAt", "type": "timestamp with time zone", "description": "When this row was last recomputed"})
+    return {
+        "description": (
+            f"{granularity.capitalize()} rollup of table \"{source_table}\": one row per organization, location and UTC {bucket} "
+            f"with the SUM of every count column. Prefer it over \"{source_table}\" for SUM totals and {bucket}-or-coarser "
+            f"trends filtered on \"bucket\"; use the raw table for anything else (COUNT(*) of raw rows, other columns, finer time filters)."
+        ),
+        "columns": columns,
+    }
+
+
+# Only advertised to the LLM when migration 0003 created the closure table
+if settings.HIERARCHY_RESOLVE_SUBTREE:
+    SCHEMA_DEFINITIONS["report_management"]["tables"]["hierarchyClosure"] = {
+        "description": "Every (ancestor, descendant) pair of the hierarchy tree, including each node with itself at depth 0 (maintained automatically from hierarchyCaches.parentId). Use it for anything 'under', 'within' or 'in' a library system or library at any depth: JOIN \"hierarchyClosure\" hcl ON hcl.\"descendantId\" = <table>.\"hierarchyId\" WHERE hcl.\"ancestorId\" = :hierarchy_id. Never write recursive queries on hierarchyCaches.",
+        "keywords": "under within inside subtree descendants ancestors all locations sub-locations library system rollup nested levels",
+        "columns": [
+            {"name": "ancestorId", "type": "uuid", "primary_key": True, "foreign_key": "hierarchyCaches.id", "description": "Hierarchy node at the top of the pair (library system, library, ...)"},
+            {"name": "descendantId", "type": "uuid", "primary_key": True, "foreign_key": "hierarchyCaches.id", "description": "Hierarchy node at or below ancestorId"},
+            {"name": "depth", "type": "integer", "description": "Levels between ancestor and descendant (0 = same node, 1 = direct child)"}
+        ]
+    }
+
+# Only advertised to the LLM when the rollup tables are actually maintained
+if settings.ROLLUPS_ENABLED:
+    for _source_table in ROLLUP_SOURCE_TABLES:
+        for _granularity, _bucket in ROLLUP_GRANULARITIES.items():
+            SCHEMA_DEFINITIONS[ROLLUP_DATABASE]["tables"][rollup_table_name(_source_table, _granularity)] = _rollup_table_definition(
+                _source_table, _granularity, _bucket
+            )
+
+
+def compute_schema_version(definitions: dict) -> str:
+    """Short content hash of a schema definition dict, used to key caches of schema-dependent output."""
+    canonical = json.dumps(definitions, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+# Changes whenever SCHEMA_DEFINITIONS changes, so cached SQL generated against an older schema is never reused
+SCHEMA_VERSION = compute_schema_version(SCHEMA_DEFINITIONS)
@@ -0,0 +1,187 @@
+"""
+sqlparse-based helpers for inspecting generated SQL: table references, normalized fingerprints and
+the columns used in WHERE / JOIN / GROUP BY clauses.
+"""
+import hashlib
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import sqlparse
+from sqlparse import sql as sql_tokens
+from sqlparse import tokens as token_types
+
+from app.db.schema_definitions import SCHEMA_DEFINITIONS
+
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RANGE_OPERATORS = {"<", ">", "<=", ">="}
+_CONDITION_KEYWORDS = {"AND", "OR", "NOT", "IS", "NULL", "NOT NULL", "IN", "NOT IN", "BETWEEN", "TRUE", "FALSE"}
+
+
+def walk(token_list: sql_tokens.TokenList) -> Iterator[sql_tokens.Token]:
+    """Depth-first iteration over every token (groups and leaves) of a parsed statement."""
+    for token in token_list.tokens:
+        yield token
+        if token.is_group:
+            yield from walk(token)
+
+
+def _is_subquery(token: sql_tokens.Token) -> bool:
+    return isinstance(token, sql_tokens.Parenthesis) and any(t.ttype is token_types.DML for t in token.tokens)
+
+
+def _is_column(token: Optional[sql_tokens.Token]) -> bool:
+    return isinstance(token, sql_tokens.Identifier) and not any(t.is_group for t in token.tokens)
+
+
+def table_references(statement: sql_tokens.TokenList, tables: Optional[Tuple[str, ...]] = None) -> List[sql_tokens.Identifier]:
+    """Identifiers after FROM/JOIN that name a table directly (not a subquery), optionally only given tables."""
+    references = []
+    expecting_table = False
+    for token in walk(statement):
+        if token.is_whitespace:
+            continue
+        if token.ttype is token_types.Keyword and (token.normalized == "FROM" or token.normalized.endswith("JOIN")):
+            expecting_table = True
+            continue
+        if not expecting_table:
+            continue
+        candidates = token.get_identifiers() if isinstance(token, sql_tokens.IdentifierList) else [token]
+        for candidate in candidates:
+            if (isinstance(candidate, sql_tokens.Identifier) and candidate.get_parent_name() is None
+                    and not any(isinstance(t, sql_tokens.Parenthesis) for t in candidate.tokens)
+                    and (tables is None or candidate.get_real_name() in tables)):
+                references.append(candidate)
+        expecting_table = False
+    return references
+
+
+def fingerprint(sql: str) -> Tuple[str, str]:
+    """Normalize a statement (literals and bind parameters -> ?, whitespace, keyword case).
+
+    Returns:
+        Tuple of (normalized SQL, 16-character hash of it)
+    """
+    parts = []
+    for statement in sqlparse.parse(sql):
+        for token in statement.flatten():
+            if token.is_whitespace or token.ttype in token_types.Comment:
+                parts.append(" ")
+            elif token.ttype is token_types.Name.Placeholder or (
+                    token.ttype in token_types.Literal and token.ttype is not token_types.Literal.String.Symbol):
+                parts.append("?")
+            elif token.ttype in token_types.Keyword:
+                parts.append(token.normalized.upper())
+            else:
+                parts.append(token.value)
+    normalized = _IN_LIST.sub("(?)", " ".join("".join(parts).split())).rstrip(" ;")
+    return normalized, hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+class _PredicateCollector:
+    """Walks one statement and classifies column usages by clause."""
+
+    def __init__(self, statement: sql_tokens.Statement):
+        self.aliases: Dict[str, str] = {}
+        for reference in table_references(statement):
+            self.aliases[reference.get_alias() or reference.get_real_name()] = reference.get_real_name()
+        self.columns_by_table: Dict[str, set] = {}
+        for database in SCHEMA_DEFINITIONS.values():
+            for table, definition in database["tables"].items():
+                self.columns_by_table.setdefault(table, set()).update(c["name"] for c in definition["columns"])
+        self.usages: Dict[str, List[str]] = {"where_eq": [], "where_range": [], "join": [], "group_by": []}
+
+    def _resolve(self, identifier: sql_tokens.Identifier) -> Optional[str]:
+        name = identifier.get_real_name()
+        parent = identifier.get_parent_name()
+        if parent:
+            table = self.aliases.get(parent)
+        else:
+            owners = [t for t in set(self.aliases.values()) if name in self.columns_by_table.get(t, ())]
+            table = owners[0] if len(owners) == 1 else None
+        if not table or name not in self.columns_by_table.get(table, ()):
+            return None
+        return f"{table}.{name}"
+
+    def _columns(self, token: sql_tokens.Token) -> List[str]:
+        if _is_column(token):
+            column = self._resolve(token)
+            return [column] if column else []
+        if token.is_group and not _is_subquery(token):
+            return [column for child in token.tokens for column in self._columns(child)]
+        return []
+
+    def _add(self, kind: str, columns: List[str]) -> None:
+        for column in columns:
+            if column not in self.usages[kind]:
+                self.usages[kind].append(column)
+
+    def _conditions(self, tokens: List[sql_tokens.Token]) -> None:
+        """Classify the columns of a boolean expression from a WHERE or JOIN ... ON clause."""
+        tokens = [t for t in tokens if not t.is_whitespace]
+        for index, token in enumerate(tokens):
+            following = tokens[index + 1].normalized if index + 1 < len(tokens) else ""
+            if isinstance(token, sql_tokens.Comparison):
+                left, right = self._columns(token.left), self._columns(token.right)
+                operator = next((t.normalized for t in token.tokens if t.ttype is token_types.Operator.Comparison), "")
+                if _is_column(token.left) and _is_column(token.right):
+                    self._add("join", left + right)
+                elif operator == "=":
+                    self._add("where_eq", left or right)
+                elif operator in _RANGE_OPERATORS:
+                    self._add("where_range", left or right)
+                for side in (token.left, token.right):
+                    if _is_subquery(side):
+                        self.collect(side)
+            elif isinstance(token, sql_tokens.Identifier) and following in ("IN", "IS", "NOT IN"):
+                self._add("where_eq", self._columns(token))
+            elif isinstance(token, sql_tokens.Identifier) and following == "BETWEEN":
+                self._add("where_range", self._columns(token))
+            elif _is_subquery(token):
+                self.collect(token)
+            elif isinstance(token, sql_tokens.Parenthesis):
+                self._conditions(token.tokens[1:-1])
+
+    def collect(self, token_list: sql_tokens.TokenList) -> None:
+        """Record the column usages of a statement or subquery."""
+        clause = None
+        on_tokens: List[sql_tokens.Token] = []
+        for token in token_list.tokens:
+            if token.is_whitespace:
+                continue
+            if isinstance(token, sql_tokens.Where):
+                self._conditions(on_tokens)
+                on_tokens, clause = [], None
+                self._conditions(token.tokens[1:])
+                continue
+            if token.ttype in token_types.Keyword:
+                if clause == "on" and token.normalized in _CONDITION_KEYWORDS:
+                    on_tokens.append(token)
+                    continue
+                self._conditions(on_tokens)
+                on_tokens = []
+                clause = {"ON": "on", "GROUP BY": "group_by"}.get(token.normalized)
+                continue
+            if clause == "on":
+                on_tokens.append(token)
+                continue
+            if clause == "group_by":
+                self._add("group_by", self._columns(token))
+                clause = None
+            for child in [token] + (list(token.tokens) if token.is_group else []):
+                if _is_subquery(child):
+                    self.collect(child)
+        self._conditions(on_tokens)
+
+def predicate_columns(sql: str) -> Dict[str, List[str]]:
+    """Columns ("table.column") used in equality and range filters, join conditions and GROUP BY.
+
+    Unqualified columns are attributed to the only referenced table that has them; columns that
+    cannot be attributed (unknown aliases, ambiguous names, expressions) are left out.
+    """
+    usages: Dict[str, List[str]] = {"where_eq": [], "where_range": [], "join": [], "group_by": []}
+    for statement in sqlparse.parse(sql):
+        collector = _PredicateCollector(statement)
+        collector.collect(statement)
+        for kind, columns in collector.usages.items():
+            usages[kind].extend(c for c in columns if c not in usages[kind])
+    return usages
@@ -1,25 +1,27 @@
 import logging
 import json
 import asyncio
-from typing import Any, Dict, List, Optional, Tuple, TypedDict, Annotated, Sequence
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, TypedDict, Annotated, Sequence
 import operator
 from pydantic import BaseModel, Field
 import functools
 from pydantic_core import ValidationError # Import for specific error handling
 
 # LangChain & LangGraph Imports
-from langchain_core.messages import BaseMessage, FunctionMessage, HumanMessage, AIMessage, SystemMessage, ToolMessage
+from langchain_core.messages import BaseMessage, FunctionMessage, HumanMessage, AIMessage, AIMessageChunk, SystemMessage, ToolMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_openai import AzureChatOpenAI
 from langchain_core.output_parsers.openai_tools import PydanticToolsParser, JsonOutputToolsParser
 from langgraph.graph import StateGraph, END
 
 # Local Imports
+from app.core.cache import TTLCache
 from app.core.config import settings
+from app.core.llm import AGENT_TEMPERATURE, get_chat_llm
 from app.langchain.tools.sql_tool import SQLQueryTool
 from app.langchain.tools.chart_tool import ChartRendererTool
 from app.langchain.tools.summary_tool import SummarySynthesizerTool
-from app.langchain.tools.hierarchy_resolver_tool import HierarchyNameResolverTool
+from app.langchain.tools.hierarchy_resolver_tool import RESOLVER_TOOL_NAME, HierarchyNameResolverTool
+from app.langchain.streaming import ToolCallTextStreamer
 from app.schemas.chat import ChatData
 
 logger = logging.getLogger(__name__)
@@ -68,22 +70,18 @@ Available Tools:
 Tool Use and Response Guidelines:
 1.  **Analyze History:** Always review the conversation history (`messages`) for context, previous tool outputs (`ToolMessage`), and accumulated data (`tables`, `visualizations` in state).
 2.  **Adhere to Tool Schemas:** Ensure all arguments provided to tool calls strictly match the tool's defined input schema (`args_schema`).
-3.  **Hierarchy Name Resolution (MANDATORY FIRST STEP if names present):**
-    *   If the user query mentions specific organizational hierarchy entities by name (e.g., "Main Library", "Argyle Branch"), you MUST call the `hierarchy_name_resolver` tool **ALONE** as your first action. Do *not* call any other tools in the same step.
-    *   Pass the list of names as `name_candidates`.
-    *   This tool uses the correct `organization_id` from the request context automatically. You do not need to provide it as an argument. **DO NOT ask the user for the organization_id.**
-    *   The graph will automatically route you back here after the resolver runs.
-    *   Examine the `ToolMessage` from `hierarchy_name_resolver` in the history.
-    *   If any status is 'not_found' or 'error': Inform the user via `FinalApiResponseStructure` about the failure. Only proceed for *successfully* resolved names if logical, clearly stating which ones failed.
-    *   If all relevant names have status 'found': Proceed to the next step (e.g., `sql_query` or `summary_synthesizer`) using the returned `id` values.
+3.  **Hierarchy Names (branches, libraries, locations):**
+    *   **For data requests (`sql_query`):** Do NOT call `hierarchy_name_resolver` first. Call `sql_query` directly, keep the names in the `query_description` as the user wrote them, and pass them as `location_names` (e.g., `location_names=["Main Library", "Argyle"]`). The tool resolves the names to hierarchy IDs itself and filters on them.
+    *   If the `sql_query` output has no `table` but a `hierarchy_resolution` object, no data was queried: a name was 'ambiguous' (several entries match; the candidates are in `matches`) or 'not_found'. Ask the user which location is meant (listing the `matches` names), or inform them via `FinalApiResponseStructure` that the name was not found.
+    *   **Only when IDs are needed for another tool** (e.g., `summary_synthesizer`): call `hierarchy_name_resolver` **ALONE** first, passing the names as `name_candidates`. Examine its `ToolMessage`: if any status is 'not_found', 'ambiguous' or 'error', inform the user (for 'ambiguous', list the `matches` to choose from); if all are 'found', proceed using the returned `id` values.
+    *   Both tools use the correct `organization_id` from the request context automatically. You do not need to provide it as an argument. **DO NOT ask the user for the organization_id.**
 4.  **Database Usage:** ALWAYS use the `report_management` database. Specify `db_name='report_management'` in `sql_query` calls.
     *   Events: table '5'. Hierarchy: `hierarchyCaches`.
-    *   Joins: Use **resolved hierarchy IDs** (`JOIN "hierarchyCaches" hc ON "5"."hierarchyId" = hc."id" WHERE hc."id" IN (...)`).
+    *   Locations are filtered by hierarchy ID; `sql_query` binds the IDs of the `location_names` it resolves.
 5.  **SQL Query Generation (`sql_query` tool - Use Primarily for Raw Data/Charts):**
-    *   Call this tool *after* name resolution (if needed).
-    *   **CRITICAL:** When constructing the `query_description` argument for this tool, you **MUST** explicitly include the **resolved hierarchy ID(s)** obtained from the `hierarchy_name_resolver` tool's output (`ToolMessage`). Do NOT just use the resolved name.
-    *   Example Description: `"Get borrow counts for hierarchy ID 'ca4b911c-8b54-e811-2a94-0024e880a2b7' last week"` (NOT "Get borrow counts for Maxville Branch last week").
-    *   The SQL generating LLM inside `sql_query` is instructed to use these IDs directly for filtering.
+    *   **CRITICAL:** When the request names locations, pass every one of them in `location_names`, spelled exactly as in the `query_description`.
+    *   Example: `query_description="Get borrow counts for Maxville Branch last week"`, `location_names=["Maxville Branch"]`.
+    *   If you already hold resolved hierarchy IDs (e.g., from an earlier `hierarchy_name_resolver` call), you may put them in the `query_description` instead (e.g., `"Get borrow counts for hierarchy ID 'ca4b911c-8b54-e811-2a94-0024e880a2b7' last week"`) and omit `location_names`.
     *   Filter appropriately (e.g., by ID, timestamp). Avoid adding non-existent filters like `isActive`.
     *   Follow standard SQL practices.
 6.  **Query Consolidation & Aggregation Strategy (`sql_query` tool):**
@@ -91,9 +89,11 @@ Tool Use and Response Guidelines:
     *   Comparisons/Plots/Breakdowns for **Specific Entities**: If calling `sql_query` for multiple resolved IDs (e.g., for a chart), use **ONE** query **grouped by hierarchy identifier** (e.g., `GROUP BY hc."id", hc."name"`).
     *   Avoid multiple `sql_query` calls if one grouped query suffices.
 7.  **SQL Output Format:** `sql_query` returns JSON (`{{"table": ..., "text": ...}}`). Added to state.
+    *   If its `text` says no time range was specified and only data since a date was included, tell the user which period the figures cover.
+    *   If the JSON also contains an `error` object (e.g., `"type": "query_too_expensive"` or `"statement_timeout"`), the query was refused. Call `sql_query` again **once** with a narrower `query_description` (shorter time range, specific locations, or coarser aggregation). If it is refused again, explain the limitation to the user.
 8.  **Chart Request (`chart_renderer` tool):**
-    a. Resolve names using `hierarchy_name_resolver` (ALONE, first step).
-    b. Use `sql_query` (using resolved IDs, grouped if comparing) to get data.
+    a. (No separate name resolution needed.)
+    b. Use `sql_query` (with `location_names`, grouped if comparing) to get data.
     c. Wait for `sql_query` result.
     d. Invoke `chart_renderer`.
 9.  **Summary Request (`summary_synthesizer` tool):**
@@ -105,7 +105,7 @@ Tool Use and Response Guidelines:
 
 11. **Efficiency:** 
     *   If the user asks to compare simple metrics (like counts or sums) for multiple specific entities (e.g., two branches, two specific books) over the *same* time period, try to formulate a *single* call to the `sql_query` tool with a description covering the entire comparison, rather than making separate `sql_query` calls for each entity.
-    *   For example, if comparing borrows for Branch A and Branch B last week, make one `sql_query` call with a description like "Compare total successful borrows for hierarchy ID 'id-a' and hierarchy ID 'id-b' last week", which allows the tool to generate a single efficient query.
+    *   For example, if comparing borrows for Branch A and Branch B last week, make one `sql_query` call with a description like "Compare total successful borrows for Branch A and Branch B last week" and `location_names=["Branch A", "Branch B"]`, which allows the tool to generate a single efficient query.
 
 12. **Including Tables/Visualizations (Final Response):** When invoking `FinalApiResponseStructure`:
     *   Decide for each table returned by `sql_query` whether to include it. Set the `include_tables` argument to a **list of booleans** (e.g., `[True]`, `[False]`, or `[True, False]` if multiple tables were generated, matching the order). Include a table (`True` in the list) **only if** it provides substantial detail not easily summarized in the `text` field (e.g., multiple rows comparing items, complex breakdowns, or if the user explicitly asked for a table).
@@ -132,13 +132,12 @@ Tool Use and Response Guidelines:
 
 16. **Example (Name Resolution Failure):**
     *   User Query: "Borrows for Main Lib last week"
-    *   `hierarchy_name_resolver` runs, returns `status: 'not_found'` for "Main Lib".
+    *   `sql_query` runs with `location_names=["Main Lib"]` and returns a `hierarchy_resolution` with `status: 'not_found'` for "Main Lib" (no table).
     *   Analysis: Name resolution failed.
     *   Your Response: Invoke `FinalApiResponseStructure(text="I couldn't find a hierarchy entity named 'Main Lib'. Please check the name.", include_tables=[], include_visualizations=[])`
 17. **Example (Name Resolution Success -> Query -> Summarization):**
     *   User Query: "Compare borrows for Main Library and Argyle Branch last week"
-    *   `hierarchy_name_resolver` runs, returns `status: 'found'` with IDs for both.
-    *   `sql_query` runs using the resolved IDs and time filter. Adds table data to state.
+    *   `sql_query` runs with `location_names=["Main Library", "Argyle Branch"]`; both names resolve, and the tool filters on their IDs and the time range. Adds table data to state.
     *   `summary_synthesizer` runs on the table data. Adds summary text to state (or directly prepares it).
     *   Analysis: Summarization complete based on resolved names.
     *   Your Response: Invoke `FinalApiResponseStructure(text="Over the last week, Main Library (Main) had X borrows, while Argyle Branch (AYL) had Y borrows.", include_tables=[True], include_visualizations=[])` # Table useful for comparison
@@ -152,35 +151,23 @@ Tool Use and Response Guidelines:
     *   Your Response: Invoke `FinalApiResponseStructure(text="I cannot provide information about Rishabh Pant. My function is limited to answering questions about library data.", include_tables=[], include_visualizations=[])` # Note: Still uses the structure!
 20. **Example (Combined Factual Answer + Analytical Interpretation With Benchmark - Simple Result):**
     *   User Query: "What was the footfall for Main Library last month, and is it busy?"
-    *   `hierarchy_name_resolver` resolves "Main Library".
-    *   `sql_query` gets footfall data AND org average. Returns table like: `'[{{"Location Name": "Main Library", "Total Entries": 5000, "Org Average Entries": 4500, "Total Exits": 4950, "Org Average Exits": 4400}}]'`
+    *   `sql_query` (with `location_names=["Main Library"]`) gets footfall data AND org average. Returns table like: `'[{{"Location Name": "Main Library", "Total Entries": 5000, "Org Average Entries": 4500, "Total Exits": 4950, "Org Average Exits": 4400}}]'`
     *   Analysis: Got factual data + benchmark. Result is simple (one location).
     *   Your Response: Invoke `FinalApiResponseStructure(text="Main Library had 5000 entries and 4950 exits last month. This is slightly above the organizational average of 4500 entries and 4400 exits.", include_tables=[False], include_visualizations=[])` # Note: include_tables is [False]
 21. **Example (Combined Factual Answer + Analytical Interpretation Without Benchmark - Simple Result):**
     *   User Query: "What was the footfall for the Annex last month, and is it busy?"
-    *   `hierarchy_name_resolver` resolves "Annex".
-    *   `sql_query` gets footfall data (e.g., 10 entries, 5 exits). Benchmark calculation was maybe too complex or skipped by LLM.
+    *   `sql_query` (with `location_names=["Annex"]`) gets footfall data (e.g., 10 entries, 5 exits). Benchmark calculation was maybe too complex or skipped by LLM.
     *   Analysis: Got factual data. Benchmark missing. Result is simple.
     *   Your Response: Invoke `FinalApiResponseStructure(text="The Annex recorded 10 entries and 5 exits last month. Assessing whether this is considered 'busy' requires comparison with other branches or historical data, which was not readily available.", include_tables=[False], include_visualizations=[])` # Note: include_tables is [False]
 
-**Workflow Summary:** Check names -> Resolve (if needed) -> Refuse if entirely out-of-scope -> Get factual data (SQL/Summarizer - SQL may include benchmark for analytical queries) -> Formulate Final Response (Combine facts + context from benchmark OR state facts + need for context if benchmark missing; Decide on table inclusion) -> Conclude with `FinalApiResponseStructure`.
+**Workflow Summary:** Check names (pass them to `sql_query` as `location_names`) -> Refuse if entirely out-of-scope -> Get factual data (SQL/Summarizer - SQL may include benchmark for analytical queries) -> Formulate Final Response (Combine facts + context from benchmark OR state facts + need for context if benchmark missing; Decide on table inclusion) -> Conclude with `FinalApiResponseStructure`.
 """
 
 # --- LLM and Tools Initialization ---
 def get_llm():
-    """Get the Azure OpenAI LLM."""
-    logger.info(f"Initializing Azure OpenAI LLM with deployment {settings.AZURE_OPENAI_DEPLOYMENT_NAME}")
+    """Get the pooled Azure OpenAI LLM used by the agent node."""
     # Ensure model supports tool calling / structured output
-    return AzureChatOpenAI(
-        openai_api_key=settings.AZURE_OPENAI_API_KEY,
-        azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-        openai_api_version=settings.AZURE_OPENAI_API_VERSION,
-        deployment_name=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
-        model_name=settings.LLM_MODEL_NAME, # Ensure this model supports tool calling well
-        temperature=0.1,
-        verbose=settings.VERBOSE_LLM,
-        # streaming=False # Ensure streaming is False if not handled downstream
-    )
+    return get_chat_llm(AGENT_TEMPERATURE)
 
 def get_tools(organization_id: str) -> List[Any]:
     """Get tools for the agent (excluding FinalApiResponseStructure, which is handled via binding)."""
@@ -192,9 +179,10 @@ def get_tools(organization_id: str) -> List[Any]:
     ]
 
 # Function to bind tools AND the final response structure to the LLM
-def create_llm_with_tools_and_final_response_structure(organization_id: str):
+def create_llm_with_tools_and_final_response_structure(organization_id: str, tools: Optional[List[Any]] = None):
     llm = get_llm()
-    tools = get_tools(organization_id)
+    if tools is None:
+        tools = get_tools(organization_id)
     # Bind the operational tools AND the final response structure
     # The LLM will treat FinalApiResponseStructure like another tool it can call
     all_bindable_items = tools + [FinalApiResponseStructure]
@@ -231,17 +219,9 @@ def create_llm_with_tools_and_final_response_structure(organization_id: str):
 
 # --- Graph Nodes ---
 
-# Agent Node: Decides action - call a tool or invoke FinalApiResponseStructure
-def agent_node(state: AgentState, llm_with_structured_output):
-    """Invokes the LLM to decide the next action or final response structure."""
-    logger.debug(f"Agent node executing. Current state messages: {len(state['messages'])} messages.")
-    logger.debug(f"Agent node state: Tables={len(state.get('tables',[]))}, Visualizations={len(state.get('visualizations',[]))}")
-
-    # Invoke the LLM. It will either return tool calls for sql/chart/summary
-    # OR a tool call for FinalApiResponseStructure
-    response = llm_with_structured_output.invoke(state)
-    logger.debug(f"Agent node generated raw response: {response}")
-
+# Parses (and, where possible, corrects) a FinalApiResponseStructure call made by the agent
+async def parse_final_response_structure(response: BaseMessage) -> Optional[FinalApiResponseStructure]:
+    """Returns the FinalApiResponseStructure from the agent's AIMessage, or None if it did not call it (or parsing failed)."""
     # Initialize parser for potential FinalApiResponseStructure tool call
     parser = PydanticToolsParser(tools=[FinalApiResponseStructure])
 
@@ -254,7 +234,7 @@ def agent_node(state: AgentState, llm_with_structured_output):
             logger.info(f"Agent decided on final response structure. Attempting to parse AIMessage.")
             try:
                 # Attempt to parse the AIMessage to extract the structured object
-                parsed_objects = parser.invoke(response) # Pass the whole AIMessage
+                parsed_objects = await parser.ainvoke(response) # Pass the whole AIMessage
                 if parsed_objects: # Should be a list with one item
                     final_structure = parsed_objects[0]
                     logger.info(f"Successfully parsed FinalApiResponseStructure: {final_structure}")
@@ -300,6 +280,22 @@ def agent_node(state: AgentState, llm_with_structured_output):
                 logger.error(f"Unexpected error parsing FinalApiResponseStructure from AIMessage tool calls: {e}", exc_info=True)
                 # Let final_structure remain None
 
+    return final_structure
+
+# Agent Node: Decides action - call a tool or invoke FinalApiResponseStructure
+async def agent_node(state: AgentState, llm_with_structured_output):
+    """Invokes the LLM to decide the next action or final response structure."""
+    logger.debug(f"Agent node executing. Current state messages: {len(state['messages'])} messages.")
+    logger.debug(f"Agent node state: Tables={len(state.get('tables',[]))}, Visualizations={len(state.get('visualizations',[]))}")
+
+    # Invoke the LLM. It will either return tool calls for sql/chart/summary
+    # OR a tool call for FinalApiResponseStructure
+    # Awaited so the agent hop (the most frequent and slowest step) never holds a worker thread
+    response = await llm_with_structured_output.ainvoke(state)
+    logger.debug(f"Agent node generated raw response: {response}")
+
+    final_structure = await parse_final_response_structure(response)
+
     # Return the AIMessage (containing tool calls or the final structure call)
     # Add the parsed final structure (potentially corrected) to the state if available
     return {
@@ -559,21 +555,21 @@ async def resolve_hierarchy_node(state: AgentState, tools: List[Any]) -> Dict[st
     # Find the hierarchy resolver tool call
     resolver_tool_call = None
     for tool_call in last_message.tool_calls:
-        if tool_call.get("name") == HierarchyNameResolverTool.__name__:
+        if tool_call.get("name") == RESOLVER_TOOL_NAME:
             resolver_tool_call = tool_call
             break
 
     if not resolver_tool_call:
-        logger.warning(f"resolve_hierarchy_node: Expected {HierarchyNameResolverTool.__name__} call, not found.")
+        logger.warning(f"resolve_hierarchy_node: Expected {RESOLVER_TOOL_NAME} call, not found.")
         return {"messages": []}
 
     # Find the corresponding tool implementation
     tool_map = {tool.name: tool for tool in tools}
-    resolver_tool = tool_map.get(HierarchyNameResolverTool.__name__)
+    resolver_tool = tool_map.get(RESOLVER_TOOL_NAME)
 
     if not resolver_tool:
-         logger.error(f"resolve_hierarchy_node: {HierarchyNameResolverTool.__name__} tool implementation not found.")
-         return {"messages": [ToolMessage(content=f"Error: Tool {HierarchyNameResolverTool.__name__} not available.", tool_call_id=resolver_tool_call['id'], name=HierarchyNameResolverTool.__name__)]}
+         logger.error(f"resolve_hierarchy_node: {RESOLVER_TOOL_NAME} tool implementation not found.")
+         return {"messages": [ToolMessage(content=f"Error: Tool {RESOLVER_TOOL_NAME} not available.", tool_call_id=resolver_tool_call['id'], name=RESOLVER_TOOL_NAME)]}
 
     try:
         args = resolver_tool_call.get("args", {})
@@ -623,10 +619,10 @@ def should_continue(state: AgentState) -> str:
     # Check if the AI called ONLY the hierarchy resolver tool
     if last_message.tool_calls:
         operational_calls = [tc for tc in last_message.tool_calls if tc.get("name") != FinalApiResponseStructure.__name__]
-        is_only_resolver = len(operational_calls) == 1 and operational_calls[0].get("name") == HierarchyNameResolverTool.__name__
+        is_only_resolver = len(operational_calls) == 1 and operational_calls[0].get("name") == RESOLVER_TOOL_NAME
 
         if is_only_resolver:
-            logger.debug(f"Conditional edge: Only {HierarchyNameResolverTool.__name__} called, routing to resolve_hierarchy node.")
+            logger.debug(f"Conditional edge: Only {RESOLVER_TOOL_NAME} called, routing to resolve_hierarchy node.")
             return "resolve_hierarchy"
 
     # Check if the AI called other tools (or a mix)
@@ -649,12 +645,12 @@ def create_graph_app(organization_id: str) -> StateGraph:
     Create the updated LangGraph application.
     The agent node now directly generates the final response structure when done.
     """
-    # Set up the LLM agent with tools and the final response structure binding
-    llm_with_bindings = create_llm_with_tools_and_final_response_structure(organization_id)
-
-    # Get operational tools for the handler node
+    # Get operational tools once; they are shared by the LLM binding and the handler nodes
     operational_tools = get_tools(organization_id)
 
+    # Set up the LLM agent with tools and the final response structure binding
+    llm_with_bindings = create_llm_with_tools_and_final_response_structure(organization_id, tools=operational_tools)
+
     # Create the agent node wrapper
     agent_node_wrapper = functools.partial(agent_node, llm_with_structured_output=llm_with_bindings)
 
@@ -698,6 +694,241 @@ def create_graph_app(organization_id: str) -> StateGraph:
     return graph_app
 
 
+# --- Compiled Graph Registry ---
+# Building the graph (LLM client, tool instances, bound prompt, StateGraph compile) is pure setup work
+# that only depends on the organization, so compiled apps are cached per organization.
+graph_registry: TTLCache = TTLCache(
+    name="graph_apps",
+    max_size=settings.GRAPH_CACHE_MAX_SIZE,
+    ttl_seconds=settings.GRAPH_CACHE_TTL_SECONDS,
+)
+
+def get_graph_app(organization_id: str):
+    """Return the compiled graph for an organization, building it on a cache miss."""
+    def _build():
+        logger.info(f"No cached LangGraph app for org {organization_id}, building a new one.")
+        return create_graph_app(organization_id)
+
+    return graph_registry.get_or_create(organization_id, _build)
+
+def invalidate_graph_app(organization_id: Optional[str] = None) -> int:
+    """Drop the cached graph for one organization, or all cached graphs if no organization is given.
+
+    Returns:
+        Number of cached graphs removed
+    """
+    if organization_id is None:
+        removed = len(graph_registry)
+        graph_registry.clear()
+    else:
+        removed = 1 if graph_registry.invalidate(organization_id) else 0
+    logger.info(f"Invalidated {removed} cached LangGraph app(s) (org: {organization_id or 'all'})")
+    return removed
+
+
+# --- Chat Message Processing Helpers ---
+def _format_chat_history(chat_history: Optional[List[Dict]]) -> List[BaseMessage]:
+    """Converts client-provided chat history dicts into LangChain messages (Improved robustness for ToolMessages)."""
+    history_messages: List[BaseMessage] = []
+    if chat_history:
+        logger.debug(f"Formatting {len(chat_history)} provided history messages.")
+        for msg_data in chat_history:
+            role = msg_data.get("role")
+            content = msg_data.get("content")
+            tool_call_id = msg_data.get("tool_call_id") # For ToolMessage
+            tool_name = msg_data.get("name") # For ToolMessage
+
+            if not content: # Skip messages without content
+                 logger.warning(f"Skipping history message due to missing content: {msg_data}")
+                 continue
+
+            try:
+                if role == "user":
+                    history_messages.append(HumanMessage(content=str(content)))
+                elif role == "assistant":
+                    # Represent past AI responses, including potential tool calls
+                    tool_calls = msg_data.get("tool_calls") # Assuming stored if assistant made calls
+                    if tool_calls and isinstance(tool_calls, list):
+                         # Reconstruct ToolCall objects if possible, otherwise keep as dicts
+                         # Note: LangChain BaseMessage tool_calls expect ToolCall objects or dicts with 'id', 'name', 'args'
+                         rehydrated_tool_calls = []
+                         for tc in tool_calls:
+                             if isinstance(tc, dict) and 'id' in tc and 'name' in tc and 'args' in tc:
+                                 rehydrated_tool_calls.append(tc) # Keep as dict if structure matches
+                             else:
+                                 logger.warning(f"Could not fully rehydrate tool call from history: {tc}")
+                         history_messages.append(AIMessage(content=str(content), tool_calls=rehydrated_tool_calls))
+                    else:
+                         history_messages.append(AIMessage(content=str(content)))
+                elif role == "tool": # Handle tool results
+                    if tool_call_id:
+                        # Include name if available in history
+                        if tool_name:
+                            history_messages.append(ToolMessage(content=str(content), tool_call_id=tool_call_id, name=tool_name))
+                        else:
+                            # Older history might not have name, add a default or log warning
+                            logger.warning(f"Tool history message missing name, using tool_call_id: {tool_call_id}")
+                            history_messages.append(ToolMessage(content=str(content), tool_call_id=tool_call_id))
+                    else:
+                        logger.warning(f"Skipping tool history message due to missing tool_call_id: {msg_data}")
+                # Add other roles (system, function) if necessary
+            except Exception as hist_err:
+                logger.error(f"Error formatting history message: {msg_data}. Error: {hist_err}", exc_info=True)
+                # Append a placeholder or skip? Skipping for now.
+
+    else:
+        logger.debug("No chat history provided.")
+    return history_messages
+
+
+def _build_initial_state(message: str, chat_history: Optional[List[Dict]] = None) -> AgentState:
+    """Prepares the initial graph state from the new message and any provided history."""
+    history_messages = _format_chat_history(chat_history)
+    initial_state: AgentState = {
+        "messages": history_messages + [HumanMessage(content=message)],
+        "tables": [],
+        "visualizations": [],
+        "final_response_structure": None # Initialize as None
+    }
+    logger.debug(f"Initial graph state prepared with {len(initial_state['messages'])} messages.")
+    return initial_state
+
+
+def _build_chat_response(final_state: Dict[str, Any]) -> Dict[str, Any]:
+    """Builds the API response dictionary (status/data/error) from the final graph state."""
+    # --- Extract Final Response Structure ---
+    structured_response: Optional[FinalApiResponseStructure] = final_state.get("final_response_structure")
+
+    if not structured_response:
+         # Fallback: Try to parse from the last message if state field is missing
+         logger.warning("Final response structure not found in state field, attempting to parse last message.")
+         last_msg = final_state.get("messages", [])[-1] if final_state.get("messages") else None
+         if isinstance(last_msg, AIMessage) and last_msg.tool_calls:
+              # Check if the message contains the specific tool call we expect
+              is_final_structure_call_present = any(
+                  tc.get("name") == FinalApiResponseStructure.__name__ for tc in last_msg.tool_calls
+              )
+              if is_final_structure_call_present:
+                  parser = PydanticToolsParser(tools=[FinalApiResponseStructure])
+                  try:
+                       parsed_list = parser.invoke(last_msg) # Pass the whole AIMessage
+                       if parsed_list:
+                            structured_response = parsed_list[0]
+                            logger.info("Successfully parsed final structure from last message tool call.")
+                       else:
+                            logger.warning("Fallback parser invoked but returned empty list.")
+                  except Exception as parse_err:
+                       logger.error(f"Fallback parsing failed: {parse_err}", exc_info=True)
+              else:
+                  logger.warning("Last AIMessage had tool calls, but not for FinalApiResponseStructure.")
+
+    # --- Handle missing or invalid final structure ---
+    if not structured_response or not isinstance(structured_response, FinalApiResponseStructure):
+        logger.warning(f"Graph finished, but FinalApiResponseStructure is missing or invalid. Checking last AI message.")
+        # Check if the last message is an AIMessage with content
+        last_ai_msg_content = None
+        if final_state.get("messages"):
+             last_msg = final_state["messages"][-1]
+             if isinstance(last_msg, AIMessage) and isinstance(last_msg.content, str) and last_msg.content.strip():
+                  last_ai_msg_content = last_msg.content.strip()
+                  logger.info(f"Using content from last AIMessage as fallback text: '{last_ai_msg_content[:100]}...'")
+
+        # If we have fallback content, use it for a success response, otherwise return error
+        if last_ai_msg_content:
+            final_chat_data = ChatData(text=last_ai_msg_content, tables=None, visualizations=None)
+            logger.warning("Returning success response using fallback text due to missing FinalApiResponseStructure tool call.")
+            return {
+                "status": "success",
+                "data": final_chat_data.dict(exclude_none=True),
+                "error": None, # No functional error, just formatting failure by LLM
+             }
+        else:
+            # If no structure AND no usable last AI message, return error
+            logger.error(f"CRITICAL: No FinalApiResponseStructure and no usable final AIMessage. State: {final_state}")
+            error_text = "I encountered an issue generating the final response structure and couldn't recover a message."
+            final_chat_data = ChatData(text=error_text)
+            return {
+                "status": "error",
+                "data": final_chat_data.dict(exclude_none=True),
+                "error": {"code": "AGENT_STRUCTURE_ERROR", "message": "Agent failed to produce FinalApiResponseStructure or usable message."},
+             }
+
+    # --- Process valid final structure ---
+    # Standardized log format using actual attribute names
+    logger.info(f"Successfully obtained FinalApiResponseStructure: text='{structured_response.text}', include_tables={structured_response.include_tables}, include_visualizations={structured_response.include_visualizations}")
+
+    # Get all accumulated tables and visualizations from the state
+    all_tables = final_state.get('tables', [])
+    all_visualizations = final_state.get('visualizations', [])
+
+    # Validate and filter tables/visualizations based on the structure's flags
+    # Ensure boolean list lengths match data lengths provided by the LLM
+    num_tables_state = len(all_tables)
+    num_viz_state = len(all_visualizations)
+    num_include_tables = len(structured_response.include_tables)
+    num_include_viz = len(structured_response.include_visualizations)
+
+    if num_include_tables != num_tables_state:
+        # Log the actual flags received vs state length
+        logger.warning(
+            f"Mismatch: LLM provided {num_include_tables} include_tables flags "
+            f"({structured_response.include_tables}), but state has {num_tables_state} tables. "
+            f"Defaulting to include all."
+        )
+        structured_response.include_tables = [True] * num_tables_state
+    if num_include_viz != num_viz_state:
+        # Log the actual flags received vs state length
+         logger.warning(
+             f"Mismatch: LLM provided {num_include_viz} include_visualizations flags "
+             f"({structured_response.include_visualizations}), but state has {num_viz_state} visualizations. "
+             f"Defaulting to include all."
+        )
+         structured_response.include_visualizations = [True] * num_viz_state
+
+    included_tables = [
+        table for i, table in enumerate(all_tables)
+        if i < len(structured_response.include_tables) and structured_response.include_tables[i]
+    ]
+    included_visualizations = [
+        viz for i, viz in enumerate(all_visualizations)
+        if i < len(structured_response.include_visualizations) and structured_response.include_visualizations[i]
+    ]
+
+    logger.info(f"Final response includes {len(included_tables)} tables and {len(included_visualizations)} visualizations.")
+
+    # Construct the final data payload using the API schema (ChatData)
+    try:
+        final_chat_data = ChatData(
+            text=structured_response.text,
+            tables=included_tables if included_tables else None,
+            visualizations=included_visualizations if included_visualizations else None
+        )
+        logger.debug("Successfully validated response data against ChatData schema.")
+    except Exception as validation_err:
+        logger.error(f"Error validating final ChatData: {validation_err}", exc_info=True)
+        # Fallback to simpler format
+        final_chat_data = ChatData(
+            text=structured_response.text or "Error formatting validated response data."
+        )
+        logger.warning("Using text-only response due to final validation error.")
+
+    logger.info(f"Successfully processed chat message. Response keys: {list(final_chat_data.dict(exclude_none=True).keys())}")
+    return {
+        "status": "success",
+        "data": final_chat_data.dict(exclude_none=True),
+        "error": None,
+    }
+
+
+def _critical_error_response(e: Exception) -> Dict[str, Any]:
+    """Consistent error structure for unexpected failures while processing a chat message."""
+    return {
+        "status": "error",
+        "data": ChatData(text="An unexpected critical error occurred processing your request.").dict(exclude_none=True),
+        "error": {"code": "CRITICAL_PROCESSING_ERROR", "message": str(e)},
+    }
+
+
 # --- Refactored process_chat_message (Simplified) ---
 async def process_chat_message(
     organization_id: str,
@@ -711,67 +942,10 @@ async def process_chat_message(
     """
     logger.info(f"Processing chat message for org {organization_id}, session {session_id}. Original message: '{message}'")
     try:
-        app = create_graph_app(organization_id)
-
-        # Format chat history (Improved robustness for ToolMessages)
-        history_messages: List[BaseMessage] = []
-        if chat_history:
-            logger.debug(f"Formatting {len(chat_history)} provided history messages.")
-            for msg_data in chat_history:
-                role = msg_data.get("role")
-                content = msg_data.get("content")
-                tool_call_id = msg_data.get("tool_call_id") # For ToolMessage
-                tool_name = msg_data.get("name") # For ToolMessage
-
-                if not content: # Skip messages without content
-                     logger.warning(f"Skipping history message due to missing content: {msg_data}")
-                     continue
-
-                try:
-                    if role == "user":
-                        history_messages.append(HumanMessage(content=str(content)))
-                    elif role == "assistant":
-                        # Represent past AI responses, including potential tool calls
-                        tool_calls = msg_data.get("tool_calls") # Assuming stored if assistant made calls
-                        if tool_calls and isinstance(tool_calls, list):
-                             # Reconstruct ToolCall objects if possible, otherwise keep as dicts
-                             # Note: LangChain BaseMessage tool_calls expect ToolCall objects or dicts with 'id', 'name', 'args'
-                             rehydrated_tool_calls = []
-                             for tc in tool_calls:
-                                 if isinstance(tc, dict) and 'id' in tc and 'name' in tc and 'args' in tc:
-                                     rehydrated_tool_calls.append(tc) # Keep as dict if structure matches
-                                 else:
-                                     logger.warning(f"Could not fully rehydrate tool call from history: {tc}")
-                             history_messages.append(AIMessage(content=str(content), tool_calls=rehydrated_tool_calls))
-                        else:
-                             history_messages.append(AIMessage(content=str(content)))
-                    elif role == "tool": # Handle tool results
-                        if tool_call_id:
-                            # Include name if available in history
-                            if tool_name:
-                                history_messages.append(ToolMessage(content=str(content), tool_call_id=tool_call_id, name=tool_name))
-                            else:
-                                # Older history might not have name, add a default or log warning
-                                logger.warning(f"Tool history message missing name, using tool_call_id: {tool_call_id}")
-                                history_messages.append(ToolMessage(content=str(content), tool_call_id=tool_call_id))
-                        else:
-                            logger.warning(f"Skipping tool history message due to missing tool_call_id: {msg_data}")
-                    # Add other roles (system, function) if necessary
-                except Exception as hist_err:
-                    logger.error(f"Error formatting history message: {msg_data}. Error: {hist_err}", exc_info=True)
-                    # Append a placeholder or skip? Skipping for now.
-
-        else:
-            logger.debug("No chat history provided.")
+        app = get_graph_app(organization_id)
 
         # Prepare the initial state
-        initial_state: AgentState = {
-            "messages": history_messages + [HumanMessage(content=message)],
-            "tables": [],
-            "visualizations": [],
-            "final_response_structure": None # Initialize as None
-        }
-        logger.debug(f"Initial graph state prepared with {len(initial_state['messages'])} messages.")
+        initial_state = _build_initial_state(message, chat_history)
 
         # Invoke the graph asynchronously
         config = {"configurable": {"session_id": session_id}}
@@ -779,137 +953,90 @@ async def process_chat_message(
         final_state = await app.ainvoke(initial_state, config=config)
         logger.debug(f"Graph invocation complete. Final state keys: {list(final_state.keys())}")
 
-        # --- Extract Final Response Structure ---
-        structured_response: Optional[FinalApiResponseStructure] = final_state.get("final_response_structure")
-
-        if not structured_response:
-             # Fallback: Try to parse from the last message if state field is missing
-             logger.warning("Final response structure not found in state field, attempting to parse last message.")
-             last_msg = final_state.get("messages", [])[-1] if final_state.get("messages") else None
-             if isinstance(last_msg, AIMessage) and last_msg.tool_calls:
-                  # Check if the message contains the specific tool call we expect
-                  is_final_structure_call_present = any(
-                      tc.get("name") == FinalApiResponseStructure.__name__ for tc in last_msg.tool_calls
-                  )
-                  if is_final_structure_call_present:
-                      parser = PydanticToolsParser(tools=[FinalApiResponseStructure])
-                      try:
-                           parsed_list = parser.invoke(last_msg) # Pass the whole AIMessage
-                           if parsed_list:
-                                structured_response = parsed_list[0]
-                                logger.info("Successfully parsed final structure from last message tool call.")
-                           else:
-                                logger.warning("Fallback parser invoked but returned empty list.")
-                      except Exception as parse_err:
-                           logger.error(f"Fallback parsing failed: {parse_err}", exc_info=True)
-                  else:
-                      logger.warning("Last AIMessage had tool calls, but not for FinalApiResponseStructure.")
-
-        # --- Handle missing or invalid final structure ---
-        if not structured_response or not isinstance(structured_response, FinalApiResponseStructure):
-            logger.warning(f"Graph finished, but FinalApiResponseStructure is missing or invalid. Checking last AI message.")
-            # Check if the last message is an AIMessage with content
-            last_ai_msg_content = None
-            if final_state.get("messages"):
-                 last_msg = final_state["messages"][-1]
-                 if isinstance(last_msg, AIMessage) and isinstance(last_msg.content, str) and last_msg.content.strip():
-                      last_ai_msg_content = last_msg.content.strip()
-                      logger.info(f"Using content from last AIMessage as fallback text: '{last_ai_msg_content[:100]}...'")
-
-            # If we have fallback content, use it for a success response, otherwise return error
-            if last_ai_msg_content:
-                final_chat_data = ChatData(text=last_ai_msg_content, tables=None, visualizations=None)
-                logger.warning("Returning success response using fallback text due to missing FinalApiResponseStructure tool call.")
-                return {
-                    "status": "success",
-                    "data": final_chat_data.dict(exclude_none=True),
-                    "error": None, # No functional error, just formatting failure by LLM
-                 }
-            else:
-                # If no structure AND no usable last AI message, return error
-                logger.error(f"CRITICAL: No FinalApiResponseStructure and no usable final AIMessage. State: {final_state}")
-                error_text = "I encountered an issue generating the final response structure and couldn't recover a message."
-                final_chat_data = ChatData(text=error_text)
-                return {
-                    "status": "error",
-                    "data": final_chat_data.dict(exclude_none=True),
-                    "error": {"code": "AGENT_STRUCTURE_ERROR", "message": "Agent failed to produce FinalApiResponseStructure or usable message."},
-                 }
-
-        # --- Process valid final structure ---
-        # Standardized log format using actual attribute names
-        logger.info(f"Successfully obtained FinalApiResponseStructure: text='{structured_response.text}', include_tables={structured_response.include_tables}, include_visualizations={structured_response.include_visualizations}")
-
-        # Get all accumulated tables and visualizations from the state
-        all_tables = final_state.get('tables', [])
-        all_visualizations = final_state.get('visualizations', [])
-
-        # Validate and filter tables/visualizations based on the structure's flags
-        # Ensure boolean list lengths match data lengths provided by the LLM
-        num_tables_state = len(all_tables)
-        num_viz_state = len(all_visualizations)
-        num_include_tables = len(structured_response.include_tables)
-        num_include_viz = len(structured_response.include_visualizations)
-
-        if num_include_tables != num_tables_state:
-            # Log the actual flags received vs state length
-            logger.warning(
-                f"Mismatch: LLM provided {num_include_tables} include_tables flags "
-                f"({structured_response.include_tables}), but state has {num_tables_state} tables. "
-                f"Defaulting to include all."
-            )
-            structured_response.include_tables = [True] * num_tables_state
-        if num_include_viz != num_viz_state:
-            # Log the actual flags received vs state length
-             logger.warning(
-                 f"Mismatch: LLM provided {num_include_viz} include_visualizations flags "
-                 f"({structured_response.include_visualizations}), but state has {num_viz_state} visualizations. "
-                 f"Defaulting to include all."
-            )
-             structured_response.include_visualizations = [True] * num_viz_state
-
-        included_tables = [
-            table for i, table in enumerate(all_tables)
-            if i < len(structured_response.include_tables) and structured_response.include_tables[i]
-        ]
-        included_visualizations = [
-            viz for i, viz in enumerate(all_visualizations)
-            if i < len(structured_response.include_visualizations) and structured_response.include_visualizations[i]
-        ]
-
-        logger.info(f"Final response includes {len(included_tables)} tables and {len(included_visualizations)} visualizations.")
-
-        # Construct the final data payload using the API schema (ChatData)
-        try:
-            final_chat_data = ChatData(
-                text=structured_response.text,
-                tables=included_tables if included_tables else None,
-                visualizations=included_visualizations if included_visualizations else None
-            )
-            logger.debug("Successfully validated response data against ChatData schema.")
-        except Exception as validation_err:
-            logger.error(f"Error validating final ChatData: {validation_err}", exc_info=True)
-            # Fallback to simpler format
-            final_chat_data = ChatData(
-                text=structured_response.text or "Error formatting validated response data."
-            )
-            logger.warning("Using text-only response due to final validation error.")
-
-        logger.info(f"Successfully processed chat message. Response keys: {list(final_chat_data.dict(exclude_none=True).keys())}")
-        return {
-            "status": "success",
-            "data": final_chat_data.dict(exclude_none=True),
-            "error": None,
-        }
+        return _build_chat_response(final_state)
 
     except Exception as e:
         logger.exception(f"Critical error in process_chat_message for org {organization_id}: {e}", exc_info=True)
         # Ensure consistent error structure
-        return {
-            "status": "error",
-            "data": ChatData(text="An unexpected critical error occurred processing your request.").dict(exclude_none=True),
-            "error": {"code": "CRITICAL_PROCESSING_ERROR", "message": str(e)},
-        }
+        return _critical_error_response(e)
+
+
+# --- Streaming variant of process_chat_message ---
+# Graph nodes reported to streaming clients as progress events
+STREAMED_NODES = ("agent", "resolve_hierarchy", "tools")
+
+async def stream_chat_message(
+    organization_id: str,
+    message: str,
+    session_id: Optional[str] = None,
+    chat_history: Optional[List[Dict]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Processes a user chat message like process_chat_message, but yields progress events as the graph runs.
+
+    Yields dicts of the form {"event": <name>, "data": <payload>}:
+        node: a graph node finished (for the agent node, includes the tools it decided to call)
+        text_delta: newly generated characters of the FinalApiResponseStructure `text` argument, while the LLM streams it
+        table: a table returned by sql_query, as soon as the tools node completes
+        visualization: a rendered chart, as soon as the tools node completes
+        final: the complete response dictionary (same shape as process_chat_message's return value)
+    """
+    logger.info(f"Streaming chat message for org {organization_id}, session {session_id}. Original message: '{message}'")
+    try:
+        app = get_graph_app(organization_id)
+        initial_state = _build_initial_state(message, chat_history)
+        config = {"configurable": {"session_id": session_id}}
+
+        final_state: Optional[Dict[str, Any]] = None
+        table_index = 0
+        viz_index = 0
+        # Pulls the final answer text out of the FinalApiResponseStructure arguments as they stream in.
+        # include_tables/include_visualizations are only applied once the call completes (final event).
+        text_streamer = ToolCallTextStreamer(FinalApiResponseStructure.__name__, field="text")
+        # "updates" gives per-node deltas for progress events, "values" tracks the full state for the final response,
+        # "messages" gives LLM token chunks as they are generated
+        async for mode, chunk in app.astream(initial_state, config=config, stream_mode=["updates", "values", "messages"]):
+            if mode == "values":
+                final_state = chunk
+                continue
+
+            if mode == "messages":
+                message_chunk, metadata = chunk
+                # Only the agent node's LLM produces the final response; ignore tool-internal LLM calls
+                if metadata.get("langgraph_node") != "agent" or not isinstance(message_chunk, AIMessageChunk):
+                    continue
+                if message_chunk.tool_call_chunks:
+                    delta = text_streamer.feed(message_chunk.id, message_chunk.tool_call_chunks)
+                    if delta:
+                        yield {"event": "text_delta", "data": {"delta": delta}}
+                continue
+
+            for node_name, update in chunk.items():
+                if node_name not in STREAMED_NODES:
+                    continue
+                update = update or {}
+                node_event: Dict[str, Any] = {"node": node_name}
+                if node_name == "agent":
+                    last_msg = update.get("messages", [None])[-1] if update.get("messages") else None
+                    if isinstance(last_msg, AIMessage) and last_msg.tool_calls:
+                        node_event["tool_calls"] = [tc.get("name") for tc in last_msg.tool_calls]
+                yield {"event": "node", "data": node_event}
+
+                for table in update.get("tables", []) or []:
+                    yield {"event": "table", "data": {"index": table_index, "table": table}}
+                    table_index += 1
+                for viz in update.get("visualizations", []) or []:
+                    yield {"event": "visualization", "data": {"index": viz_index, "visualization": viz}}
+                    viz_index += 1
+
+        if final_state is None:
+            raise RuntimeError("Graph stream finished without producing a state.")
+        logger.debug(f"Graph stream complete. Final state keys: {list(final_state.keys())}")
+        yield {"event": "final", "data": _build_chat_response(final_state)}
+
+    except Exception as e:
+        logger.exception(f"Critical error in stream_chat_message for org {organization_id}: {e}", exc_info=True)
+        yield {"event": "final", "data": _critical_error_response(e)}
 
 
 # --- test_azure_openai_connection() remains the same ---
@@ -0,0 +1,151 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# JSON single-character escape sequences
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class PartialJsonFieldExtractor:
+    """Incrementally extracts one top-level string field from a JSON object that arrives in chunks.
+
+    Tool-call arguments are streamed by the LLM as raw JSON fragments, e.g.
+    '{"te', 'xt": "Over the', ' last week\\n...'. Feeding each fragment to `feed`
+    returns only the newly decoded characters of the target field's value, so
+    they can be forwarded to clients before the JSON document is complete.
+    Escape sequences (including \\uXXXX and surrogate pairs) split across chunk
+    boundaries are handled.
+    """
+
+    def __init__(self, field: str = "text"):
+        """Create an extractor.
+
+        Args:
+            field: Name of the top-level string field to extract
+        """
+        self.field = field
+        self.done = False  # True once the field's closing quote has been seen
+        self._depth = 0
+        self._in_string = False
+        self._string_role: Optional[str] = None  # "key", "target" or None (any other string)
+        self._escape = False
+        self._unicode_digits: Optional[str] = None
+        self._pending_high_surrogate: Optional[int] = None
+        self._key_chars: List[str] = []
+        self._last_key: Optional[str] = None
+        self._expect_key = False
+        self._after_colon = False
+        self._out: List[str] = []
+
+    def feed(self, chunk: str) -> str:
+        """Consume a fragment of the JSON document and return newly decoded field characters."""
+        self._out = []
+        for ch in chunk:
+            self._consume(ch)
+        return "".join(self._out)
+
+    def _emit(self, value: str) -> None:
+        if self._string_role == "key":
+            self._key_chars.append(value)
+        elif self._string_role == "target":
+            self._out.append(value)
+
+    def _emit_code_point(self, code: int) -> None:
+        if 0xD800 <= code <= 0xDBFF:
+            # High surrogate: wait for the low half of the pair
+            self._pending_high_surrogate = code
+            return
+        if 0xDC00 <= code <= 0xDFFF and self._pending_high_surrogate is not None:
+            code = 0x10000 + ((self._pending_high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._pending_high_surrogate = None
+        self._emit(chr(code))
+
+    def _consume(self, ch: str) -> None:
+        if self._in_string:
+            if self._unicode_digits is not None:
+                self._unicode_digits += ch
+                if len(self._unicode_digits) == 4:
+                    digits, self._unicode_digits, self._escape = self._unicode_digits, None, False
+                    try:
+                        self._emit_code_point(int(digits, 16))
+                    except ValueError:
+                        logger.debug(f"Invalid unicode escape in streamed JSON: \\u{digits}")
+                return
+            if self._escape:
+                if ch == "u":
+                    self._unicode_digits = ""
+                    return
+                self._escape = False
+                self._emit(_ESCAPES.get(ch, ch))
+                return
+            if ch == "\\":
+                self._escape = True
+                return
+            if ch == '"':
+                self._in_string = False
+                if self._string_role == "key":
+                    self._last_key = "".join(self._key_chars)
+                elif self._string_role == "target":
+                    self.done = True
+                self._string_role = None
+                return
+            self._emit(ch)
+            return
+
+        # Outside of any string: track structure at the top level of the object
+        if ch == '"':
+            self._in_string = True
+            if self._depth == 1 and self._expect_key:
+                self._string_role = "key"
+                self._key_chars = []
+                self._expect_key = False
+            elif self._depth == 1 and self._after_colon and self._last_key == self.field and not self.done:
+                self._string_role = "target"
+            else:
+                self._string_role = None
+            self._after_colon = False
+        elif ch in "{[":
+            self._depth += 1
+            self._after_colon = False
+            if ch == "{" and self._depth == 1:
+                self._expect_key = True
+        elif ch in "}]":
+            self._depth -= 1
+        elif ch == "," and self._depth == 1:
+            self._expect_key = True
+        elif ch == ":" and self._depth == 1:
+            self._after_colon = True
+        elif not ch.isspace():
+            # Non-string value (number, bool, null) started
+            self._after_colon = False
+
+
+class ToolCallTextStreamer:
+    """Routes streamed tool-call chunks to one PartialJsonFieldExtractor per tool call.
+
+    Only calls to `tool_name` are tracked. Chunks are keyed by (message id, tool call index),
+    since the tool name and id are only present on the first chunk of each call.
+    """
+
+    def __init__(self, tool_name: str, field: str = "text"):
+        self.tool_name = tool_name
+        self.field = field
+        self._names: Dict[Tuple[Optional[str], int], Optional[str]] = {}
+        self._extractors: Dict[Tuple[Optional[str], int], PartialJsonFieldExtractor] = {}
+
+    def feed(self, message_id: Optional[str], tool_call_chunks: List[Dict]) -> str:
+        """Consume the tool_call_chunks of one AIMessageChunk and return newly decoded field text."""
+        deltas = []
+        for tool_chunk in tool_call_chunks:
+            key = (message_id, tool_chunk.get("index") or 0)
+            if tool_chunk.get("name"):
+                self._names[key] = tool_chunk["name"]
+            if self._names.get(key) != self.tool_name:
+                continue
+            args_fragment = tool_chunk.get("args")
+            if not args_fragment:
+                continue
+            extractor = self._extractors.setdefault(key, PartialJsonFieldExtractor(self.field))
+            deltas.append(extractor.feed(args_fragment))
+        return "".join(deltas)
@@ -0,0 +1,211 @@
+import logging
+import re
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Column name hints
+_TEMPORAL_NAME = re.compile(r"(date|time|day|week|month|year|hour|period|timestamp|bucket)", re.IGNORECASE)
+_IDENTIFIER_NAME = re.compile(r"(^id$|_id$|Id$|^uuid$)")
+_SHARE_NAME = re.compile(r"(percent|pct|share|ratio|proportion|fraction)", re.IGNORECASE)
+
+# Query hints
+_QUERY_CHART_TYPES = (
+    ("pie", re.compile(r"\bpie\b|\bdonut\b", re.IGNORECASE)),
+    ("scatter", re.compile(r"\bscatter\b|\bcorrelat", re.IGNORECASE)),
+    ("line", re.compile(r"\bline (chart|graph|plot)\b|\btrend\b|\bover time\b", re.IGNORECASE)),
+    ("bar", re.compile(r"\bbar\b|\bcolumn chart\b", re.IGNORECASE)),
+)
+_QUERY_PART_OF_WHOLE = re.compile(r"\b(share|proportion|percentage|breakdown|distribution|split|composition)\b", re.IGNORECASE)
+
+# Maximum number of slices for a pie chart and of series for a hue column
+PIE_MAX_CATEGORIES = 6
+HUE_MAX_CATEGORIES = 10
+# Fewer rows than this do not make a meaningful scatter plot
+SCATTER_MIN_ROWS = 3
+# Confidence of shapes a rule cannot chart faithfully (several measures, scatter plots); it is below
+# CHART_INFERENCE_MIN_CONFIDENCE's default, so the LLM decides
+UNCERTAIN_CONFIDENCE = 0.6
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _is_integral(value: Any) -> bool:
+    # Tool rows arrive as JSON, so EXTRACT(HOUR ...) values are floats such as 13.0
+    return _is_number(value) and float(value).is_integer()
+
+
+def _is_temporal_value(value: Any) -> bool:
+    if isinstance(value, (datetime, date)):
+        return True
+    if isinstance(value, str) and len(value) >= 7 and value[:4].isdigit() and value[4] == "-":
+        try:
+            datetime.fromisoformat(value)
+            return True
+        except ValueError:
+            return False
+    return False
+
+
+def _classify_column(name: str, values: List[Any]) -> str:
+    """Classify a column as 'temporal', 'numeric', 'identifier', 'categorical' or 'empty'."""
+    present = [v for v in values if v is not None]
+    if not present:
+        return "empty"
+    if all(_is_temporal_value(v) for v in present):
+        return "temporal"
+    if all(_is_number(v) for v in present):
+        if _IDENTIFIER_NAME.search(name):
+            return "identifier"
+        # Whole-number years/hours/months used as an axis
+        if _TEMPORAL_NAME.search(name) and all(_is_integral(v) for v in present):
+            return "temporal"
+        return "numeric"
+    if _IDENTIFIER_NAME.search(name):
+        return "identifier"
+    return "categorical"
+
+
+def _query_chart_type(query: Optional[str]) -> Optional[str]:
+    if not query:
+        return None
+    for chart_type, pattern in _QUERY_CHART_TYPES:
+        if pattern.search(query):
+            return chart_type
+    return None
+
+
+def _looks_like_part_of_whole(name: str, values: List[Any], query: Optional[str]) -> bool:
+    numbers = [float(v) for v in values if _is_number(v)]
+    if not numbers or any(v < 0 for v in numbers):
+        return False
+    total = sum(numbers)
+    if _SHARE_NAME.search(name) or abs(total - 100) < 0.5 or abs(total - 1) < 0.005:
+        return True
+    return bool(query and _QUERY_PART_OF_WHOLE.search(query))
+
+
+def _humanize(column: str) -> str:
+    words = re.sub(r"([a-z])([A-Z])", r"\1 \2", column).replace("_", " ").strip()
+    return words[:1].upper() + words[1:]
+
+
+def infer_chart_metadata(columns: List[str], rows: List[List[Any]], query: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], float]:
+    """Choose chart type and axes from column types, cardinality and names.
+
+    Args:
+        columns: Column names
+        rows: Row values
+        query: Optional user request, used for explicit chart types and part-of-whole hints
+
+    Returns:
+        Tuple of (metadata in the chart metadata LLM format or None, confidence between 0 and 1)
+    """
+    if not columns or not rows:
+        return None, 0.0
+
+    kinds: Dict[str, str] = {}
+    cardinality: Dict[str, int] = {}
+    for index, column in enumerate(columns):
+        values = [row[index] if index < len(row) else None for row in rows]
+        kinds[column] = _classify_column(column, values)
+        cardinality[column] = len({str(v) for v in values if v is not None})
+
+    temporal = [c for c in columns if kinds[c] == "temporal"]
+    numeric = [c for c in columns if kinds[c] == "numeric"]
+    categorical = [c for c in columns if kinds[c] == "categorical"]
+    requested = _query_chart_type(query)
+
+    if not numeric:
+        return None, 0.0
+
+    # A chart shows one measure: the first one, and the LLM decides when there are several
+    y_col = numeric[0]
+    single_measure = len(numeric) == 1
+    hue_col = None
+    chart_type = None
+    confidence = 0.0
+
+    if temporal and requested in (None, "line", "bar"):
+        # Time on the x-axis: a trend line (unless bars were asked for), split by a low-cardinality category
+        x_col = temporal[0]
+        chart_type = requested or "line"
+        hue_candidates = [c for c in categorical if 1 < cardinality[c] <= HUE_MAX_CATEGORIES]
+        hue_col = hue_candidates[0] if hue_candidates else None
+        if not single_measure:
+            confidence = UNCERTAIN_CONFIDENCE
+        else:
+            confidence = 0.9 if len(categorical) <= 1 else 0.75
+    elif categorical:
+        x_col = categorical[0]
+        y_values = [row[columns.index(y_col)] for row in rows]
+        few_categories = cardinality[x_col] <= PIE_MAX_CATEGORIES and len(rows) == cardinality[x_col]
+        if requested == "pie" or (requested is None and few_categories and len(categorical) == 1 and len(numeric) == 1
+                                  and _looks_like_part_of_whole(y_col, y_values, query)):
+            chart_type = "pie"
+            confidence = 0.9 if requested == "pie" else 0.8
+        elif requested in (None, "bar"):
+            chart_type = "bar"
+            if len(categorical) > 1 and 1 < cardinality[categorical[1]] <= HUE_MAX_CATEGORIES:
+                hue_col = categorical[1]
+            if not single_measure:
+                confidence = UNCERTAIN_CONFIDENCE
+            else:
+                confidence = 0.85 if len(categorical) == 1 else 0.7
+        elif requested == "line":
+            chart_type = "line"
+            confidence = 0.7
+    elif len(numeric) >= 2 and len(rows) >= SCATTER_MIN_ROWS and requested in (None, "scatter"):
+        # Two measures rarely mean a correlation plot (e.g. successful vs failed totals per row)
+        x_col = numeric[0]
+        y_col = numeric[1]
+        chart_type = "scatter"
+        confidence = UNCERTAIN_CONFIDENCE
+
+    if chart_type is None:
+        return None, 0.0
+
+    title = f"{_humanize(y_col)} by {_humanize(x_col)}"
+    metadata = {
+        "chart_type": chart_type,
+        "title": title,
+        "x_column": x_col,
+        "y_column": y_col,
+        "color_column": hue_col,
+        "description": f"{chart_type.capitalize()} chart of {_humanize(y_col).lower()} by {_humanize(x_col).lower()}.",
+    }
+    return metadata, confidence
+
+
+class ChartInferenceStats:
+    """Counts how often chart metadata came from local inference vs. the LLM."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fast_path = 0
+        self.llm_fallback = 0
+
+    def record(self, fast_path: bool) -> None:
+        with self._lock:
+            if fast_path:
+                self.fast_path += 1
+            else:
+                self.llm_fallback += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the counters."""
+        with self._lock:
+            total = self.fast_path + self.llm_fallback
+            return {
+                "fast_path": self.fast_path,
+                "llm_fallback": self.llm_fallback,
+                "fast_path_rate": round(self.fast_path / total, 4) if total else 0.0,
+            }
+
+
+chart_inference_stats = ChartInferenceStats()
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from pathlib import Path
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.langchain.tools import chart_worker
+
+logger = logging.getLogger(__name__)
+
+
+class ChartRenderPool:
+    """Warmed process pool that renders chart specs off the event loop.
+
+    Workers are started with the 'spawn' method (forking a threaded server process is unsafe)
+    and initialized with matplotlib/seaborn already imported and themed. Rendering is bounded by
+    a per-render timeout and a maximum number of queued/in-flight renders; a render that timed out
+    keeps its place in that budget until its worker has finished it.
+
+    Specs carrying a content `digest` are deduplicated: if the output file already exists it is
+    reused, and concurrent renders of the same digest share a single in-flight render.
+    """
+
+    def __init__(self, max_workers: int, render_timeout: float, max_queue: int):
+        self.max_workers = max(1, max_workers)
+        self.render_timeout = render_timeout
+        self.max_queue = max(1, max_queue)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._inflight: Dict[str, "asyncio.Future[Dict[str, Any]]"] = {}
+        self.renders = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejections = 0
+        self.reused = 0
+        self.coalesced = 0
+
+    def _ensure_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                logger.info(f"Starting chart render pool with {self.max_workers} worker process(es)")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=chart_worker.init_worker,
+                )
+            return self._executor
+
+    async def start(self) -> None:
+        """Start the worker processes and wait until each has run its initializer."""
+        executor = self._ensure_executor()
+        loop = asyncio.get_running_loop()
+        try:
+            pids = await asyncio.gather(*[loop.run_in_executor(executor, chart_worker.warmup) for _ in range(self.max_workers)])
+            logger.info(f"Chart render pool warmed ({len(set(pids))} worker process(es) ready)")
+        except Exception as e:
+            logger.warning(f"Chart render pool warm-up failed: {str(e)}")
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+            logger.info("Chart render pool shut down")
+
+    def _reset_broken_executor(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    async def render(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        """Render a chart spec in a worker process, reusing identical charts where possible.
+
+        Args:
+            spec: Render spec (see chart_worker.render_chart), optionally with a content `digest`
+
+        Returns:
+            Dictionary with the `output_path` of the chart and whether it was `cached`
+
+        Raises:
+            ValueError: If the queue is full, the render times out, or the worker fails
+        """
+        digest = spec.get("digest")
+        if not digest:
+            return await self._render(spec)
+
+        if Path(spec["output_path"]).exists():
+            self.reused += 1
+            logger.debug(f"Reusing existing chart {spec['output_path']}")
+            return {"output_path": spec["output_path"], "cached": True}
+
+        inflight = self._inflight.get(digest)
+        if inflight is not None:
+            self.coalesced += 1
+            logger.debug(f"Joining in-flight render of chart {digest}")
+            return {**await asyncio.shield(inflight), "cached": True}
+
+        task = asyncio.ensure_future(self._render(spec))
+        self._inflight[digest] = task
+        task.add_done_callback(lambda _: self._inflight.pop(digest, None))
+        # Shield the shared render so a cancelled caller does not cancel it for the others
+        return await asyncio.shield(task)
+
+    def _release_slot(self, _future: Optional[Future] = None) -> None:
+        # Runs in the executor's management thread when a render completes
+        with self._lock:
+            self._pending -= 1
+
+    async def _render(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self.rejections += 1
+                raise ValueError(f"Chart render queue is full ({self.max_queue} renders pending). Please try again shortly.")
+            self._pending += 1
+
+        future: Optional[Future] = None
+        try:
+            executor = self._ensure_executor()
+            future = executor.submit(chart_worker.render_chart, spec)
+            # The slot is held until the worker is done with the render, not until the caller stops
+            # waiting, so timed-out renders still count against the queue while they occupy a worker
+            future.add_done_callback(self._release_slot)
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.render_timeout)
+            self.renders += 1
+            return {**result, "cached": False}
+        except asyncio.TimeoutError:
+            # A render not yet started is cancelled; a running one keeps its worker until it finishes
+            self.timeouts += 1
+            raise ValueError(f"Chart rendering timed out after {self.render_timeout} seconds.")
+        except BrokenProcessPool as e:
+            self.failures += 1
+            logger.error(f"Chart render pool is broken, restarting it: {str(e)}")
+            self._reset_broken_executor(executor)
+            raise ValueError("Chart rendering worker crashed.")
+        except ValueError:
+            self.failures += 1
+            raise
+        except Exception as e:
+            self.failures += 1
+            raise ValueError(f"Chart rendering failed: {str(e)}")
+        finally:
+            if future is None:
+                self._release_slot()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the pool counters."""
+        return {
+            "workers": self.max_workers,
+            "started": self._executor is not None,
+            "pending": self._pending,
+            "inflight": len(self._inflight),
+            "max_queue": self.max_queue,
+            "renders": self.renders,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejections": self.rejections,
+            "reused": self.reused,
+            "coalesced": self.coalesced,
+        }
+
+
+# Shared pool used by ChartRendererTool
+chart_pool = ChartRenderPool(
+    max_workers=settings.CHART_POOL_SIZE or min(4, os.cpu_count() or 1),
+    render_timeout=settings.CHART_RENDER_TIMEOUT_SECONDS,
+    max_queue=settings.CHART_POOL_MAX_QUEUE,
+)
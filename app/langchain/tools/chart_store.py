@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ChartStore:
+    """Size- and age-bounded store for rendered chart images.
+
+    Keeps an in-memory LRU index (filename -> size, last access) of CHART_DIR, rebuilt from a
+    directory scan at startup. Charts are touched whenever they are rendered, reused or served,
+    and a periodic sweep deletes charts not accessed within `max_age_seconds`, then the least
+    recently accessed ones until the store fits in `max_bytes`.
+    Last access is also written to the file's mtime so LRU order survives restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_age_seconds: Optional[float] = None):
+        """Create a store.
+
+        Args:
+            directory: Directory holding the chart images
+            max_bytes: Total size budget in bytes (0 = unbounded)
+            max_age_seconds: Maximum time since last access, or None/0 for no age limit
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_age_seconds = max_age_seconds if max_age_seconds and max_age_seconds > 0 else None
+        self._index: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._sweeper: Optional[asyncio.Task] = None
+        self.evictions = 0
+        self.expirations = 0
+        self.evicted_bytes = 0
+
+    @staticmethod
+    def _is_chart_file(name: str) -> bool:
+        # Temporary files from in-progress renders start with a dot
+        return name.endswith(".png") and not name.startswith(".")
+
+    def scan(self) -> None:
+        """Rebuild the index from the files currently in the directory."""
+        entries = []
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file() or not self._is_chart_file(entry.name):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.name, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda item: item[2])
+        with self._lock:
+            self._index = OrderedDict((name, (size, accessed)) for name, size, accessed in entries)
+            self._bytes = sum(size for _, size, _ in entries)
+        logger.info(f"Chart store indexed {len(entries)} chart(s), {self._bytes} bytes in {self.directory}")
+
+    def touch(self, name: str) -> bool:
+        """Record an access to a chart (by filename or path). Returns False if the file is missing."""
+        name = Path(name).name
+        path = self.directory / name
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+            size = path.stat().st_size
+        except FileNotFoundError:
+            with self._lock:
+                entry = self._index.pop(name, None)
+                if entry is not None:
+                    self._bytes -= entry[0]
+            return False
+        with self._lock:
+            previous = self._index.pop(name, None)
+            if previous is not None:
+                self._bytes -= previous[0]
+            self._index[name] = (size, now)
+            self._bytes += size
+        return True
+
+    def _remove(self, name: str) -> int:
+        try:
+            (self.directory / name).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not delete chart {name}: {str(e)}")
+        size, _ = self._index.pop(name)
+        self._bytes -= size
+        return size
+
+    def sweep(self) -> int:
+        """Delete expired charts, then least recently accessed ones until within the size budget.
+
+        Returns:
+            Number of charts deleted
+        """
+        removed = 0
+        with self._lock:
+            if self.max_age_seconds is not None:
+                cutoff = time.time() - self.max_age_seconds
+                # The index is in access order, so expired entries are at the front
+                while self._index:
+                    name, (_, accessed) = next(iter(self._index.items()))
+                    if accessed >= cutoff:
+                        break
+                    self.evicted_bytes += self._remove(name)
+                    self.expirations += 1
+                    removed += 1
+            if self.max_bytes:
+                while self._index and self._bytes > self.max_bytes:
+                    name = next(iter(self._index))
+                    self.evicted_bytes += self._remove(name)
+                    self.evictions += 1
+                    removed += 1
+        if removed:
+            logger.info(f"Chart store sweep removed {removed} chart(s), {self._bytes} bytes remain")
+        return removed
+
+    async def _sweep_periodically(self, interval_seconds: float) -> None:
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"Chart store sweep failed: {str(e)}", exc_info=True)
+
+    async def start(self, interval_seconds: float) -> None:
+        """Index the directory, sweep once, and start the background sweeper."""
+        await asyncio.to_thread(self.scan)
+        await asyncio.to_thread(self.sweep)
+        if interval_seconds and interval_seconds > 0 and self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_periodically(interval_seconds))
+
+    async def stop(self) -> None:
+        """Stop the background sweeper."""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the store counters."""
+        with self._lock:
+            return {
+                "charts": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_age_seconds": self.max_age_seconds,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+
+class ChartStaticFiles(StaticFiles):
+    """StaticFiles app for CHART_DIR that records each served chart as an access in the store."""
+
+    def __init__(self, *args, store: ChartStore, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.store = store
+
+    async def get_response(self, path: str, scope: Scope):
+        response = await super().get_response(path, scope)
+        if response.status_code == 200:
+            self.store.touch(path)
+        return response
+
+
+# Shared store for CHART_DIR
+chart_store = ChartStore(
+    directory=settings.CHART_DIR,
+    max_bytes=settings.CHART_STORE_MAX_BYTES,
+    max_age_seconds=settings.CHART_STORE_MAX_AGE_SECONDS,
+)
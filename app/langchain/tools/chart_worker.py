@@ -0,0 +1,292 @@
+"""
+Chart rendering worker functions.
+
+This module is imported by the chart process pool workers, so it deliberately only depends on
+pandas/matplotlib/seaborn (no LangChain, settings or database imports). Everything here is a
+module-level function so it can be pickled and executed in a separate process.
+"""
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg') # Use Agg backend for non-interactive environments (important for servers)
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+logger = logging.getLogger(__name__)
+
+# Set a default Seaborn style
+sns.set_theme(style="whitegrid")
+
+
+def init_worker() -> None:
+    """Process pool initializer: set up plotting state once per worker process."""
+    matplotlib.use('Agg')
+    sns.set_theme(style="whitegrid")
+    # Render and discard a tiny figure so font caches and the Agg canvas are loaded before the first real chart
+    fig, ax = plt.subplots(figsize=(1, 1))
+    ax.plot([0, 1], [0, 1])
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+def warmup() -> int:
+    """No-op task used to force worker processes to start. Returns the worker's PID."""
+    return os.getpid()
+
+
+def create_dataframe(columns: List[str], rows: List[List[Any]]) -> pd.DataFrame:
+    """Create pandas DataFrame from column names and row values."""
+    logger.debug("Creating pandas DataFrame...")
+    try:
+        df = pd.DataFrame([dict(zip(columns, row)) for row in rows])
+        logger.debug(f"DataFrame created successfully with shape {df.shape}")
+        return df
+    except Exception as e:
+        logger.error(f"Error creating DataFrame: {e}", exc_info=True)
+        raise ValueError(f"Could not create DataFrame from provided data: {e}")
+
+
+def render_bar_chart(ax: plt.Axes, df: pd.DataFrame, metadata: Dict[str, Any]):
+    """Render a bar chart using Seaborn on the provided Axes."""
+    x_col_meta = metadata.get("x_column") # Seaborn typically uses x/y based on plot type
+    y_col_meta = metadata.get("y_column")
+    hue_col_meta = metadata.get("color_column") # Hue for color
+
+    actual_cols = df.columns.tolist()
+    x_col = x_col_meta if x_col_meta in actual_cols else actual_cols[0] if len(actual_cols) > 0 else None
+    y_col = y_col_meta if y_col_meta in actual_cols else actual_cols[1] if len(actual_cols) > 1 else None
+    hue_col = hue_col_meta if hue_col_meta and hue_col_meta in actual_cols else None
+
+    # Get color mapping from metadata if provided
+    color_mapping = metadata.get("color_mapping")
+    palette = None
+    if isinstance(color_mapping, dict) and color_mapping:
+        # Ensure mapping keys exist in the x-column data for bar chart
+        valid_mapping = {k: v for k, v in color_mapping.items() if k in df[x_col].unique()}
+        if valid_mapping:
+            palette = valid_mapping
+            logger.debug(f"Using provided color mapping (palette): {palette}")
+        else:
+            logger.warning("Provided color_mapping keys do not match data categories. Using default palette.")
+
+    if x_col != x_col_meta or y_col != y_col_meta:
+         logger.warning(f"Metadata columns ('{x_col_meta}', '{y_col_meta}') invalid. Falling back to ('{x_col}', '{y_col}').")
+
+    if not x_col or not y_col:
+        raise ValueError("Could not determine valid x and y columns for bar chart")
+
+    logger.debug(f"Rendering bar chart with x='{x_col}', y='{y_col}', hue='{hue_col}', palette='{bool(palette)}'") # Log if palette used
+    try:
+        # Use the palette if available
+        sns.barplot(data=df, x=x_col, y=y_col, hue=hue_col, ax=ax, errorbar=None, palette=palette)
+        ax.set_xlabel(x_col)
+        ax.set_ylabel(y_col)
+    except Exception as e:
+        logger.error(f"Error rendering bar chart with Seaborn: {e}", exc_info=True)
+        raise ValueError(f"Failed to render bar chart: {e}")
+
+def render_pie_chart(ax: plt.Axes, df: pd.DataFrame, metadata: Dict[str, Any]):
+    """Render a pie chart using Matplotlib on the provided Axes."""
+    labels_col_meta = metadata.get("x_column") # Map x -> labels
+    values_col_meta = metadata.get("y_column") # Map y -> values
+
+    # Get color mapping from metadata if provided
+    color_mapping = metadata.get("color_mapping")
+    colors = None
+    if isinstance(color_mapping, dict) and color_mapping:
+        # For pie charts, create a list of colors in the order of the labels
+        ordered_colors = [color_mapping.get(label) for label in df[labels_col_meta]]
+        # Filter out None values if some labels weren't in the mapping
+        if any(c is not None for c in ordered_colors):
+            # Use mapped colors where available, None otherwise (matplotlib will default)
+            colors = [c if c is not None else None for c in ordered_colors]
+            logger.debug(f"Using provided colors for pie chart segments (partial matches allowed).")
+        else:
+            logger.warning("Provided color_mapping keys do not match data labels. Using default colors.")
+
+    actual_cols = df.columns.tolist()
+    labels_col = labels_col_meta if labels_col_meta in actual_cols else actual_cols[0] if len(actual_cols) > 0 else None
+    values_col = values_col_meta if values_col_meta in actual_cols else actual_cols[1] if len(actual_cols) > 1 else None
+
+    if labels_col != labels_col_meta or values_col != values_col_meta:
+         logger.warning(f"Metadata columns ('{labels_col_meta}', '{values_col_meta}') invalid. Falling back to ('{labels_col}', '{values_col}').")
+
+    if not labels_col or not values_col:
+        raise ValueError("Could not determine valid labels and values columns for pie chart")
+
+    # Handle potential non-numeric data in values column
+    try:
+        pie_data = pd.to_numeric(df[values_col], errors='coerce').fillna(0)
+        if (pie_data < 0).any():
+             logger.warning(f"Pie chart values column '{values_col}' contains negative values. Taking absolute values.")
+             pie_data = pie_data.abs()
+    except KeyError:
+         raise ValueError(f"Values column '{values_col}' not found for pie chart.")
+    except Exception as e:
+         logger.error(f"Error processing pie chart values: {e}", exc_info=True)
+         raise ValueError(f"Invalid data in values column '{values_col}' for pie chart.")
+
+    logger.debug(f"Rendering pie chart with labels='{labels_col}', values='{values_col}', colors='{bool(colors)}'")
+    try:
+        # Pass the colors list to ax.pie
+        wedges, texts, autotexts = ax.pie(pie_data, labels=df[labels_col], autopct='%1.1f%%', startangle=90, colors=colors)
+        # ax.axis('equal') # Equal aspect ratio ensures that pie is drawn as a circle.
+        plt.setp(autotexts, size=8, weight="bold", color="white") # Improve autopct visibility
+    except Exception as e:
+        logger.error(f"Error rendering pie chart with Matplotlib: {e}", exc_info=True)
+        raise ValueError(f"Failed to render pie chart: {e}")
+
+def render_line_chart(ax: plt.Axes, df: pd.DataFrame, metadata: Dict[str, Any]):
+    """Render a line chart using Seaborn on the provided Axes."""
+    x_col_meta = metadata.get("x_column")
+    y_col_meta = metadata.get("y_column")
+    hue_col_meta = metadata.get("color_column")
+
+    # Get color mapping from metadata if provided (used if hue_col is set)
+    color_mapping = metadata.get("color_mapping")
+    palette = None
+    if isinstance(color_mapping, dict) and color_mapping and hue_col_meta:
+         # Ensure mapping keys exist in the hue column data
+         valid_mapping = {k: v for k, v in color_mapping.items() if k in df[hue_col_meta].unique()}
+         if valid_mapping:
+             palette = valid_mapping
+             logger.debug(f"Using provided color mapping (palette) for hue: {palette}")
+         else:
+             logger.warning(f"Provided color_mapping keys do not match hue categories ('{hue_col_meta}'). Using default palette.")
+
+    actual_cols = df.columns.tolist()
+    x_col = x_col_meta if x_col_meta in actual_cols else actual_cols[0] if len(actual_cols) > 0 else None
+    y_col = y_col_meta if y_col_meta in actual_cols else actual_cols[1] if len(actual_cols) > 1 else None
+    hue_col = hue_col_meta if hue_col_meta and hue_col_meta in actual_cols else None
+
+    if x_col != x_col_meta or y_col != y_col_meta:
+         logger.warning(f"Metadata columns ('{x_col_meta}', '{y_col_meta}') invalid. Falling back to ('{x_col}', '{y_col}').")
+
+    if not x_col or not y_col:
+        raise ValueError("Could not determine valid x and y columns for line chart")
+
+    logger.debug(f"Rendering line chart with x='{x_col}', y='{y_col}', hue='{hue_col}', palette='{bool(palette)}'")
+    try:
+        # Convert x_col to numeric or datetime if possible for better plotting
+        try:
+            df[x_col] = pd.to_datetime(df[x_col], errors='ignore')
+        except Exception: pass # Ignore if conversion fails
+        try:
+            df[x_col] = pd.to_numeric(df[x_col], errors='ignore')
+        except Exception: pass 
+
+        # Pass palette to lineplot
+        sns.lineplot(data=df, x=x_col, y=y_col, hue=hue_col, marker='o', ax=ax, palette=palette)
+        ax.set_xlabel(x_col)
+        ax.set_ylabel(y_col)
+    except Exception as e:
+        logger.error(f"Error rendering line chart with Seaborn: {e}", exc_info=True)
+        raise ValueError(f"Failed to render line chart: {e}")
+
+def render_scatter_chart(ax: plt.Axes, df: pd.DataFrame, metadata: Dict[str, Any]):
+    """Render a scatter chart using Seaborn on the provided Axes."""
+    x_col_meta = metadata.get("x_column")
+    y_col_meta = metadata.get("y_column")
+    hue_col_meta = metadata.get("color_column") # Use hue for color
+
+    # Get color mapping from metadata if provided (used if hue_col is set)
+    color_mapping = metadata.get("color_mapping")
+    palette = None
+    if isinstance(color_mapping, dict) and color_mapping and hue_col_meta:
+         # Ensure mapping keys exist in the hue column data
+         valid_mapping = {k: v for k, v in color_mapping.items() if k in df[hue_col_meta].unique()}
+         if valid_mapping:
+             palette = valid_mapping
+             logger.debug(f"Using provided color mapping (palette) for hue: {palette}")
+         else:
+             logger.warning(f"Provided color_mapping keys do not match hue categories ('{hue_col_meta}'). Using default palette.")
+
+    actual_cols = df.columns.tolist()
+    x_col = x_col_meta if x_col_meta in actual_cols else actual_cols[0] if len(actual_cols) > 0 else None
+    y_col = y_col_meta if y_col_meta in actual_cols else actual_cols[1] if len(actual_cols) > 1 else None
+    hue_col = hue_col_meta if hue_col_meta and hue_col_meta in actual_cols else None
+
+    if x_col != x_col_meta or y_col != y_col_meta:
+         logger.warning(f"Metadata columns ('{x_col_meta}', '{y_col_meta}') invalid. Falling back to ('{x_col}', '{y_col}').")
+
+    if not x_col or not y_col:
+        raise ValueError("Could not determine valid x and y columns for scatter chart")
+
+    logger.debug(f"Rendering scatter chart with x='{x_col}', y='{y_col}', hue='{hue_col}', palette='{bool(palette)}'")
+    try:
+        # Pass palette to scatterplot
+        sns.scatterplot(data=df, x=x_col, y=y_col, hue=hue_col, ax=ax, palette=palette)
+        ax.set_xlabel(x_col)
+        ax.set_ylabel(y_col)
+    except Exception as e:
+        logger.error(f"Error rendering scatter chart with Seaborn: {e}", exc_info=True)
+        raise ValueError(f"Failed to render scatter chart: {e}")
+
+
+# Dispatch table of supported chart types
+RENDERERS = {
+    "bar": render_bar_chart,
+    "pie": render_pie_chart,
+    "line": render_line_chart,
+    "scatter": render_scatter_chart,
+}
+
+
+def render_chart(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """Render a chart spec to a PNG file.
+
+    Args:
+        spec: Compact render spec with keys `columns`, `rows`, `metadata`, `chart_type`,
+            `title` and `output_path`
+
+    Returns:
+        Dictionary with the `output_path` of the written file
+
+    Raises:
+        ValueError: If the chart cannot be rendered or saved
+    """
+    chart_type = spec["chart_type"]
+    renderer = RENDERERS.get(chart_type)
+    if renderer is None:
+        raise ValueError(f"Unsupported chart type: {chart_type}")
+
+    df = create_dataframe(spec["columns"], spec["rows"])
+    output_path = Path(spec["output_path"])
+    fig = None
+    try:
+        # Create a new figure and axes for each plot
+        fig, ax = plt.subplots(figsize=(10, 6)) # Adjust figsize as needed
+        ax.set_title(spec["title"])
+        renderer(ax, df, spec["metadata"])
+
+        # --- Final Adjustments and Saving ---
+        logger.debug("Adjusting layout and saving figure...")
+        try:
+            # Improve layout and handle potentially long x-axis labels
+            plt.xticks(rotation=45, ha='right') # Rotate labels
+            plt.tight_layout() # Adjust layout to prevent overlap
+
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            # Save to a temporary file and rename it into place, so a content-addressed
+            # path never exposes a partially written PNG
+            tmp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+            try:
+                fig.savefig(str(tmp_path), format='png', bbox_inches='tight')
+                os.replace(tmp_path, output_path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+            logger.info(f"Chart saved successfully to {output_path}")
+        except Exception as save_err:
+            logger.error(f"Failed during figure saving: {save_err}", exc_info=True)
+            raise ValueError(f"Failed to save image file: {save_err}") from save_err
+    finally:
+        # IMPORTANT: Close the figure to release memory
+        if fig is not None:
+            plt.close(fig)
+            logger.debug("Closed Matplotlib figure.")
+
+    return {"output_path": str(output_path)}
@@ -0,0 +1,350 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.connection import get_async_db_engine, get_db_engine
+
+logger = logging.getLogger(__name__)
+
+HIERARCHY_DATABASE = "report_management"
+
+
+
+def hierarchy_scope(alias: str = "", organization: str = ":org_id") -> str:
+    """WHERE condition selecting the hierarchyCaches rows whose names can be resolved for an organization.
+
+    The organization's whole subtree (through the "hierarchyClosure" table) or, with
+    HIERARCHY_RESOLVE_SUBTREE off, the organization itself and its direct children.
+
+    Args:
+        alias: Alias of "hierarchyCaches" in the query, if any
+        organization: SQL expression of the organization id (the :org_id parameter by default)
+    """
+    prefix = f"{alias}." if alias else ""
+    if settings.HIERARCHY_RESOLVE_SUBTREE:
+        return f'{prefix}"id" IN (SELECT "descendantId" FROM "hierarchyClosure" WHERE "ancestorId" = {organization})'
+    return f'({prefix}"id" = {organization} OR {prefix}"parentId" = {organization})'
+
+
+# The organization and the locations under it, as resolvable names
+HIERARCHY_ROWS_QUERY = text(
+    'SELECT "id", "name", "parentId", "path" FROM "hierarchyCaches" '
+    f'WHERE "deletedAt" IS NULL AND {hierarchy_scope()}'
+)
+
+# Changes whenever a row of the same scope is added, updated, soft-deleted or removed
+HIERARCHY_WATERMARK_QUERY = text(
+    f'SELECT max("updatedAt"), max("deletedAt"), count(*) FROM "hierarchyCaches" WHERE {hierarchy_scope()}'
+)
+
+# The same watermark for many organizations in one round trip, in the order of :org_ids
+HIERARCHY_WATERMARKS_QUERY = text(f"""
+SELECT scope.ordinality, watermark.*
+FROM unnest(CAST(:org_ids AS uuid[])) WITH ORDINALITY AS scope(org_id, ordinality)
+CROSS JOIN LATERAL (
+    SELECT max(h."updatedAt"), max(h."deletedAt"), count(*) FROM "hierarchyCaches" h
+    WHERE {hierarchy_scope("h", "scope.org_id")}
+) AS watermark
+""")
+
+# Organizations with recent events, warmed at startup
+ACTIVE_ORGANIZATIONS_QUERY = text(
+    'SELECT "organizationId" FROM "5" WHERE "eventTimestamp" >= NOW() - make_interval(days => :days) '
+    'UNION SELECT "organizationId" FROM "8" WHERE "eventTimestamp" >= NOW() - make_interval(days => :days) '
+    'LIMIT :limit'
+)
+
+
+@dataclass
+class OrgHierarchy:
+    """Resolvable hierarchy entries of one organization, as parallel arrays."""
+
+    organization_id: str
+    ids: Tuple[str, ...]
+    names: Tuple[str, ...]
+    lower_names: Tuple[str, ...]
+    parent_ids: Tuple[Optional[str], ...]
+    paths: Tuple[Optional[Tuple[str, ...]], ...]
+    watermark: Tuple[Any, ...]
+    loaded_at: float = field(default_factory=time.monotonic)
+    # Lower-case name -> position of its first entry, for exact matches
+    by_lower_name: Dict[str, int] = field(default_factory=dict)
+    # Lower-case names shared by several entries -> all their positions
+    duplicate_names: Dict[str, Tuple[int, ...]] = field(default_factory=dict)
+    # Structures derived lazily by the name matcher (processed names, n-gram matrix)
+    matcher_state: Dict[str, Any] = field(default_factory=dict, repr=False)
+    # Too many entries to hold in memory: no names are loaded and matching runs in Postgres
+    server_side: bool = False
+
+    def __post_init__(self) -> None:
+        for position, lower_name in enumerate(self.lower_names):
+            first = self.by_lower_name.setdefault(lower_name, position)
+            if first != position:
+                self.duplicate_names[lower_name] = self.duplicate_names.get(lower_name, (first,)) + (position,)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, organization_id: str, rows: List[Any], watermark: Tuple[Any, ...], server_side: bool = False) -> "OrgHierarchy":
+        """Build the arrays from (id, name, parentId, path) rows."""
+        rows = [row for row in rows if row[1]]
+        return cls(
+            organization_id=organization_id,
+            ids=tuple(str(row[0]) for row in rows),
+            names=tuple(row[1] for row in rows),
+            lower_names=tuple(row[1].lower() for row in rows),
+            parent_ids=tuple(str(row[2]) if row[2] is not None else None for row in rows),
+            paths=tuple(tuple(str(node) for node in row[3]) if row[3] is not None else None for row in rows),
+            watermark=watermark,
+            server_side=server_side,
+        )
+
+    def exact(self, name: str) -> Optional[int]:
+        """Position of the entry whose name equals name case-insensitively, or None."""
+        return self.by_lower_name.get(name.lower())
+
+    def exact_all(self, name: str) -> Tuple[int, ...]:
+        """Positions of all entries whose name equals name case-insensitively."""
+        lower_name = name.lower()
+        if lower_name in self.duplicate_names:
+            return self.duplicate_names[lower_name]
+        position = self.by_lower_name.get(lower_name)
+        return (position,) if position is not None else ()
+
+
+class HierarchyIndex:
+    """Shared in-memory index of every active organization's hierarchy names.
+
+    Entries are loaded on first use (or warmed at startup for organizations with recent events) and
+    kept until their hierarchy changes: a background task probes max("updatedAt"), max("deletedAt")
+    and the row count of all cached organizations (in one query) every `refresh_interval_seconds`
+    and reloads the ones that changed. Entries older than `ttl_seconds` are reloaded regardless.
+
+    Organizations with at least `server_match_min_entries` entries are cached without their names
+    (`server_side=True`); the resolver matches those in Postgres with pg_trgm instead.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        refresh_interval_seconds: float,
+        max_orgs: int,
+        warm_active_days: int,
+        server_match_min_entries: int = 0,
+    ):
+        """Create the index.
+
+        Args:
+            ttl_seconds: Reload an organization's hierarchy at least this often
+            refresh_interval_seconds: Time between change probes of the cached organizations
+            max_orgs: Maximum number of organizations kept in memory (least recently used are dropped)
+            warm_active_days: At startup, load organizations with events in this many days (0 = none)
+            server_match_min_entries: Do not load hierarchies with this many entries or more (0 = load all)
+        """
+        self.ttl_seconds = ttl_seconds
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.warm_active_days = warm_active_days
+        self.max_orgs = max_orgs
+        self.server_match_min_entries = server_match_min_entries
+        self.orgs: TTLCache[OrgHierarchy] = TTLCache(name="hierarchy_index", max_size=max_orgs)
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.reloads = 0
+        self.probes = 0
+        self.failures = 0
+        self.warmed = 0
+
+    def _is_stale(self, hierarchy: OrgHierarchy) -> bool:
+        return bool(self.ttl_seconds) and time.monotonic() - hierarchy.loaded_at > self.ttl_seconds
+
+    def _is_server_side(self, watermark: Tuple[Any, ...]) -> bool:
+        # The watermark's row count covers the same scope as the names that would be loaded
+        return bool(self.server_match_min_entries) and (watermark[2] or 0) >= self.server_match_min_entries
+
+    # --- Loading ---
+
+    def _store(self, organization_id: str, rows: List[Any], watermark: Tuple[Any, ...]) -> OrgHierarchy:
+        server_side = self._is_server_side(watermark)
+        hierarchy = OrgHierarchy.from_rows(organization_id, rows, watermark, server_side=server_side)
+        self.orgs.set(organization_id, hierarchy)
+        self.loads += 1
+        if server_side:
+            logger.debug(f"Organization {organization_id} has {watermark[2]} hierarchy entries, matching its names in the database")
+        else:
+            logger.debug(f"Loaded {len(hierarchy)} hierarchy entries for organization {organization_id}")
+        return hierarchy
+
+    async def _aload(self, organization_id: str) -> OrgHierarchy:
+        engine = get_async_db_engine(HIERARCHY_DATABASE)
+        if not engine:
+            raise RuntimeError(f"Database engine '{HIERARCHY_DATABASE}' not configured.")
+        async with engine.connect() as conn:
+            watermark = tuple((await conn.execute(HIERARCHY_WATERMARK_QUERY, {"org_id": organization_id})).one())
+            rows = [] if self._is_server_side(watermark) else (await conn.execute(HIERARCHY_ROWS_QUERY, {"org_id": organization_id})).fetchall()
+        return self._store(organization_id, rows, watermark)
+
+    def _load(self, organization_id: str) -> OrgHierarchy:
+        engine = get_db_engine(HIERARCHY_DATABASE)
+        if not engine:
+            raise RuntimeError(f"Database engine '{HIERARCHY_DATABASE}' not configured.")
+        with engine.connect() as conn:
+            watermark = tuple(conn.execute(HIERARCHY_WATERMARK_QUERY, {"org_id": organization_id}).one())
+            rows = [] if self._is_server_side(watermark) else conn.execute(HIERARCHY_ROWS_QUERY, {"org_id": organization_id}).fetchall()
+        return self._store(organization_id, rows, watermark)
+
+    async def aget(self, organization_id: str) -> OrgHierarchy:
+        """Hierarchy of an organization, loading it on a miss (concurrent misses share one query).
+
+        Raises:
+            Exception: If the hierarchy is not cached and could not be loaded
+        """
+        hierarchy = self.orgs.get(organization_id)
+        if hierarchy is not None and not self._is_stale(hierarchy):
+            return hierarchy
+        pending = self._loading.get(organization_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.ensure_future(self._aload(organization_id))
+        self._loading[organization_id] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._loading.pop(organization_id, None)
+
+    def get(self, organization_id: str) -> OrgHierarchy:
+        """Synchronous version of aget, for the tools' sync code path."""
+        hierarchy = self.orgs.get(organization_id)
+        if hierarchy is not None and not self._is_stale(hierarchy):
+            return hierarchy
+        return self._load(organization_id)
+
+    def invalidate(self, organization_id: Optional[str] = None) -> None:
+        """Drop one organization's hierarchy, or all of them, so the next lookup reloads it."""
+        if organization_id is None:
+            self.orgs.clear()
+        else:
+            self.orgs.invalidate(organization_id)
+
+    # --- Background refresh ---
+
+    async def refresh(self) -> None:
+        """Reload the cached organizations whose hierarchy changed or whose entry is older than the TTL."""
+        engine = get_async_db_engine(HIERARCHY_DATABASE)
+        if not engine:
+            return
+        changed, cached = [], []
+        for organization_id in self.orgs.keys():
+            hierarchy = self.orgs.peek(organization_id)
+            if hierarchy is None:
+                continue
+            if self._is_stale(hierarchy):
+                changed.append(organization_id)
+            else:
+                cached.append((organization_id, hierarchy))
+        if cached:
+            # One query probes every cached organization
+            async with engine.connect() as conn:
+                rows = (await conn.execute(HIERARCHY_WATERMARKS_QUERY, {"org_ids": [org for org, _ in cached]})).fetchall()
+            self.probes += len(cached)
+            watermarks = {ordinality: tuple(watermark) for ordinality, *watermark in rows}
+            changed.extend(
+                organization_id for ordinality, (organization_id, hierarchy) in enumerate(cached, 1)
+                if watermarks.get(ordinality) != hierarchy.watermark
+            )
+        reloaded = 0
+        for organization_id in changed:
+            try:
+                await self._aload(organization_id)
+                self.reloads += 1
+                reloaded += 1
+            except Exception as e:
+                # Keep serving the previous hierarchy; it is probed again on the next run
+                self.failures += 1
+                logger.error(f"Could not reload hierarchy index for organization {organization_id}: {str(e)}")
+        if reloaded:
+            logger.info(f"Reloaded hierarchy index for {reloaded} organization(s)")
+
+    async def warm(self) -> None:
+        """Load the hierarchies of organizations with events in the last warm_active_days days."""
+        if self.warm_active_days <= 0:
+            return
+        engine = get_async_db_engine(HIERARCHY_DATABASE)
+        if not engine:
+            return
+        started = time.perf_counter()
+        async with engine.connect() as conn:
+            rows = (await conn.execute(ACTIVE_ORGANIZATIONS_QUERY, {"days": self.warm_active_days, "limit": self.max_orgs})).fetchall()
+        for (organization_id,) in rows:
+            if organization_id is None:
+                continue
+            try:
+                await self._aload(str(organization_id))
+                self.warmed += 1
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Could not warm hierarchy index for organization {organization_id}: {str(e)}")
+        logger.info(f"Warmed hierarchy index for {self.warmed} organization(s) in {time.perf_counter() - started:.2f}s")
+
+    async def _run_periodically(self) -> None:
+        try:
+            await self.warm()
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Hierarchy index warm-up failed: {str(e)}", exc_info=True)
+        while True:
+            await asyncio.sleep(self.refresh_interval_seconds)
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Hierarchy index refresh failed: {str(e)}", exc_info=True)
+
+    async def start(self) -> None:
+        """Warm the index and start the background refresher (does not wait for the warm-up)."""
+        if not get_async_db_engine(HIERARCHY_DATABASE):
+            logger.warning(f"No async engine for '{HIERARCHY_DATABASE}', hierarchy index loads on demand only.")
+            return
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_periodically())
+
+    async def stop(self) -> None:
+        """Stop the background refresher."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the index counters."""
+        return {
+            "organizations": len(self.orgs),
+            "server_side_organizations": sum(1 for key in self.orgs.keys() if getattr(self.orgs.peek(key), "server_side", False)),
+            "entries": sum(len(self.orgs.peek(key) or ()) for key in self.orgs.keys()),
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "warmed": self.warmed,
+            "probes": self.probes,
+            "failures": self.failures,
+            "cache": self.orgs.stats(),
+        }
+
+
+# Shared index used by HierarchyNameResolverTool
+hierarchy_index = HierarchyIndex(
+    ttl_seconds=settings.HIERARCHY_INDEX_TTL_SECONDS,
+    refresh_interval_seconds=settings.HIERARCHY_INDEX_REFRESH_INTERVAL_SECONDS,
+    max_orgs=settings.HIERARCHY_INDEX_MAX_ORGS,
+    warm_active_days=settings.HIERARCHY_INDEX_WARM_ACTIVE_DAYS,
+    server_match_min_entries=settings.HIERARCHY_SERVER_MATCH_MIN_ENTRIES,
+)
@@ -0,0 +1,135 @@
+"""
+Batch fuzzy matching of user-provided names against an organization's hierarchy names.
+
+All candidates are scored against all names in one vectorized pass: with rapidfuzz, a `cdist` matrix
+of WRatio scores (the fuzzywuzzy scorer the resolver used before, in C++); without it, a NumPy
+character-trigram index scored with the same "best of full and partial match" idea. Both return
+0-100 scores, best first. For large hierarchies WRatio only rescores each candidate's best trigram
+matches, which keeps a 10k-name lookup around a millisecond (see benchmarks/hierarchy_matcher.py).
+"""
+import logging
+import zlib
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from rapidfuzz import fuzz, process, utils
+except ImportError:  # Optional, the NumPy trigram scorer is used instead
+    fuzz = process = utils = None
+
+from app.langchain.tools.hierarchy_index import OrgHierarchy
+
+logger = logging.getLogger(__name__)
+
+BACKEND = "rapidfuzz" if process is not None else "ngram"
+
+# Width of the hashed trigram vectors of the NumPy fallback
+NGRAM_DIMENSIONS = 1024
+
+# Same weight fuzzywuzzy/rapidfuzz WRatio give partial matches ("Argyle" in "Argyle Branch")
+PARTIAL_MATCH_WEIGHT = 0.9
+
+# From this many names on, WRatio only rescores the best trigram matches of each candidate
+SHORTLIST_MIN_NAMES = 500
+SHORTLIST_SIZE = 50
+
+
+def _normalize(name: str) -> str:
+    """Lower-case, alphanumerics only, single spaces (what WRatio's default processor does)."""
+    return " ".join("".join(char if char.isalnum() else " " for char in name.lower()).split())
+
+
+def _trigrams(name: str) -> List[int]:
+    padded = f"  {_normalize(name)} "
+    return sorted({zlib.crc32(padded[i:i + 3].encode("utf-8")) % NGRAM_DIMENSIONS for i in range(len(padded) - 2)})
+
+
+def _ngram_index(names: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Binary (NGRAM_DIMENSIONS x len(names)) trigram incidence matrix and the trigram count of each name.
+
+    Stored trigram-major, so scoring a query only sums the few rows of its own trigrams.
+    """
+    index = np.zeros((NGRAM_DIMENSIONS, len(names)), dtype=np.uint8)
+    for column, name in enumerate(names):
+        index[_trigrams(name), column] = 1
+    return index, index.sum(axis=0, dtype=np.float32)
+
+
+def _ngram_scores(hierarchy: OrgHierarchy, candidates: Sequence[str]) -> np.ndarray:
+    state = hierarchy.matcher_state.get("ngrams")
+    if state is None:
+        state = _ngram_index(hierarchy.names)
+        hierarchy.matcher_state["ngrams"] = state
+    index, name_sizes = state
+    scores = np.zeros((len(candidates), len(name_sizes)), dtype=np.float32)
+    for row, candidate in enumerate(candidates):
+        trigrams = _trigrams(candidate)
+        shared = index[trigrams].sum(axis=0, dtype=np.float32)
+        dice = 2 * shared / np.maximum(len(trigrams) + name_sizes, 1)
+        containment = shared / max(len(trigrams), 1)
+        scores[row] = 100 * np.maximum(dice, PARTIAL_MATCH_WEIGHT * containment)
+    return scores
+
+
+def _processed_names(hierarchy: OrgHierarchy) -> List[str]:
+    names = hierarchy.matcher_state.get("processed")
+    if names is None:
+        names = [utils.default_process(name) for name in hierarchy.names]
+        hierarchy.matcher_state["processed"] = names
+    return names
+
+
+def _rapidfuzz_scores(hierarchy: OrgHierarchy, candidates: Sequence[str]) -> np.ndarray:
+    queries = [utils.default_process(candidate) for candidate in candidates]
+    return process.cdist(queries, _processed_names(hierarchy), scorer=fuzz.WRatio, dtype=np.float32)
+
+
+def _shortlisted_scores(hierarchy: OrgHierarchy, candidates: Sequence[str]) -> np.ndarray:
+    """WRatio scores of each candidate's SHORTLIST_SIZE best trigram matches (0 for all other names)."""
+    names = _processed_names(hierarchy)
+    shortlists = np.argpartition(-_ngram_scores(hierarchy, candidates), SHORTLIST_SIZE - 1, axis=1)[:, :SHORTLIST_SIZE]
+    scores = np.zeros((len(candidates), len(names)), dtype=np.float32)
+    for row, (candidate, shortlist) in enumerate(zip(candidates, shortlists)):
+        shortlisted_names = [names[position] for position in shortlist]
+        scores[row, shortlist] = process.cdist([utils.default_process(candidate)], shortlisted_names, scorer=fuzz.WRatio, dtype=np.float32)[0]
+    return scores
+
+
+def score_matrix(hierarchy: OrgHierarchy, candidates: Sequence[str]) -> np.ndarray:
+    """(len(candidates) x len(hierarchy)) matrix of 0-100 similarity scores."""
+    if process is None:
+        return _ngram_scores(hierarchy, candidates)
+    if len(hierarchy) >= SHORTLIST_MIN_NAMES:
+        return _shortlisted_scores(hierarchy, candidates)
+    return _rapidfuzz_scores(hierarchy, candidates)
+
+
+def match_names(
+    hierarchy: OrgHierarchy,
+    candidates: Sequence[str],
+    top_k: int = 3,
+    min_score: float = 0,
+) -> List[List[Tuple[int, float]]]:
+    """Best hierarchy entries for each candidate name.
+
+    Args:
+        hierarchy: Organization hierarchy to match against
+        candidates: Names as the user wrote them
+        top_k: Maximum number of matches per candidate
+        min_score: Drop matches scoring below this (0-100)
+
+    Returns:
+        For each candidate, (position in hierarchy, score) pairs, best first
+    """
+    if not candidates or not len(hierarchy):
+        return [[] for _ in candidates]
+    scores = score_matrix(hierarchy, candidates)
+    k = min(top_k, scores.shape[1])
+    # Unordered top k per row, then sorted (by score, ties by position) within those k
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    results = []
+    for row, positions in enumerate(best):
+        ranked = sorted(((int(position), float(scores[row, position])) for position in positions), key=lambda item: (-item[1], item[0]))
+        results.append([(position, round(score, 1)) for position, score in ranked if score >= min_score])
+    return results
@@ -1,17 +1,19 @@
 import logging
 from typing import Type, List, Dict, Any, Optional
-import sqlalchemy 
-from sqlalchemy.engine import Connection 
 from pydantic import BaseModel, Field 
 
 from langchain_core.tools import BaseTool
-from fuzzywuzzy import process # Using fuzzywuzzy for matching
 
-
-from app.db.connection import get_db_engine 
+from app.core.config import settings
+from app.langchain.tools.hierarchy_index import OrgHierarchy, hierarchy_index
+from app.langchain.tools.hierarchy_matcher import match_names
+from app.langchain.tools.hierarchy_trigram import hierarchy_trigram_search
 
 logger = logging.getLogger(__name__)
 
+# Name the agent calls the tool by (the graph routes on it)
+RESOLVER_TOOL_NAME = "hierarchy_name_resolver"
+
 # --- Input Schema ---
 class HierarchyResolverInput(BaseModel):
     name_candidates: List[str] = Field(description="A list of potential hierarchy names (e.g., branch names, library names) mentioned by the user.")
@@ -22,156 +24,165 @@ class HierarchyResolverInput(BaseModel):
 # --- Tool Implementation ---
 class HierarchyNameResolverTool(BaseTool):
     """Tool to resolve potentially fuzzy user-provided hierarchy names (like branches, libraries)
-    against the exact names stored in the 'hierarcyCaches' table for the organization associated with the request context.
+    against the exact names stored in the 'hierarcyCaches' table for the organization associated with the request context
+    (anywhere in its subtree).
     It uses fuzzy matching to find the best match and returns the exact database name, ID, and matching score."""
-    name: str = "hierarchy_name_resolver"
+    name: str = RESOLVER_TOOL_NAME
     description: str = (
         "Resolves user-provided hierarchy entity names (e.g., 'Main Library', 'Argyle') against the exact names "
         "in the database for the relevant organization. Use this *before* querying data if the user mentions "
         "specific branches, libraries, or other hierarchy entities by name. Returns a mapping of input names "
-        "to their resolved database name, ID, and matching score."
+        "to their resolved database name, ID, and matching score, plus the closest alternative names (`matches`). "
+        "A status of 'ambiguous' means several entries match about equally well; ask the user which one is meant."
     )
     args_schema: Type[BaseModel] = HierarchyResolverInput
     # user_id: str # Removed
     organization_id: str # Passed during instantiation for context, **used internally**
     min_score_threshold: int = 85
+    top_k: int = settings.HIERARCHY_MATCH_TOP_K # Close matches returned per name, for disambiguation
+    min_suggestion_score: int = settings.HIERARCHY_MATCH_MIN_SUGGESTION_SCORE
+    ambiguity_margin: int = settings.HIERARCHY_MATCH_AMBIGUITY_MARGIN
     db_name: str = "report_management" # Assume we always use this DB for hierarchy
 
     def _run(self, name_candidates: List[str], **kwargs: Any) -> Dict[str, Any]: # Removed organization_id param
-        """Synchronous execution. Mirrors the pattern in SQLQueryTool."""
-        logger.warning("Running HierarchyNameResolverTool synchronously.")
+        """Synchronous execution. Answers from the shared hierarchy index, loading it on a miss."""
         # Use self.organization_id from the tool's context
         org_id_to_use = self.organization_id
-        engine = get_db_engine(self.db_name)
-        if not engine:
-            logger.error(f"Database engine for '{self.db_name}' not found for sync execution.")
-            return self._format_error_output(f"Database engine '{self.db_name}' not configured.", name_candidates)
-
         try:
-            # Get connection using context manager, same as sql_tool
-            with engine.connect() as connection:
-                 # Pass the organization_id from the tool's internal state
-                 return self._execute_logic(connection, name_candidates, org_id_to_use)
+            hierarchy = hierarchy_index.get(org_id_to_use)
         except Exception as e:
-            logger.error(f"Error during synchronous hierarchy resolution: {e}", exc_info=True)
-            return self._format_error_output(f"Failed during sync execution: {str(e)}", name_candidates)
+            return self._format_fetch_error(e, name_candidates, org_id_to_use)
+        if hierarchy.server_side:
+            try:
+                matches = hierarchy_trigram_search.search(org_id_to_use, name_candidates, self.top_k, self.min_suggestion_score)
+            except Exception as e:
+                return self._format_fetch_error(e, name_candidates, org_id_to_use)
+            return self._resolve(name_candidates, dict(zip(name_candidates, matches)), set(), {})
+        return self._match_candidates(hierarchy, name_candidates, org_id_to_use)
 
     async def _arun(self, name_candidates: List[str], **kwargs: Any) -> Dict[str, Any]: # Removed organization_id param
-        """Resolve names asynchronously. Mirrors the pattern in SQLQueryTool's _run method structure."""
+        """Resolve names asynchronously from the shared hierarchy index (no database round trip once it is loaded)."""
         # Use self.organization_id from the tool's context for logging and execution
         org_id_to_use = self.organization_id
         logger.info(f"Executing Hierarchy Name Resolver for org {org_id_to_use} with candidates: {name_candidates}")
-        engine = get_db_engine(self.db_name)
-        if not engine:
-            logger.error(f"Database engine for '{self.db_name}' not found.")
-            return self._format_error_output(f"Database engine '{self.db_name}' not configured.", name_candidates)
-
         try:
-            # Use engine.connect() within context manager - works with asyncpg driver
-            with engine.connect() as connection:
-                # Pass the connection object and the organization_id from the tool's internal state
-                return self._execute_logic(connection, name_candidates, org_id_to_use)
+            hierarchy = await hierarchy_index.aget(org_id_to_use)
         except Exception as e:
-            logger.error(f"Error during async hierarchy resolution: {e}", exc_info=True)
-            return self._format_error_output(f"Failed during async execution: {str(e)}", name_candidates)
+            return self._format_fetch_error(e, name_candidates, org_id_to_use)
+        if hierarchy.server_side:
+            # Too large to hold in memory: one pg_trgm query matches all candidates in the database
+            try:
+                matches = await hierarchy_trigram_search.asearch(org_id_to_use, name_candidates, self.top_k, self.min_suggestion_score)
+            except Exception as e:
+                return self._format_fetch_error(e, name_candidates, org_id_to_use)
+            return self._resolve(name_candidates, dict(zip(name_candidates, matches)), set(), {})
+        return self._match_candidates(hierarchy, name_candidates, org_id_to_use)
 
-    # Renamed helper function for clarity, now takes the Connection object
-    # Signature remains the same, it receives the org_id from _run/_arun
-    def _execute_logic(self, connection: Connection, name_candidates: List[str], organization_id: str) -> Dict[str, Any]:
-        """Core logic to fetch data and perform fuzzy matching using a SQLAlchemy Connection."""
+    def _format_fetch_error(self, e: Exception, name_candidates: List[str], organization_id: str) -> Dict[str, Any]:
+        """Error output when the hierarchy rows could not be fetched."""
+        logger.error(f"Database error fetching hierarchy cache for organization {organization_id} and children: {e}", exc_info=True)
         resolved_map: Dict[str, Dict[str, Any]] = {}
-        hierarchy_cache_data: List[Dict[str, Any]] = []
+        db_error_msg = f"DB error fetching org/children cache: {str(e)}"
+        for name in name_candidates:
+             resolved_map[name] = {"status": "error", "error_message": db_error_msg, "resolved_name": None, "id": None, "score": 0}
+        return {"resolution_results": resolved_map, "error": f"Database error fetching org/children hierarchy data: {str(e)}"}
 
-        # 1. Fetch hierarchy names belonging ONLY to the specified organization OR its direct children
-        try:
-            # Select ID and Name for non-deleted entries where the ID is the org ID itself,
-            # OR the parentId is the org ID (i.e., direct children/locations).
-            query = sqlalchemy.text(
-                'SELECT "id", "name" FROM "hierarchyCaches" ' \
-                'WHERE "deletedAt" IS NULL AND (id = :org_id OR "parentId" = :org_id)'
-            )
-            # Pass the organization_id as a parameter
-            result = connection.execute(query, {"org_id": organization_id})
-            hierarchy_cache_data = [{"id": str(row.id), "name": row.name} for row in result.mappings()]
-            logger.debug(f"Retrieved {len(hierarchy_cache_data)} hierarchy entries (org + direct children) for organization {organization_id}.")
-
-            if not hierarchy_cache_data:
-                 logger.warning(f"No hierarchy entries found for organization {organization_id} or its direct children. Cannot resolve names.")
-                 for name in name_candidates:
-                      resolved_map[name] = {"status": "no_hierarchy_data", "resolved_name": None, "id": None, "score": 0}
-                 return {"resolution_results": resolved_map}
+    def _match_candidates(self, hierarchy: OrgHierarchy, name_candidates: List[str], organization_id: str) -> Dict[str, Any]:
+        """Match candidate names against the organization's hierarchy entries (exact first, then fuzzy)."""
+        resolved_map: Dict[str, Dict[str, Any]] = {}
+        logger.debug(f"Matching against {len(hierarchy)} hierarchy entries for organization {organization_id}.")
 
-        except Exception as e:
-            logger.error(f"Database error fetching hierarchy cache for organization {organization_id} and children: {e}", exc_info=True)
-            db_error_msg = f"DB error fetching org/children cache: {str(e)}"
-            for name in name_candidates:
-                 resolved_map[name] = {"status": "error", "error_message": db_error_msg, "resolved_name": None, "id": None, "score": 0}
-            return {"resolution_results": resolved_map, "error": f"Database error fetching org/children hierarchy data: {str(e)}"}
-
-        # 2. Create lookups for matching
-        # Exact (case-insensitive) lookup
-        exact_match_lookup = {entry["name"].lower(): {"id": entry["id"], "name": entry["name"]} for entry in hierarchy_cache_data}
-        # List for fuzzy matching
-        fuzzy_match_name_list = [entry["name"] for entry in hierarchy_cache_data]
-        fuzzy_match_id_lookup = {entry["name"]: entry["id"] for entry in hierarchy_cache_data}
+        if not len(hierarchy):
+             logger.warning(f"No hierarchy entries found for organization {organization_id}. Cannot resolve names.")
+             for name in name_candidates:
+                  resolved_map[name] = {"status": "no_hierarchy_data", "resolved_name": None, "id": None, "score": 0}
+             return {"resolution_results": resolved_map}
 
+        # 2. Exact (case-insensitive) matches first, then all remaining candidates in one batch
+        exact_positions = {candidate: hierarchy.exact(candidate) for candidate in name_candidates}
+        fuzzy_candidates = [candidate for candidate, position in exact_positions.items() if position is None]
+        try:
+            fuzzy_matches = dict(zip(fuzzy_candidates, match_names(hierarchy, fuzzy_candidates, self.top_k, self.min_suggestion_score)))
+        except Exception as e:
+            logger.error(f"Error during batch matching of candidates {fuzzy_candidates}: {e}", exc_info=True)
+            fuzzy_matches = {}
+            for candidate in fuzzy_candidates:
+                resolved_map[candidate] = {
+                    "status": "error",
+                    "error_message": f"Matching error: {str(e)}",
+                    "resolved_name": None,
+                    "id": None,
+                    "score": 0
+                }
+
+        matches_by_candidate: Dict[str, List[tuple]] = {}
+        for candidate in name_candidates:
+            exact_position = exact_positions[candidate]
+            if exact_position is not None:
+                positions = [(position, 100) for position in hierarchy.exact_all(candidate)][:self.top_k] # Assign 100 for exact match(es)
+            else:
+                positions = fuzzy_matches.get(candidate, [])
+            matches_by_candidate[candidate] = [(hierarchy.ids[position], hierarchy.names[position], score) for position, score in positions]
+        exact_candidates = {candidate for candidate, position in exact_positions.items() if position is not None}
+        return self._resolve(name_candidates, matches_by_candidate, exact_candidates, resolved_map)
+
+    def _resolve(
+        self,
+        name_candidates: List[str],
+        matches_by_candidate: Dict[str, List[tuple]],
+        exact_candidates: set,
+        resolved_map: Dict[str, Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Build the resolution results from each candidate's (id, name, score) matches, best first.
+
+        The same output is produced whether the matches were computed in memory or in the database.
+        """
         # 3. Process each candidate name
         for candidate in name_candidates:
-            matched = False
-            try:
-                # Prioritize exact (case-insensitive) match
-                exact_match_info = exact_match_lookup.get(candidate.lower())
-                if exact_match_info:
-                    matched_name = exact_match_info["name"]
-                    matched_id = exact_match_info["id"]
-                    logger.info(f"Resolved '{candidate}' to '{matched_name}' (ID: {matched_id}) via exact match.")
-                    resolved_map[candidate] = {
-                        "status": "found",
-                        "resolved_name": matched_name,
-                        "id": matched_id,
-                        "score": 100 # Assign 100 for exact match
-                    }
-                    matched = True
-                
-                # If no exact match, try fuzzy matching
-                if not matched:
-                    best_match = process.extractOne(candidate, fuzzy_match_name_list, score_cutoff=self.min_score_threshold)
-                    if best_match:
-                        matched_name, score = best_match
-                        matched_id = fuzzy_match_id_lookup[matched_name]
-                        logger.info(f"Resolved '{candidate}' to '{matched_name}' (ID: {matched_id}) with fuzzy score {score}")
-                        resolved_map[candidate] = {
-                            "status": "found",
-                            "resolved_name": matched_name,
-                            "id": matched_id,
-                            "score": score
-                        }
-                        matched = True
-                    
-                # If still no match (neither exact nor fuzzy above threshold)
-                if not matched:
-                    logger.warning(f"Could not resolve '{candidate}' via exact or fuzzy match (score >= {self.min_score_threshold})")
-                    resolved_map[candidate] = {
-                        "status": "not_found",
-                        "resolved_name": None,
-                        "id": None,
-                        "score": 0
-                    }
-
-            except Exception as e:
-                 logger.error(f"Error during matching process for candidate '{candidate}': {e}", exc_info=True)
-                 resolved_map[candidate] = {
-                     "status": "error",
-                     "error_message": f"Matching error: {str(e)}",
-                     "resolved_name": None,
-                     "id": None,
-                     "score": 0
-                 }
+            if candidate in resolved_map:
+                continue
+            matches = matches_by_candidate.get(candidate, [])
+            suggestions = [
+                {"resolved_name": name, "id": hierarchy_id, "score": int(round(score))}
+                for hierarchy_id, name, score in matches
+            ]
+
+            if self._is_ambiguous(matches):
+                # Several entries (e.g. same-named branches of different library systems) match about equally
+                logger.warning(f"'{candidate}' is ambiguous: {[suggestion['resolved_name'] for suggestion in suggestions]}")
+                resolved_map[candidate] = {
+                    "status": "ambiguous",
+                    "resolved_name": None,
+                    "id": None,
+                    "score": 0,
+                    "matches": suggestions
+                }
+            elif matches and matches[0][2] >= self.min_score_threshold:
+                best = suggestions[0]
+                how = "exact match" if candidate in exact_candidates else f"fuzzy score {best['score']}"
+                logger.info(f"Resolved '{candidate}' to '{best['resolved_name']}' (ID: {best['id']}) via {how}.")
+                resolved_map[candidate] = {"status": "found", **best, "matches": suggestions}
+            else:
+                # Neither exact nor fuzzy above threshold; close names are returned so the agent can ask the user
+                logger.warning(f"Could not resolve '{candidate}' via exact or fuzzy match (score >= {self.min_score_threshold})")
+                resolved_map[candidate] = {
+                    "status": "not_found",
+                    "resolved_name": None,
+                    "id": None,
+                    "score": 0,
+                    "matches": suggestions
+                }
 
         logger.debug(f"Hierarchy name resolution completed. Result map: {resolved_map}")
         # Final successful return structure
         return {"resolution_results": resolved_map}
 
+    def _is_ambiguous(self, matches: List[tuple]) -> bool:
+        """True if the two best (id, name, score) matches both pass the threshold within ambiguity_margin of each other."""
+        if len(matches) < 2 or matches[1][2] < self.min_score_threshold:
+            return False
+        return matches[0][2] - matches[1][2] <= self.ambiguity_margin
+
     # Helper to format error outputs consistently
     def _format_error_output(self, error_message: str, name_candidates: List[str]) -> Dict[str, Any]:
         """Formats the error output to match the expected structure."""
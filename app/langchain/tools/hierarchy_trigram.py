@@ -0,0 +1,153 @@
+"""
+Server-side fuzzy matching of hierarchy names with pg_trgm, for organizations too large to hold in memory.
+
+All candidate names go to Postgres in one round trip: `unnest` turns the candidate array into rows and
+a LATERAL subquery returns the top-k names of each one, found through the GIN trigram index on
+lower("name") (migration 0002). Scores use the same formula as the in-process NumPy scorer
+(hierarchy_matcher): the best of the Dice coefficient of the trigram sets (derived from pg_trgm's
+Jaccard `similarity`) and a down-weighted `word_similarity` for partial names, on a 0-100 scale.
+"""
+import logging
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+from sqlalchemy import text
+
+from app.db.connection import get_async_db_engine, get_db_engine
+from app.langchain.tools.hierarchy_index import HIERARCHY_DATABASE, hierarchy_scope
+from app.langchain.tools.hierarchy_matcher import PARTIAL_MATCH_WEIGHT
+
+logger = logging.getLogger(__name__)
+
+# Lowest pg_trgm thresholds used, so a low suggestion score never turns the index scan into a full scan
+MIN_TRIGRAM_THRESHOLD = 0.1
+
+# Thresholds of the `%` / `<%` operators for this transaction only (the operators cannot take parameters)
+TRIGRAM_THRESHOLDS_QUERY = text(
+    "SELECT set_config('pg_trgm.similarity_threshold', :similarity, true), "
+    "set_config('pg_trgm.word_similarity_threshold', :word_similarity, true)"
+)
+
+# Top-k names per candidate, in the same scope as the in-memory index
+TRIGRAM_MATCH_QUERY = text(f"""
+SELECT candidate.ordinality, match."id", match."name", match.score
+FROM unnest(CAST(:candidates AS text[])) WITH ORDINALITY AS candidate(name, ordinality)
+CROSS JOIN LATERAL (
+    SELECT h."id", h."name",
+           greatest(
+               2 * similarity(lower(h."name"), candidate.name) / (1 + similarity(lower(h."name"), candidate.name)),
+               CAST(:partial_weight AS real) * word_similarity(candidate.name, lower(h."name"))
+           ) AS score
+    FROM "hierarchyCaches" h
+    WHERE h."deletedAt" IS NULL
+      AND {hierarchy_scope("h")}
+      AND (lower(h."name") % candidate.name OR candidate.name <% lower(h."name"))
+    ORDER BY score DESC, h."id"
+    LIMIT :top_k
+) AS match
+ORDER BY candidate.ordinality, match.score DESC, match."id"
+""")
+
+
+class HierarchyTrigramSearch:
+    """Top-k hierarchy name matches computed in Postgres with pg_trgm (one query for all candidates)."""
+
+    def __init__(self, db_name: str = HIERARCHY_DATABASE):
+        self.db_name = db_name
+        self.searches = 0
+        self.failures = 0
+        self.search_seconds = 0.0
+
+    @staticmethod
+    def _parameters(organization_id: str, candidates: Sequence[str], top_k: int, min_score: float) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        # A score of min_score is reached with a Dice coefficient of d (Jaccard d / (2 - d)) or a word
+        # similarity of min_score / PARTIAL_MATCH_WEIGHT, so the operators can prefilter on both
+        dice = min(max(min_score / 100, 0.0), 1.0)
+        thresholds = {
+            "similarity": str(max(dice / (2 - dice), MIN_TRIGRAM_THRESHOLD)),
+            "word_similarity": str(min(max(dice / PARTIAL_MATCH_WEIGHT, MIN_TRIGRAM_THRESHOLD), 1.0)),
+        }
+        parameters = {
+            "candidates": [candidate.lower() for candidate in candidates],
+            "org_id": organization_id,
+            "partial_weight": PARTIAL_MATCH_WEIGHT,
+            "top_k": top_k,
+        }
+        return thresholds, parameters
+
+    @staticmethod
+    def _group(rows: List[Any], count: int, min_score: float) -> List[List[Tuple[str, str, float]]]:
+        matches: List[List[Tuple[str, str, float]]] = [[] for _ in range(count)]
+        for ordinality, hierarchy_id, name, score in rows:
+            score = round(100 * float(score), 1)
+            if score >= min_score:
+                matches[ordinality - 1].append((str(hierarchy_id), name, score))
+        return matches
+
+    def _record(self, started: float) -> None:
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+
+    def search(self, organization_id: str, candidates: Sequence[str], top_k: int = 3, min_score: float = 0) -> List[List[Tuple[str, str, float]]]:
+        """Best hierarchy entries for each candidate name.
+
+        Args:
+            organization_id: Organization whose hierarchy is searched
+            candidates: Names as the user wrote them
+            top_k: Maximum number of matches per candidate
+            min_score: Drop matches scoring below this (0-100)
+
+        Returns:
+            For each candidate, (id, name, score) tuples, best first
+
+        Raises:
+            Exception: If the query fails (e.g. pg_trgm or its index is not installed)
+        """
+        if not candidates:
+            return []
+        engine = get_db_engine(self.db_name)
+        if not engine:
+            raise RuntimeError(f"Database engine '{self.db_name}' not configured.")
+        thresholds, parameters = self._parameters(organization_id, candidates, top_k, min_score)
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(TRIGRAM_THRESHOLDS_QUERY, thresholds)
+                rows = conn.execute(TRIGRAM_MATCH_QUERY, parameters).fetchall()
+        except Exception:
+            self.failures += 1
+            raise
+        self._record(started)
+        return self._group(rows, len(candidates), min_score)
+
+    async def asearch(self, organization_id: str, candidates: Sequence[str], top_k: int = 3, min_score: float = 0) -> List[List[Tuple[str, str, float]]]:
+        """Async version of search."""
+        if not candidates:
+            return []
+        engine = get_async_db_engine(self.db_name)
+        if not engine:
+            raise RuntimeError(f"Database engine '{self.db_name}' not configured.")
+        thresholds, parameters = self._parameters(organization_id, candidates, top_k, min_score)
+        started = time.perf_counter()
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(TRIGRAM_THRESHOLDS_QUERY, thresholds)
+                rows = (await conn.execute(TRIGRAM_MATCH_QUERY, parameters)).fetchall()
+        except Exception:
+            self.failures += 1
+            raise
+        self._record(started)
+        logger.debug(f"Matched {len(candidates)} name(s) in the database for organization {organization_id}")
+        return self._group(rows, len(candidates), min_score)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the search counters."""
+        return {
+            "searches": self.searches,
+            "failures": self.failures,
+            "avg_search_ms": round(1000 * self.search_seconds / self.searches, 2) if self.searches else None,
+        }
+
+
+# Shared search used by HierarchyNameResolverTool for server_side hierarchies
+hierarchy_trigram_search = HierarchyTrigramSearch()
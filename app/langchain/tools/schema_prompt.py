@@ -0,0 +1,233 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.text_search import BM25Index
+from app.db.schema_definitions import ROLLUP_GRANULARITIES, SCHEMA_DEFINITIONS, SCHEMA_VERSION, rollup_table_name
+
+logger = logging.getLogger(__name__)
+
+
+def _column_line(column: Dict[str, Any], indent: str) -> str:
+    primary_key = " (PRIMARY KEY)" if column.get('primary_key') else ""
+    foreign_key = f" (FOREIGN KEY -> {column.get('foreign_key')})" if column.get('foreign_key') else ""
+    timestamp_note = " (Timestamp for filtering)" if 'timestamp' in column['type'].lower() else ""
+    return f"{indent}{column['name']} ({column['type']}){primary_key}{foreign_key} - {column['description']}{timestamp_note}"
+
+
+def _table_block(table_name: str, table_info: Dict[str, Any], indent: str = "") -> str:
+    """Prompt text of one table: description and columns, followed by a blank line.
+
+    Example queries are not part of the schema text; relevant ones are retrieved per request (see sql_examples).
+    """
+    lines = [
+        f"{indent}Table: {table_name}",
+        f"{indent}Description: {table_info['description']}",
+        f"{indent}Columns:",
+    ]
+    lines.extend(_column_line(column, f"{indent}  ") for column in table_info['columns'])
+    lines.append("")  # Empty line between tables
+    return "\n".join(lines)
+
+
+def _search_text(table_name: str, table_info: Dict[str, Any]) -> str:
+    """Text a table is matched on: its name, description, keywords and column names/descriptions."""
+    parts = [table_name, table_info['description'], table_info.get('keywords', "")]
+    for column in table_info['columns']:
+        parts.append(column['name'])
+        parts.append(column['description'])
+    return " ".join(parts)
+
+
+@dataclass
+class CompiledSchema:
+    """Prompt text of one database, split per table so subsets can be joined without re-rendering."""
+
+    header: str
+    tables: Dict[str, str]
+    full_text: str
+    index: BM25Index
+    # Tables a selected table pulls in: foreign-key targets and, for event tables, their rollups
+    dependencies: Dict[str, List[str]] = field(default_factory=dict)
+
+
+def compile_schema(db_name: str) -> Optional[CompiledSchema]:
+    """Render the prompt text of a database from SCHEMA_DEFINITIONS and index its tables for selection."""
+    db_info = SCHEMA_DEFINITIONS.get(db_name)
+    if db_info is None:
+        return None
+    header = "\n".join([f"Database: {db_name}", f"Description: {db_info['description']}", ""])
+    tables = {name: _table_block(name, info) for name, info in db_info['tables'].items()}
+
+    rollups = {
+        rollup_table_name(source, granularity): source
+        for source in db_info['tables']
+        for granularity in ROLLUP_GRANULARITIES
+        if rollup_table_name(source, granularity) in db_info['tables']
+    }
+    index: BM25Index[str] = BM25Index()
+    dependencies: Dict[str, List[str]] = {}
+    for name, info in db_info['tables'].items():
+        targets = [
+            column['foreign_key'].split(".", 1)[0]
+            for column in info['columns'] if column.get('foreign_key')
+        ]
+        targets.extend(rollup for rollup, source in rollups.items() if source == name)
+        dependencies[name] = [target for target in dict.fromkeys(targets) if target != name and target in tables]
+        # Rollups are selected through their source table, so they do not compete with it
+        if name not in rollups:
+            index.add(name, _search_text(name, info))
+
+    return CompiledSchema(
+        header=header,
+        tables=tables,
+        full_text="\n".join([header, *tables.values()]),
+        index=index,
+        dependencies=dependencies,
+    )
+
+
+def compile_all_schemas() -> str:
+    """Prompt text of every database, used when no database has been selected."""
+    all_schemas = []
+    for db_name, db_info in SCHEMA_DEFINITIONS.items():
+        all_schemas.append(f"Database: {db_name}")
+        all_schemas.append(f"Description: {db_info['description']}")
+        for table_name, table_info in db_info['tables'].items():
+            all_schemas.append(_table_block(table_name, table_info, indent="  "))
+    return "\n".join(all_schemas)
+
+
+class SchemaPromptBuilder:
+    """Schema text for SQL generation prompts, compiled once per SCHEMA_VERSION.
+
+    With pruning enabled, only the tables a query description needs are sent: tables are ranked by
+    BM25 over their names, descriptions, keywords and columns, every table scoring at least
+    `relative_score` of the best match is kept, and foreign-key targets, rollups and `always_include`
+    tables are added. When no other table matches at least `min_score`, the full schema is sent.
+    """
+
+    def __init__(self, pruning_enabled: bool, min_score: float, relative_score: float, always_include: Sequence[str]):
+        """Create the builder.
+
+        Args:
+            pruning_enabled: Send only relevant tables instead of the whole database
+            min_score: Best BM25 score below which the description is considered unmatched
+            relative_score: Keep tables scoring at least this fraction of the best score
+            always_include: Tables sent with every pruned schema (e.g. the hierarchy table)
+        """
+        self.pruning_enabled = pruning_enabled
+        self.min_score = min_score
+        self.relative_score = relative_score
+        self.always_include = tuple(always_include)
+        self.compiled: TTLCache[Any] = TTLCache(name="schema_prompts", max_size=32)
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self.pruned = 0
+        self.unmatched = 0
+        self.tables_sent = 0
+        self.chars_sent = 0
+        self.chars_full = 0
+
+    def _compiled(self, db_name: str) -> Optional[CompiledSchema]:
+        key = (SCHEMA_VERSION, db_name)
+        compiled = self.compiled.get(key, default=False)
+        if compiled is False:
+            compiled = compile_schema(db_name)
+            self.compiled.set(key, compiled)
+            if compiled is not None:
+                logger.info(f"Compiled schema prompt for {db_name}: {len(compiled.tables)} tables, {len(compiled.full_text)} chars")
+        return compiled
+
+    def select_tables(self, db_name: str, query_description: str) -> Optional[List[str]]:
+        """Tables of db_name relevant to a query description, in definition order.
+
+        Returns:
+            The selected table names, or None if the full schema should be used
+        """
+        compiled = self._compiled(db_name)
+        if compiled is None:
+            return None
+        # Always-included tables are lookups; matching only them says nothing about the data asked for
+        ranked = [(name, score) for name, score in compiled.index.search(query_description) if name not in self.always_include]
+        if not ranked or ranked[0][1] < self.min_score:
+            return None
+        best = ranked[0][1]
+        selected = {name for name, score in ranked if score >= best * self.relative_score}
+        selected.update(name for name in self.always_include if name in compiled.tables)
+        pending = list(selected)
+        while pending:
+            for dependency in compiled.dependencies.get(pending.pop(), []):
+                if dependency not in selected:
+                    selected.add(dependency)
+                    pending.append(dependency)
+        return [name for name in compiled.tables if name in selected]
+
+    def schema_text(self, db_name: Optional[str], query_description: Optional[str] = None) -> str:
+        """Schema section of the SQL generation prompt.
+
+        Args:
+            db_name: Target database, or None for an overview of every database
+            query_description: Description being translated; enables table pruning
+
+        Returns:
+            Schema text for the prompt
+        """
+        if not db_name:
+            key = (SCHEMA_VERSION, None)
+            text = self.compiled.get(key)
+            if text is None:
+                text = compile_all_schemas()
+                self.compiled.set(key, text)
+            return text
+
+        compiled = self._compiled(db_name)
+        if compiled is None:
+            return f"No schema definition found for database {db_name}."
+
+        selected = None
+        if self.pruning_enabled and query_description:
+            selected = self.select_tables(db_name, query_description)
+        pruned = selected is not None and len(selected) < len(compiled.tables)
+        if pruned:
+            text = "\n".join([compiled.header, *(compiled.tables[name] for name in selected)])
+            logger.debug(f"Schema for '{query_description}' pruned to tables {selected}")
+        else:
+            text = compiled.full_text
+
+        with self._lock:
+            self.prompts += 1
+            if self.pruning_enabled and query_description:
+                if selected is None:
+                    self.unmatched += 1
+                elif pruned:
+                    self.pruned += 1
+            self.tables_sent += len(selected) if selected is not None else len(compiled.tables)
+            self.chars_sent += len(text)
+            self.chars_full += len(compiled.full_text)
+        return text
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the pruning counters."""
+        with self._lock:
+            return {
+                "pruning_enabled": self.pruning_enabled,
+                "prompts": self.prompts,
+                "pruned": self.pruned,
+                "unmatched": self.unmatched,
+                "avg_tables": round(self.tables_sent / self.prompts, 2) if self.prompts else None,
+                "chars_saved_ratio": round(1 - self.chars_sent / self.chars_full, 3) if self.chars_full else None,
+                "compiled": self.compiled.stats(),
+            }
+
+
+# Shared builder used by SQLQueryTool
+schema_prompt_builder = SchemaPromptBuilder(
+    pruning_enabled=settings.SQL_SCHEMA_PRUNING_ENABLED,
+    min_score=settings.SQL_SCHEMA_PRUNING_MIN_SCORE,
+    relative_score=settings.SQL_SCHEMA_PRUNING_RELATIVE_SCORE,
+    always_include=settings.SQL_SCHEMA_ALWAYS_INCLUDE,
+)
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.schema_definitions import SCHEMA_VERSION
+
+logger = logging.getLogger(__name__)
+
+_UUID_PATTERN = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.?!]+$")
+
+
+def normalize_description(query_description: str) -> str:
+    """Normalize a query description for cache lookups (case, whitespace, trailing punctuation)."""
+    normalized = " ".join(query_description.lower().split())
+    return _TRAILING_PUNCTUATION.sub("", normalized)
+
+
+def validate_template(sql: str, params: Dict[str, Any], query_description: str, organization_id: str) -> Optional[str]:
+    """Check that generated SQL is safe to reuse for other organizations.
+
+    Args:
+        sql: Generated SQL with placeholders
+        params: Generated parameters (including organization_id)
+        query_description: Description the SQL was generated from
+        organization_id: Organization the SQL was generated for
+
+    Returns:
+        None if the template can be cached, otherwise the reason it cannot
+    """
+    if ":organization_id" not in sql:
+        return "SQL does not filter on :organization_id"
+    if organization_id and organization_id in sql:
+        return "SQL contains an inlined organization id"
+    description = query_description.lower()
+    for name, value in params.items():
+        if name == "organization_id":
+            continue
+        if f":{name}" not in sql:
+            return f"parameter '{name}' is not used in the SQL"
+        if value == organization_id:
+            return f"parameter '{name}' carries the organization id"
+        # Ids must come from the description, otherwise they were looked up for this organization only
+        if isinstance(value, str) and _UUID_PATTERN.match(value) and value.lower() not in description:
+            return f"parameter '{name}' holds an id that is not part of the description"
+    return None
+
+
+class SQLTemplateCache:
+    """Two-tier cache of generated SQL templates.
+
+    Maps (normalized description, db_name, SCHEMA_VERSION) to the generated SQL and its
+    non-organization parameters. The organization id is always a bound parameter, so a template
+    generated for one organization is reused for all of them with their own organization_id.
+    The first tier is an in-process TTLCache; the optional second tier is a SQLite file shared by
+    workers and surviving restarts.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: Optional[float] = None, db_path: Optional[str] = None):
+        """Create the cache.
+
+        Args:
+            max_size: Maximum number of templates held in memory
+            ttl_seconds: Template lifetime in seconds, or None/0 for no expiry
+            db_path: Path of the SQLite file for the disk tier, or None/"" for memory only
+        """
+        self.memory: TTLCache[Tuple[str, Dict[str, Any]]] = TTLCache(name="sql_templates", max_size=max_size, ttl_seconds=ttl_seconds)
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self.db_path = db_path or None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.stores = 0
+        self.rejections = 0
+
+    def _key(self, query_description: str, db_name: str) -> str:
+        raw = f"{SCHEMA_VERSION}|{db_name}|{normalize_description(query_description)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        if not self.db_path:
+            return None
+        if self._conn is None:
+            try:
+                Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS sql_templates ("
+                    "key TEXT PRIMARY KEY, sql TEXT NOT NULL, params TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._conn.commit()
+                logger.info(f"SQL template disk cache opened at {self.db_path}")
+            except sqlite3.Error as e:
+                logger.error(f"Could not open SQL template disk cache at {self.db_path}, using memory only: {str(e)}")
+                self.db_path = None
+                self._conn = None
+        return self._conn
+
+    def _disk_get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            conn = self._disk()
+            if conn is None:
+                return None
+            try:
+                row = conn.execute("SELECT sql, params, created_at FROM sql_templates WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.disk_misses += 1
+                    return None
+                sql, params_json, created_at = row
+                if self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds:
+                    conn.execute("DELETE FROM sql_templates WHERE key = ?", (key,))
+                    conn.commit()
+                    self.disk_misses += 1
+                    return None
+                self.disk_hits += 1
+                return sql, json.loads(params_json)
+            except (sqlite3.Error, ValueError) as e:
+                logger.warning(f"SQL template disk cache read failed: {str(e)}")
+                return None
+
+    def _disk_set(self, key: str, sql: str, params: Dict[str, Any]) -> None:
+        with self._lock:
+            conn = self._disk()
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sql_templates (key, sql, params, created_at) VALUES (?, ?, ?, ?)",
+                    (key, sql, json.dumps(params, default=str), time.time()),
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"SQL template disk cache write failed: {str(e)}")
+
+    def get(self, query_description: str, db_name: str, organization_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Return (sql, params) bound to organization_id for a cached description, or None on a miss."""
+        key = self._key(query_description, db_name)
+        entry = self.memory.get(key)
+        if entry is None:
+            entry = self._disk_get(key)
+            if entry is None:
+                return None
+            # The disk tier may hold entries written by other processes or older releases, re-check them
+            reason = validate_template(entry[0], entry[1], query_description, organization_id)
+            if reason:
+                self.rejections += 1
+                logger.warning(f"Discarding cached SQL for '{query_description}': {reason}")
+                return None
+            self.memory.set(key, entry)
+        sql, params = entry
+        return sql, {**params, "organization_id": organization_id}
+
+    def put(self, query_description: str, db_name: str, sql: str, params: Dict[str, Any], organization_id: str) -> bool:
+        """Store a generated template if it passes validation. Returns True if it was stored."""
+        reason = validate_template(sql, params, query_description, organization_id)
+        if reason:
+            self.rejections += 1
+            logger.debug(f"Not caching SQL for '{query_description}': {reason}")
+            return False
+        template_params = {name: value for name, value in params.items() if name != "organization_id"}
+        key = self._key(query_description, db_name)
+        self.memory.set(key, (sql, template_params))
+        self._disk_set(key, sql, template_params)
+        self.stores += 1
+        return True
+
+    def clear(self) -> None:
+        """Drop all templates from both tiers."""
+        self.memory.clear()
+        with self._lock:
+            conn = self._disk()
+            if conn is not None:
+                conn.execute("DELETE FROM sql_templates")
+                conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the cache counters."""
+        memory_stats = self.memory.stats()
+        lookups = memory_stats["hits"] + memory_stats["misses"]
+        hits = memory_stats["hits"] + self.disk_hits
+        return {
+            "memory": memory_stats,
+            "disk": {"enabled": bool(self.db_path), "hits": self.disk_hits, "misses": self.disk_misses},
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "rejections": self.rejections,
+            "schema_version": SCHEMA_VERSION,
+        }
+
+
+# Shared cache used by SQLQueryTool
+sql_template_cache = SQLTemplateCache(
+    max_size=settings.SQL_CACHE_MAX_SIZE,
+    ttl_seconds=settings.SQL_CACHE_TTL_SECONDS,
+    db_path=settings.SQL_CACHE_DB_PATH,
+)
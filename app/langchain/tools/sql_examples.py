@@ -0,0 +1,175 @@
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.text_search import BM25Index
+from app.langchain.tools.sql_cache import normalize_description, validate_template
+
+logger = logging.getLogger(__name__)
+
+
+class SQLExampleLibrary:
+    """Few-shot (question, SQL) examples for SQL generation, retrieved with an in-process BM25 index.
+
+    Examples come from a curated JSONL file shipped with the app and, optionally, from a second JSONL
+    file that grows with generated queries that executed successfully. Each line holds
+    {"db", "question", "sql", "params"}; params never include organization_id. Everything runs in
+    memory, so retrieval takes microseconds and needs no embedding service.
+    """
+
+    def __init__(self, curated_path: str, learned_path: str, top_k: int, min_score: float, max_learned: int):
+        """Create the library (examples are read by load()).
+
+        Args:
+            curated_path: JSONL file of hand-written examples
+            learned_path: JSONL file successful generated queries are appended to, or "" to not learn
+            top_k: Number of examples injected into a prompt
+            min_score: Minimum BM25 score for an example to be used
+            max_learned: Stop learning once the learned file holds this many examples
+        """
+        self.curated_path = curated_path
+        self.learned_path = learned_path or None
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_learned = max_learned
+        self.examples: List[Dict[str, Any]] = []
+        self.index: BM25Index[int] = BM25Index()
+        self._questions: set = set()
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.learned = 0
+        self.searches = 0
+        self.search_ns = 0
+        self.max_search_ns = 0
+
+    def _add(self, example: Dict[str, Any]) -> bool:
+        key = (example["db"], normalize_description(example["question"]))
+        if key in self._questions:
+            return False
+        self._questions.add(key)
+        self.index.add(len(self.examples), example["question"])
+        self.examples.append(example)
+        return True
+
+    def _read(self, path: str) -> int:
+        count = 0
+        try:
+            with open(path, encoding="utf-8") as handle:
+                for line_number, line in enumerate(handle, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                        example = {
+                            "db": entry["db"],
+                            "question": entry["question"],
+                            "sql": entry["sql"],
+                            "params": entry.get("params", {}),
+                        }
+                    except (ValueError, KeyError) as e:
+                        logger.warning(f"Skipping invalid SQL example {path}:{line_number}: {str(e)}")
+                        continue
+                    if not settings.HIERARCHY_RESOLVE_SUBTREE and '"hierarchyClosure"' in example["sql"]:
+                        continue  # The closure table may not exist (migration 0003)
+                    count += self._add(example)
+        except FileNotFoundError:
+            logger.debug(f"SQL example file {path} does not exist")
+        return count
+
+    def load(self) -> None:
+        """(Re)build the index from the curated and learned example files."""
+        with self._lock:
+            self.examples = []
+            self.index = BM25Index()
+            self._questions = set()
+            curated = self._read(self.curated_path) if self.curated_path else 0
+            self.learned = self._read(self.learned_path) if self.learned_path else 0
+            self._loaded = True
+        logger.info(f"Loaded {curated} curated and {self.learned} learned SQL examples")
+
+    def search(self, query_description: str, db_name: str, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Examples for db_name whose questions are most similar to a query description, best first."""
+        if not self._loaded:
+            self.load()
+        started = time.perf_counter_ns()
+        with self._lock:
+            ranked = self.index.search(query_description)
+            limit = top_k or self.top_k
+            found = [
+                self.examples[key] for key, score in ranked
+                if score >= self.min_score and self.examples[key]["db"] == db_name
+            ][:limit]
+            elapsed = time.perf_counter_ns() - started
+            self.searches += 1
+            self.search_ns += elapsed
+            self.max_search_ns = max(self.max_search_ns, elapsed)
+        return found
+
+    def format_examples(self, query_description: str, db_name: str, organization_id: str) -> str:
+        """Prompt text of the examples most similar to a query description ("None" if there are none)."""
+        blocks = []
+        for example in self.search(query_description, db_name):
+            output = {"sql": example["sql"], "params": {**example["params"], "organization_id": organization_id}}
+            blocks.append(f"Query description: {example['question']}\n{json.dumps(output)}")
+        return "\n\n".join(blocks) if blocks else "None"
+
+    def learn(self, query_description: str, db_name: str, sql: str, params: Dict[str, Any], organization_id: str) -> bool:
+        """Add a generated query that executed successfully, if it is reusable and not known yet.
+
+        Args:
+            query_description: Description the SQL was generated from (after time normalization)
+            db_name: Database the SQL ran on
+            sql: Generated SQL template
+            params: Its parameters, without the resolved time range
+            organization_id: Organization it was generated for (never stored)
+
+        Returns:
+            True if the example was added
+        """
+        if not self.learned_path or self.learned >= self.max_learned:
+            return False
+        if validate_template(sql, params, query_description, organization_id):
+            return False
+        example = {
+            "db": db_name,
+            "question": query_description,
+            "sql": sql,
+            "params": {name: value for name, value in params.items() if name != "organization_id"},
+        }
+        with self._lock:
+            if not self._add(example):
+                return False
+            self.learned += 1
+            try:
+                Path(self.learned_path).parent.mkdir(parents=True, exist_ok=True)
+                with open(self.learned_path, "a", encoding="utf-8") as handle:
+                    handle.write(json.dumps(example, default=str) + "\n")
+            except OSError as e:
+                logger.error(f"Could not append SQL example to {self.learned_path}: {str(e)}")
+        logger.debug(f"Learned SQL example for '{query_description}'")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the library counters."""
+        return {
+            "examples": len(self.examples),
+            "learned": self.learned,
+            "learning": bool(self.learned_path),
+            "searches": self.searches,
+            "avg_search_us": round(self.search_ns / self.searches / 1000, 1) if self.searches else None,
+            "max_search_us": round(self.max_search_ns / 1000, 1),
+        }
+
+
+# Shared library used by SQLQueryTool
+sql_example_library = SQLExampleLibrary(
+    curated_path=settings.SQL_EXAMPLES_PATH,
+    learned_path=settings.SQL_EXAMPLES_LEARNED_PATH,
+    top_k=settings.SQL_EXAMPLES_TOP_K,
+    min_score=settings.SQL_EXAMPLES_MIN_SCORE,
+    max_learned=settings.SQL_EXAMPLES_MAX_LEARNED,
+)
@@ -0,0 +1,125 @@
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.sql_parsing import fingerprint, predicate_columns
+
+logger = logging.getLogger(__name__)
+
+
+class SQLQueryLog:
+    """JSONL log of every query the SQL tool sends to the database.
+
+    Each line holds the normalized fingerprint, the referenced filter/join/group columns, latency,
+    row count and outcome of one execution; `python -m app.db.index_advisor` aggregates the file
+    into index proposals. Parsing results are memoized per SQL text, since generated SQL repeats.
+    """
+
+    def __init__(self, path: str, include_params: bool, max_bytes: int, backup_count: int = 5):
+        """Create the log.
+
+        Args:
+            path: JSONL file to append to, or "" to disable logging
+            include_params: Also record bind parameters (lets the advisor EXPLAIN real queries)
+            max_bytes: Rotate the file once it reaches this size
+            backup_count: Number of rotated files to keep
+        """
+        self.path = path or None
+        self.include_params = include_params
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.analyses: TTLCache[Tuple[str, str, Dict[str, List[str]]]] = TTLCache(name="sql_fingerprints", max_size=1024)
+        self._writer: Optional[logging.Logger] = None
+        self._lock = threading.Lock()
+        self.records = 0
+        self.failures = 0
+
+    def _get_writer(self) -> Optional[logging.Logger]:
+        if not self.path:
+            return None
+        with self._lock:
+            if self._writer is None:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backup_count, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                writer = logging.getLogger("app.sql_query_log")
+                writer.handlers = [handler]
+                writer.setLevel(logging.INFO)
+                writer.propagate = False
+                self._writer = writer
+        return self._writer
+
+    def _analyze(self, sql: str) -> Tuple[str, str, Dict[str, List[str]]]:
+        analysis = self.analyses.get(sql)
+        if analysis is None:
+            normalized, digest = fingerprint(sql)
+            analysis = (normalized, digest, predicate_columns(sql))
+            self.analyses.set(sql, analysis)
+        return analysis
+
+    def record(
+        self,
+        sql: str,
+        parameters: Dict[str, Any],
+        db_name: str,
+        latency_ms: float,
+        status: str,
+        row_count: Optional[int] = None,
+    ) -> None:
+        """Append one execution to the log. Never raises.
+
+        Args:
+            sql: SQL as executed (after rollup routing / default time window)
+            parameters: Bind parameters
+            db_name: Database the query ran on
+            latency_ms: Wall time from acquiring the connection to having the rows
+            status: "ok", "rejected" (cost guard), "timeout" or "error"
+            row_count: Number of rows fetched, if the query succeeded
+        """
+        writer = self._get_writer()
+        if writer is None:
+            return
+        try:
+            normalized, digest, columns = self._analyze(sql)
+            entry = {
+                "ts": datetime.now(timezone.utc).isoformat(),
+                "db": db_name,
+                "fingerprint": digest,
+                "sql": normalized,
+                **columns,
+                "latency_ms": round(latency_ms, 2),
+                "status": status,
+                "rows": row_count,
+            }
+            if self.include_params:
+                entry["template"] = sql
+                entry["params"] = parameters
+            writer.info(json.dumps(entry, default=str))
+            self.records += 1
+        except Exception as e:
+            self.failures += 1
+            logger.debug(f"Could not record SQL query log entry: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the log counters."""
+        return {
+            "enabled": bool(self.path),
+            "path": self.path,
+            "records": self.records,
+            "failures": self.failures,
+            "fingerprints": self.analyses.stats(),
+        }
+
+
+# Shared log used by SQLQueryTool
+sql_query_log = SQLQueryLog(
+    path=settings.SQL_QUERY_LOG_PATH,
+    include_params=settings.SQL_QUERY_LOG_PARAMS,
+    max_bytes=settings.SQL_QUERY_LOG_MAX_BYTES,
+)
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Hashable, Optional, Tuple
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Cheap freshness probes for the append-heavy event tables, scoped to one organization (served by the
+# ("organizationId", "updatedAt") index of migration 0004 and the ("organizationId", "eventTimestamp")
+# index of migration 0001). Apply 0004 before enabling the cache on a large database.
+# A cached result is only served while the watermark of every probed table it reads is unchanged.
+# Other tables (e.g. "hierarchyCaches") have no probe: changes to them only show up after the TTL.
+WATERMARK_QUERIES: Dict[str, str] = {
+    "5": 'SELECT max("updatedAt"), max("eventTimestamp") FROM "5" WHERE "organizationId" = :organization_id',
+    "8": 'SELECT max("updatedAt"), max("eventTimestamp") FROM "8" WHERE "organizationId" = :organization_id',
+}
+
+_TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+"([^"]+)"', re.IGNORECASE)
+
+
+def referenced_tables(sql: str) -> FrozenSet[str]:
+    """Quoted table names that appear after FROM/JOIN in a statement."""
+    return frozenset(_TABLE_REFERENCE.findall(sql))
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class SQLResultCache:
+    """Byte-bounded LRU cache of executed query results.
+
+    Entries are keyed by a hash of (db_name, SQL text, canonicalized parameters) and expire after
+    `ttl_seconds`. Results reading tables listed in WATERMARK_QUERIES also record those tables'
+    watermarks at execution time and are only served while the current watermark still matches.
+    Results reading no such table (e.g. only "hierarchyCaches") are invalidated by the TTL alone, so
+    they are not cached at all when there is no TTL. Watermarks are themselves memoized per (db, organization, table) for `watermark_ttl_seconds`
+    so bursts of lookups cost at most one probe.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: Optional[float] = None, watermark_ttl_seconds: Optional[float] = None):
+        """Create the cache.
+
+        Args:
+            max_bytes: Approximate memory budget for cached results, in bytes of their JSON encoding
+            ttl_seconds: Result lifetime in seconds, or None/0 for no expiry
+            watermark_ttl_seconds: How long a probed watermark is reused before probing again
+        """
+        self.max_bytes = max(1, int(max_bytes))
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self.watermarks: TTLCache[Tuple] = TTLCache(name="sql_watermarks", max_size=4096, ttl_seconds=watermark_ttl_seconds)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(db_name: str, sql: str, parameters: Dict[str, Any]) -> str:
+        raw = f"{db_name}\x00{sql.strip()}\x00{_canonical(parameters)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def watermark_tables(sql: str) -> Tuple[str, ...]:
+        """Tables read by sql that have a watermark probe, in a stable order."""
+        return tuple(sorted(t for t in referenced_tables(sql) if t in WATERMARK_QUERIES))
+
+    def watermark_key(self, db_name: str, organization_id: str, table: str) -> Hashable:
+        return (db_name, organization_id, table)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+
+    def get(self, key: str, watermarks: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return the cached result for key if it is fresh for the given current watermarks."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expired = self.ttl_seconds is not None and time.monotonic() - entry["stored_at"] > self.ttl_seconds
+            if expired or entry["watermarks"] != watermarks:
+                self._remove(key)
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["result"]
+
+    def put(self, key: str, result: Dict[str, Any], sql: str, organization_id: str, watermarks: Dict[str, Any]) -> None:
+        """Store a result, evicting least-recently-used entries to stay within max_bytes."""
+        if not watermarks and self.ttl_seconds is None:
+            return  # Nothing would ever invalidate it
+        size = len(_canonical(result))
+        if size > self.max_bytes:
+            logger.debug(f"SQL result of {size} bytes exceeds the cache budget, not caching")
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "result": result,
+                "size": size,
+                "stored_at": time.monotonic(),
+                "tables": referenced_tables(sql),
+                "organization_id": organization_id,
+                "watermarks": watermarks,
+            }
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_table(self, table: str, organization_id: Optional[str] = None) -> int:
+        """Drop cached results (and watermarks) that read a table, optionally for one organization only.
+
+        Returns:
+            Number of results removed
+        """
+        with self._lock:
+            doomed = [
+                key for key, entry in self._entries.items()
+                if table in entry["tables"] and (organization_id is None or entry["organization_id"] == organization_id)
+            ]
+            for key in doomed:
+                self._remove(key)
+            self.invalidations += len(doomed)
+        self.watermarks.invalidate_where(
+            lambda key, _: key[2] == table and (organization_id is None or key[1] == organization_id)
+        )
+        if doomed:
+            logger.info(f"Invalidated {len(doomed)} cached SQL result(s) for table {table} (org={organization_id})")
+        return len(doomed)
+
+    def clear(self) -> None:
+        """Drop all cached results and watermarks."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        self.watermarks.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "watermarks": self.watermarks.stats(),
+            }
+
+
+# Shared cache used by SQLQueryTool
+sql_result_cache = SQLResultCache(
+    max_bytes=settings.SQL_RESULT_CACHE_MAX_BYTES,
+    ttl_seconds=settings.SQL_RESULT_CACHE_TTL_SECONDS,
+    watermark_ttl_seconds=settings.SQL_RESULT_CACHE_WATERMARK_TTL_SECONDS,
+)
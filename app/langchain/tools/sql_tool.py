@@ -1,27 +1,44 @@
 ﻿import logging
-from typing import Any, Dict, List, Optional, Union, Tuple
+from typing import Any, Dict, List, Optional, Type, Union, Tuple
 import json
+import re
 import uuid 
 import datetime 
-import asyncio
-import functools
 import decimal
+import time
 
 from langchain.tools import BaseTool
-from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
-from langchain_openai import AzureChatOpenAI
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from pydantic import BaseModel, Field
 
 from app.core.config import settings
-from app.db.connection import get_db_engine
+from app.core.llm import SQL_TEMPERATURE, get_chat_llm
+from app.db.connection import get_async_db_engine, get_db_engine
+from app.db.partitions import apply_default_time_window
+from app.db.rollups import rollup_manager
 from app.db.schema_definitions import SCHEMA_DEFINITIONS
+from app.langchain.tools.hierarchy_resolver_tool import HierarchyNameResolverTool
+from app.langchain.tools.schema_prompt import schema_prompt_builder
+from app.langchain.tools.sql_cache import sql_template_cache
+from app.langchain.tools.sql_examples import sql_example_library
+from app.langchain.tools.sql_query_log import sql_query_log
+from app.langchain.tools.sql_result_cache import WATERMARK_QUERIES, sql_result_cache
+from app.langchain.tools.temporal import get_org_timezone, normalize_time_expressions
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of rows returned to the agent per query
+MAX_ROWS = 50
+
+# Parameters produced by the relative-date normalizer
+TIME_RANGE_PARAMS = ("start_ts", "end_ts")
+
+# Parameters bound to the hierarchy ids of location names the tool resolved itself (:location_1, ...)
+LOCATION_PARAM = re.compile(r"^location_\d+$")
+
 # Helper function for JSON serialization
 def json_default(obj):
     if isinstance(obj, uuid.UUID):
@@ -37,104 +54,16 @@ def json_default(obj):
     # Let the base class default method raise the TypeError
     raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
 
-class SQLQueryTool(BaseTool):
-    """Tool for querying SQL databases, ensuring results are scoped to the user's organization."""
-    
-    name: str = "sql_query"
-    description: str = """
-    Executes organization-scoped SQL queries against PostgreSQL databases.
-    Use this tool when you need to fetch specific data from the database.
-    The tool handles query generation and execution, automatically filtering by the user's organization.
-    Input should be a description of the data needed (e.g., 'total borrows last week').
-    DO NOT include organization filtering in the description; the tool adds it automatically.
-    """
-    
-    organization_id: str
-    selected_db: Optional[str] = None
-    
-    def _get_schema_info(self, db_name: Optional[str] = None) -> str:
-        """Get schema information from predefined schema definitions."""
-        if not db_name and not self.selected_db:
-            all_schemas = []
-            for db_name, db_info in SCHEMA_DEFINITIONS.items():
-                all_schemas.append(f"Database: {db_name}")
-                all_schemas.append(f"Description: {db_info['description']}")
-                
-                for table_name, table_info in db_info['tables'].items():
-                    all_schemas.append(f"  Table: {table_name}")
-                    all_schemas.append(f"  Description: {table_info['description']}")
-                    
-                    all_schemas.append("  Columns:")
-                    for column in table_info['columns']:
-                        primary_key = " (PRIMARY KEY)" if column.get('primary_key') else ""
-                        foreign_key = f" (FOREIGN KEY -> {column.get('foreign_key')})" if column.get('foreign_key') else ""
-                        timestamp_note = " (Timestamp for filtering)" if 'timestamp' in column['type'].lower() else ""
-                        all_schemas.append(f"    {column['name']} ({column['type']}){primary_key}{foreign_key} - {column['description']}{timestamp_note}")
-                    
-                    if 'example_queries' in table_info:
-                        all_schemas.append("  Example queries:")
-                        for query in table_info['example_queries']:
-                            all_schemas.append(f"    {query}")
-                    
-                    all_schemas.append("")  # Empty line between tables
-            
-            return "\n".join(all_schemas)
-        
-        target_db = db_name or self.selected_db
-        if target_db not in SCHEMA_DEFINITIONS:
-            return f"No schema definition found for database {target_db}."
-        
-        db_info = SCHEMA_DEFINITIONS[target_db]
-        schema_info = [
-            f"Database: {target_db}",
-            f"Description: {db_info['description']}",
-            ""
-        ]
-        
-        for table_name, table_info in db_info['tables'].items():
-            schema_info.append(f"Table: {table_name}")
-            schema_info.append(f"Description: {table_info['description']}")
-            
-            schema_info.append("Columns:")
-            for column in table_info['columns']:
-                primary_key = " (PRIMARY KEY)" if column.get('primary_key') else ""
-                foreign_key = f" (FOREIGN KEY -> {column.get('foreign_key')})" if column.get('foreign_key') else ""
-                timestamp_note = " (Timestamp for filtering)" if 'timestamp' in column['type'].lower() else ""
-                schema_info.append(f"  {column['name']} ({column['type']}){primary_key}{foreign_key} - {column['description']}{timestamp_note}")
-            
-            if 'example_queries' in table_info:
-                schema_info.append("Example queries:")
-                for query in table_info['example_queries']:
-                    schema_info.append(f"  {query}")
-            
-            schema_info.append("")  # Empty line between tables
-        
-        return "\n".join(schema_info)
-    
-    def _generate_sql(
-        self, 
-        query_description: str, 
-        db_name: str
-    ) -> Tuple[str, Dict[str, Any]]:
-        """Generate SQL with placeholders and parameters from a natural language query description using LCEL, enforcing organization filtering."""
-        schema_info = self._get_schema_info(db_name)
-        
-        llm = AzureChatOpenAI(
-            openai_api_key=settings.AZURE_OPENAI_API_KEY,
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-            openai_api_version=settings.AZURE_OPENAI_API_VERSION,
-            deployment_name=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
-            model_name=settings.LLM_MODEL_NAME,
-            temperature=0,
-        )
-        
-        # Integrating org filtering into the existing prompt structure
-        template = """You are a SQL expert. Given the following database schema and a query description,
+# Prompt for SQL generation (integrating org filtering into the existing prompt structure)
+SQL_GENERATION_TEMPLATE = """You are a SQL expert. Given the following database schema and a query description,
 generate a PostgreSQL SQL query and its corresponding parameters dictionary.
 
 Schema:
 {schema}
 
+Solved examples of similar requests (follow their patterns, but use the values of this request):
+{examples}
+
 Query description: {query_description}
 
 Important Guidelines:
@@ -145,7 +74,7 @@ Important Guidelines:
     *   If querying table '5' (event data), add `"organizationId" = :organization_id` to your WHERE clause (using AND if other conditions exist).
     *   If querying `hierarcyCaches` directly for the organization's details, filter using `"id" = :organization_id`.
     *   If querying `hierarcyCaches` for specific locations *within* an organization, ensure the data relates back to the `:organization_id` (e.g., via JOIN or direct filter on `parentId` if appropriate).
-    *   You MUST include `:organization_id` as a key in the `params` dictionary with the correct value. **Use the exact `organization_id` value provided to you in the context (e.g., '{organization_id}'), do NOT use example UUIDs or placeholders like 'your-organization-uuid'.**
+{closure_guideline}    *   You MUST include `:organization_id` as a key in the `params` dictionary with the correct value. **Use the exact `organization_id` value provided to you in the context (e.g., '{organization_id}'), do NOT use example UUIDs or placeholders like 'your-organization-uuid'.**
 5. **JOINs for Related Data:** When joining table '5' and `hierarcyCaches`, use appropriate keys like `"5"."hierarchyId" = hc."id"` (for location-specific events) or `"5"."organizationId" = hc."id"` (for organization details). Remember to apply the organization filter (Guideline #4).
 6. **Case Sensitivity:** PostgreSQL is case-sensitive; respect exact table/column capitalization.
 7. **Column Selection:** Use specific column selection instead of SELECT *.
@@ -170,22 +99,25 @@ Important Guidelines:
     *   **Avoid nested aggregates:** Do NOT use invalid nested aggregate/window functions like `AVG(SUM(...)) OVER ()`.
     *   Only include this benchmark if it can be done efficiently. The CTE approach is generally efficient.
     *   Ensure both the specific value and the benchmark value have clear, user-friendly aliases.
-13. **Time Filtering (Generate SQL Directly):**
-    *   If the `query_description` includes time references (e.g., "last week", "yesterday", "past 3 months", "since June 1st", "before 2024"), you MUST generate the appropriate SQL `WHERE` clause condition directly.
+13. **Time Filtering:**
+    *   **Pre-resolved ranges:** If the `query_description` mentions the parameters `:start_ts` and `:end_ts`, the time range has already been resolved for you. Filter with `"eventTimestamp" >= :start_ts AND "eventTimestamp" < :end_ts` (use the table's timestamp column) and do NOT compute dates yourself. Do NOT add `start_ts`/`end_ts` to the `params` dictionary; the tool binds them.
+    *   **Other time references (Generate SQL Directly):** If the `query_description` includes time references (e.g., "last week", "yesterday", "past 3 months", "since June 1st", "before 2024"), you MUST generate the appropriate SQL `WHERE` clause condition directly.
     *   Use relevant SQL functions like `NOW()`, `CURRENT_DATE`, `INTERVAL`, `DATE_TRUNC`, `EXTRACT`, and comparison operators (`>=`, `<`, `BETWEEN`).
     *   **Relative Time Interpretation:** For simple relative terms like "last week", "last month", prioritize using straightforward intervals like `NOW() - INTERVAL '7 days'` or `NOW() - INTERVAL '1 month'`, respectively. Use `DATE_TRUNC` or specific date ranges only if the user query explicitly demands calendar alignment (e.g., "the week starting Monday", "the calendar month of March").
     *   **Relative Months/Years:** For month names (e.g., "March", "in June") without a specified year, **ALWAYS** assume the **current year** in your date logic. For years alone (e.g., "in 2024"), query the whole year. **Critically, incorporate the current year directly into your date comparisons using `NOW()` or `CURRENT_DATE` where appropriate, don't just extract the year separately and then use a hardcoded year in the comparison.**
     *   Identify the correct timestamp column for filtering (e.g., `"eventTimestamp"` for table `"5"` and `"8"`, `"createdAt"` for others - check schema).
     *   Example for "last week": `WHERE "eventTimestamp" >= NOW() - INTERVAL '7 days'` # Prefer this
-    *   Example for "yesterday": `WHERE DATE_TRUNC('day', "eventTimestamp") = CURRENT_DATE - INTERVAL '1 day'` # DATE_TRUNC makes sense here
-    *   Example for "March" (current year): `WHERE EXTRACT(MONTH FROM "eventTimestamp") = 3 AND EXTRACT(YEAR FROM "eventTimestamp") = EXTRACT(YEAR FROM NOW())` # Check month AND current year
+    *   Example for "yesterday": `WHERE "eventTimestamp" >= CURRENT_DATE - INTERVAL '1 day' AND "eventTimestamp" < CURRENT_DATE`
+    *   Example for "March" (current year): `WHERE "eventTimestamp" >= MAKE_DATE(EXTRACT(YEAR FROM NOW())::int, 3, 1) AND "eventTimestamp" < MAKE_DATE(EXTRACT(YEAR FROM NOW())::int, 4, 1)` # Check month AND current year
     *   Example for "first week of February" (current year): `WHERE "eventTimestamp" >= DATE_TRUNC('year', NOW()) + INTERVAL '1 month' AND "eventTimestamp" < DATE_TRUNC('year', NOW()) + INTERVAL '1 month' + INTERVAL '7 days'` 
     *   Example for "June 2024": `WHERE "eventTimestamp" >= '2024-06-01' AND "eventTimestamp" < '2024-07-01'`
-    *   **DO NOT** use parameters like `:start_date` or `:end_date` for these time calculations.
+    *   **Partitioned tables:** Tables `"5"` and `"8"` are partitioned by month on `"eventTimestamp"`. Always filter them with plain range comparisons (`>=`, `<`, `BETWEEN`) on the bare `"eventTimestamp"` column, never only through `DATE_TRUNC`/`EXTRACT` on it. Queries without any bound on `"eventTimestamp"` are automatically limited to a recent default window.
+    *   **DO NOT** use parameters like `:start_date` or `:end_date` for these time calculations (only the pre-resolved `:start_ts`/`:end_ts` described above are allowed).
 14. **Footfall Queries (Table "8"):**
     *   If the query asks generally about "footfall", "visitors", "people entering/leaving", or "how many people visited", calculate **both** the sum of entries (`SUM("39")`) and the sum of exits (`SUM("40")`).
     *   Alias them clearly (e.g., `AS "Total Entries"`, `AS "Total Exits"`).
     *   If the query specifically asks *only* for entries (e.g., "people came in") or *only* for exits (e.g., "people went out"), then only sum the corresponding column ("39" or "40").
+15. **Pre-resolved Locations:** If the `query_description` mentions parameters like `:location_1`, `:location_2`, they are already-resolved hierarchy IDs. Filter with `"hierarchyId" = :location_1` (or `IN (:location_1, :location_2)`){closure_location_hint}; join `hierarchyCaches` for display names. Do NOT add `location_*` to the `params` dictionary; the tool binds them.
 
 Output Format:
 Return ONLY a JSON object with two keys:
@@ -205,65 +137,227 @@ Example (Aggregate Query for the Org):
    "params": {{ "organization_id": "{organization_id}" }}
 }}
 """
+
+# Closure-table hints, only given to the LLM when "hierarchyClosure" exists (HIERARCHY_RESOLVE_SUBTREE, migration 0003)
+CLOSURE_PROMPT_TEXT = {
+    "closure_guideline": '    *   For data *under* a library system or library at any depth, JOIN `hierarchyClosure` (`hcl."descendantId" = <table>."hierarchyId" AND hcl."ancestorId" = :hierarchy_id`) instead of recursive queries on `hierarcyCaches`.\n',
+    "closure_location_hint": ', or join `hierarchyClosure` with `hcl."ancestorId" = :location_1` for everything under it',
+}
+NO_CLOSURE_PROMPT_TEXT = {"closure_guideline": "", "closure_location_hint": ""}
+
+class QueryRejectedError(ValueError):
+    """Raised when generated SQL is refused before or during execution (plan too expensive, timeout).
+
+    `details` is returned to the agent as a structured error so it can rewrite the query.
+    """
+    def __init__(self, message: str, details: Dict[str, Any]):
+        super().__init__(message)
+        self.details = details
+
+class SQLOutput(BaseModel):
+    sql: str = Field(description="SQL query with placeholders")
+    params: Dict[str, Any] = Field(description="Dictionary of parameters")
+
+class SQLQueryInput(BaseModel):
+    query_description: str = Field(description="Description of the data needed (e.g., 'total borrows at Argyle Branch last week').")
+    db_name: Optional[str] = Field(default=None, description="Database to query (report_management).")
+    location_names: Optional[List[str]] = Field(default=None, description="Branch/library/location names mentioned in the request, exactly as the user wrote them. The tool resolves them to hierarchy IDs itself.")
+
+class SQLQueryTool(BaseTool):
+    """Tool for querying SQL databases, ensuring results are scoped to the user's organization."""
+    
+    name: str = "sql_query"
+    description: str = """
+    Executes organization-scoped SQL queries against PostgreSQL databases.
+    Use this tool when you need to fetch specific data from the database.
+    The tool handles query generation and execution, automatically filtering by the user's organization.
+    Input should be a description of the data needed (e.g., 'total borrows last week').
+    DO NOT include organization filtering in the description; the tool adds it automatically.
+    If the request names branches/libraries/locations, pass those names in `location_names`: the tool resolves
+    them to hierarchy IDs and filters on them. If a name is ambiguous or not found, no data is queried and the
+    output's `hierarchy_resolution` lists the closest matches instead.
+    """
+    args_schema: Type[BaseModel] = SQLQueryInput
+    
+    organization_id: str
+    selected_db: Optional[str] = None
+    
+    def _get_schema_info(self, db_name: Optional[str] = None, query_description: Optional[str] = None) -> str:
+        """Get schema information from predefined schema definitions.
         
+        The text is compiled once per schema version; with a query description, only the tables
+        relevant to it are included (see SchemaPromptBuilder).
+        """
+        return schema_prompt_builder.schema_text(db_name or self.selected_db, query_description)
+    
+    
+    def _build_sql_chain(self):
+        """Build the LCEL chain that turns a query description into SQL + parameters."""
         prompt = PromptTemplate(
-            input_variables=["schema", "organization_id", "query_description"],
-            template=template,
+            input_variables=["schema", "examples", "organization_id", "query_description"],
+            template=SQL_GENERATION_TEMPLATE,
+            partial_variables=CLOSURE_PROMPT_TEXT if settings.HIERARCHY_RESOLVE_SUBTREE else NO_CLOSURE_PROMPT_TEXT,
         )
+        llm = get_chat_llm(SQL_TEMPERATURE)
+        return prompt | llm | JsonOutputParser(pydantic_object=SQLOutput)
+    
+    def _sql_generation_payload(self, query_description: str, db_name: str) -> Dict[str, Any]:
+        """Prompt variables for the SQL generation chain."""
+        return {
+            "schema": self._get_schema_info(db_name, query_description),
+            "examples": sql_example_library.format_examples(query_description, db_name, self.organization_id),
+            "organization_id": self.organization_id,
+            "query_description": query_description,
+        }
+    
+    def _parse_generated_sql(self, structured_output: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """Validate the LLM's JSON output and enforce organization scoping on the parameters."""
+        logger.debug(f"Raw LLM Output for SQL generation: {structured_output}") 
         
-        class SQLOutput(BaseModel):
-            sql: str = Field(description="SQL query with placeholders")
-            params: Dict[str, Any] = Field(description="Dictionary of parameters")
+        sql_query = structured_output.get('sql', '')
+        parameters = structured_output.get('params', {})
         
-        sql_chain = prompt | llm | JsonOutputParser(pydantic_object=SQLOutput)
+        if not isinstance(sql_query, str) or not isinstance(parameters, dict):
+             logger.error(f"LLM returned unexpected types. SQL: {type(sql_query)}, Params: {type(parameters)}")
+             raise ValueError("LLM failed to return the expected SQL/parameter structure.")
         
-        logger.debug(f"Invoking SQL generation chain for org {self.organization_id} with query: {query_description}")
+        if not sql_query:
+            raise ValueError("LLM failed to generate an SQL query string.")
+
+        if 'organization_id' not in parameters:
+            logger.warning(f":organization_id missing from LLM params. Manually adding {self.organization_id}.")
+            parameters['organization_id'] = self.organization_id
+        elif parameters['organization_id'] != self.organization_id:
+            logger.warning(f"LLM parameter :organization_id ({parameters['organization_id']}) != tool's ({self.organization_id}). Overwriting.")
+            parameters['organization_id'] = self.organization_id
+        else:
+            logger.debug(f":organization_id ({self.organization_id}) present and correct in LLM params.")
             
+        # Remove any user_id parameter if LLM included it erroneously
+        if 'user_id' in parameters:
+            logger.warning("LLM included :user_id parameter erroneously. Removing.")
+            del parameters['user_id']
+        
+        # Pre-resolved time range and location parameters are always bound by the tool, never taken from the LLM
+        for name in [name for name in parameters if name in TIME_RANGE_PARAMS or LOCATION_PARAM.match(name)]:
+            if parameters.pop(name, None) is not None:
+                logger.debug(f"Dropping LLM-provided :{name}, the tool binds it.")
+        
+        logger.debug(f"Generated SQL: {sql_query}, Params: {parameters}")
+        return sql_query, parameters
+    
+    def _normalize_time_range(self, query_description: str) -> Tuple[str, Dict[str, Any]]:
+        """Resolve a relative/calendar time expression into :start_ts/:end_ts in the org's time zone."""
+        return normalize_time_expressions(query_description, get_org_timezone(self.organization_id))
+    
+    def _bind_time_range(self, sql: str, parameters: Dict[str, Any], time_params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """Add the resolved time range to the parameters of SQL that uses it."""
+        if not time_params:
+            return sql, parameters
+        if not all(f":{name}" in sql for name in time_params):
+            logger.warning(f"Generated SQL does not use the resolved time range parameters: {sql}")
+            return sql, parameters
+        return sql, {**parameters, **time_params}
+
+    def _describe_locations(self, query_description: str, locations: Optional[List[Tuple[str, str]]]) -> Tuple[str, Dict[str, Any]]:
+        """Replace resolved location names in the description with :location_N placeholders bound to their ids.
+
+        Like the time range, the ids never reach the prompt, so the generated template is cached and
+        learned independently of the locations (and organization) it was first asked for.
+
+        Args:
+            query_description: Description as written by the agent
+            locations: (name as written, hierarchy id) pairs, in the order the agent listed them
+
+        Returns:
+            The rewritten description and the location parameters
+        """
+        if not locations:
+            return query_description, {}
+        location_params: Dict[str, Any] = {}
+        placeholders: Dict[str, str] = {}
+        for number, (name, hierarchy_id) in enumerate(locations, 1):
+            location_params[f"location_{number}"] = hierarchy_id
+            placeholders[name] = f"location :location_{number}"
+        missing = []
+        # Longest names first, so "Main Library" is not rewritten through "Main"
+        for name in sorted(placeholders, key=len, reverse=True):
+            pattern = re.compile(rf"(?<!\w){re.escape(name)}(?!\w)", re.IGNORECASE)
+            query_description, count = pattern.subn(placeholders[name], query_description)
+            if not count:
+                missing.append(placeholders[name])
+        if missing:
+            query_description = f"{query_description.rstrip(' .')} at {' and '.join(missing)}"
+        return query_description, location_params
+
+    def _prepare_description(self, query_description: str, locations: Optional[List[Tuple[str, str]]]) -> Tuple[str, Dict[str, Any]]:
+        """Description sent to the generator (locations and time range as placeholders) and the parameters the tool binds."""
+        query_description, location_params = self._describe_locations(query_description, locations)
+        query_description, time_params = self._normalize_time_range(query_description)
+        return query_description, {**location_params, **time_params}
+
+    def _bind_resolved_params(self, sql: str, parameters: Dict[str, Any], bound_params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """Add the tool-bound parameters (time range, resolved locations) to generated SQL.
+
+        Raises:
+            ValueError: If the SQL ignores a resolved location (it would return data for the wrong places)
+        """
+        time_params = {name: value for name, value in bound_params.items() if name in TIME_RANGE_PARAMS}
+        location_params = {name: value for name, value in bound_params.items() if name not in time_params}
+        sql, parameters = self._bind_time_range(sql, parameters, time_params)
+        unused = [name for name in location_params if not re.search(rf":{name}(?!\w)", sql)]
+        if unused:
+            raise ValueError(f"Generated SQL does not filter on the resolved location parameter(s) {', '.join(':' + name for name in unused)}.")
+        return sql, {**parameters, **location_params}
+    
+    def _generate_sql(
+        self, 
+        query_description: str, 
+        db_name: str,
+        locations: Optional[List[Tuple[str, str]]] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Generate SQL with placeholders and parameters from a natural language query description using LCEL, enforcing organization filtering."""
+        query_description, bound_params = self._prepare_description(query_description, locations)
+        cached = sql_template_cache.get(query_description, db_name, self.organization_id)
+        if cached:
+            logger.debug(f"SQL template cache hit for query: {query_description}")
+            return self._bind_resolved_params(*cached, bound_params)
+        sql_chain = self._build_sql_chain()
+        logger.debug(f"Invoking SQL generation chain for org {self.organization_id} with query: {query_description}")
         try:
-            invoke_payload = {
-                "schema": schema_info,
-                "organization_id": self.organization_id,
-                "query_description": query_description,
-            }
-            
-            structured_output = sql_chain.invoke(invoke_payload)
-            logger.debug(f"Raw LLM Output for SQL generation: {structured_output}") 
-            
-            sql_query = structured_output.get('sql', '')
-            parameters = structured_output.get('params', {})
-            
-            if not isinstance(sql_query, str) or not isinstance(parameters, dict):
-                 logger.error(f"LLM returned unexpected types. SQL: {type(sql_query)}, Params: {type(parameters)}")
-                 raise ValueError("LLM failed to return the expected SQL/parameter structure.")
-            
-            if not sql_query:
-                raise ValueError("LLM failed to generate an SQL query string.")
-
-            if 'organization_id' not in parameters:
-                logger.warning(f":organization_id missing from LLM params. Manually adding {self.organization_id}.")
-                parameters['organization_id'] = self.organization_id
-            elif parameters['organization_id'] != self.organization_id:
-                logger.warning(f"LLM parameter :organization_id ({parameters['organization_id']}) != tool's ({self.organization_id}). Overwriting.")
-                parameters['organization_id'] = self.organization_id
-            else:
-                logger.debug(f":organization_id ({self.organization_id}) present and correct in LLM params.")
-                
-            # Remove any user_id parameter if LLM included it erroneously
-            if 'user_id' in parameters:
-                logger.warning("LLM included :user_id parameter erroneously. Removing.")
-                del parameters['user_id']
-            
-            logger.debug(f"Generated SQL: {sql_query}, Params: {parameters}")
-            return sql_query, parameters
+            structured_output = sql_chain.invoke(self._sql_generation_payload(query_description, db_name))
+            sql, parameters = self._parse_generated_sql(structured_output)
+            sql_template_cache.put(query_description, db_name, sql, parameters, self.organization_id)
+            return self._bind_resolved_params(sql, parameters, bound_params)
         except Exception as e:
             logger.error(f"Error generating SQL: {e}", exc_info=True)
             raise
     
-    def _execute_sql(self, sql: str, parameters: Dict[str, Any], db_name: str) -> Dict:
-        """Execute SQL with parameters and return results."""
-        MAX_ROWS = 50 # Used for Python-level truncation check if needed (e.g., if LLM forgets LIMIT)
-        original_sql = sql # Keep for logging/checks if needed
-        
+    async def _agenerate_sql(
+        self, 
+        query_description: str, 
+        db_name: str,
+        locations: Optional[List[Tuple[str, str]]] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Async version of _generate_sql."""
+        query_description, bound_params = self._prepare_description(query_description, locations)
+        cached = sql_template_cache.get(query_description, db_name, self.organization_id)
+        if cached:
+            logger.debug(f"SQL template cache hit for query: {query_description}")
+            return self._bind_resolved_params(*cached, bound_params)
+        sql_chain = self._build_sql_chain()
+        logger.debug(f"Invoking SQL generation chain (async) for org {self.organization_id} with query: {query_description}")
+        try:
+            structured_output = await sql_chain.ainvoke(self._sql_generation_payload(query_description, db_name))
+            sql, parameters = self._parse_generated_sql(structured_output)
+            sql_template_cache.put(query_description, db_name, sql, parameters, self.organization_id)
+            return self._bind_resolved_params(sql, parameters, bound_params)
+        except Exception as e:
+            logger.error(f"Error generating SQL: {e}", exc_info=True)
+            raise
+    
+    def _validate_sql(self, sql: str, parameters: Dict[str, Any]) -> None:
+        """Validate generated SQL syntax and the organization scoping of its parameters before execution."""
         # --- SQL Syntax Validation using sqlparse ---
         try:
             import sqlparse
@@ -297,67 +391,394 @@ Example (Aggregate Query for the Org):
              error_msg = f"SECURITY CHECK FAILED: organization_id mismatch/missing in parameters before execution. Expected {self.organization_id}, got {parameters.get('organization_id')}. Aborting."
              logger.error(error_msg)
              raise ValueError(error_msg)
+    
+    def _route_to_rollups(self, sql: str, parameters: Dict[str, Any], db_name: str) -> str:
+        """Return the SQL to run: the equivalent rollup-table query if one applies, else sql itself."""
+        if not settings.ROLLUPS_ENABLED:
+            return sql
+        try:
+            return rollup_manager.rewrite(sql, parameters, db_name)
+        except Exception as e:
+            logger.warning(f"Rollup routing failed, querying the raw tables: {str(e)}")
+            return sql
+    
+    def _apply_time_window(self, sql: str, parameters: Dict[str, Any]) -> Tuple[str, Dict[str, Any], Optional[datetime.datetime]]:
+        """Add the default eventTimestamp window to partitioned tables the SQL does not bound."""
+        sql, parameters, window_start = apply_default_time_window(sql, parameters, settings.SQL_DEFAULT_TIME_WINDOW_DAYS)
+        if window_start is not None:
+            logger.info(f"No eventTimestamp bound in SQL for org {self.organization_id}, limiting to rows since {window_start.isoformat()}")
+        return sql, parameters, window_start
+    
+    def _cap_rows(self, sql: str) -> str:
+        """Wrap a SELECT so the database returns at most MAX_ROWS + 1 rows.
+
+        The extra row only signals truncation; it is never shown. This bounds transfer and memory
+        regardless of whether the generated SQL has a LIMIT (or a much larger one).
+        """
+        inner = sql.strip().rstrip(";").strip()
+        return f"SELECT * FROM (\n{inner}\n) AS capped_result LIMIT {MAX_ROWS + 1}"
+    
+    def _estimate_row_count(self, conn, sql: str, parameters: Dict[str, Any]) -> Optional[int]:
+        """Planner estimate of the rows an (uncapped) query returns, from EXPLAIN without executing it."""
+        try:
+            with conn.begin_nested():
+                plan = conn.execute(text(self._explain_sql(sql)), parameters).scalar()
+            return self._plan_rows(plan)
+        except SQLAlchemyError as e:
+            logger.debug(f"Row estimate unavailable: {str(e)}")
+            return None
+    
+    async def _aestimate_row_count(self, conn, sql: str, parameters: Dict[str, Any]) -> Optional[int]:
+        """Async version of _estimate_row_count."""
+        try:
+            async with conn.begin_nested():
+                plan = (await conn.execute(text(self._explain_sql(sql)), parameters)).scalar()
+            return self._plan_rows(plan)
+        except SQLAlchemyError as e:
+            logger.debug(f"Row estimate unavailable: {str(e)}")
+            return None
+    
+    def _statement_timeout_sql(self, conn) -> Optional[str]:
+        """SET LOCAL statement for the configured timeout (PostgreSQL only, applies to the current transaction)."""
+        if conn.dialect.name != "postgresql" or settings.SQL_STATEMENT_TIMEOUT_MS <= 0:
+            return None
+        return f"SET LOCAL statement_timeout = {int(settings.SQL_STATEMENT_TIMEOUT_MS)}"
+    
+    def _cost_guard_enabled(self, conn) -> bool:
+        return conn.dialect.name == "postgresql" and (settings.SQL_MAX_PLAN_COST > 0 or settings.SQL_MAX_PLAN_ROWS > 0)
+    
+    def _explain_sql(self, sql: str) -> str:
+        return f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}"
+    
+    @staticmethod
+    def _summarize_plan(plan: Dict[str, Any], max_nodes: int = 10) -> List[Dict[str, Any]]:
+        """Flatten the first plan nodes into a compact list (node type, relation, estimated rows and cost)."""
+        summary: List[Dict[str, Any]] = []
+        stack = [(plan, 0)]
+        while stack and len(summary) < max_nodes:
+            node, depth = stack.pop()
+            entry = {"depth": depth, "node": node.get("Node Type"), "rows": node.get("Plan Rows"), "total_cost": node.get("Total Cost")}
+            if node.get("Relation Name"):
+                entry["relation"] = node["Relation Name"]
+            if node.get("Filter"):
+                entry["filter"] = node["Filter"]
+            summary.append(entry)
+            stack.extend((child, depth + 1) for child in reversed(node.get("Plans", [])))
+        return summary
+    
+    def _enforce_plan_limits(self, plan: Any) -> Optional[Dict[str, Any]]:
+        """Reject a query whose estimated plan exceeds the configured cost/row limits.
         
-        engine = get_db_engine(db_name)
-        if not engine:
-            raise ValueError(f"Database engine for '{db_name}' not found")
+        Args:
+            plan: Output of EXPLAIN (FORMAT JSON)
+            
+        Returns:
+            The root plan node, if the plan could be read
+            
+        Raises:
+            QueryRejectedError: If the estimated total cost or the largest node row estimate is over the limit
+        """
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        try:
+            root = plan[0]["Plan"]
+        except (TypeError, KeyError, IndexError):
+            logger.warning("Could not read EXPLAIN output, skipping cost guard.")
+            return None
+        
+        total_cost = float(root.get("Total Cost", 0))
+        max_rows = 0
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            max_rows = max(max_rows, int(node.get("Plan Rows", 0)))
+            stack.extend(node.get("Plans", []))
+        
+        over_cost = settings.SQL_MAX_PLAN_COST > 0 and total_cost > settings.SQL_MAX_PLAN_COST
+        over_rows = settings.SQL_MAX_PLAN_ROWS > 0 and max_rows > settings.SQL_MAX_PLAN_ROWS
+        if over_cost or over_rows:
+            logger.warning(f"Rejected SQL for org {self.organization_id}: estimated cost {total_cost}, max node rows {max_rows}")
+            raise QueryRejectedError(
+                f"Query is too expensive to run (estimated cost {total_cost:.0f}, up to {max_rows} rows scanned). "
+                "Narrow it with a time range on \"eventTimestamp\", filter on specific locations, or aggregate further.",
+                {
+                    "type": "query_too_expensive",
+                    "estimated_total_cost": total_cost,
+                    "max_cost": settings.SQL_MAX_PLAN_COST,
+                    "estimated_max_rows": max_rows,
+                    "max_rows": settings.SQL_MAX_PLAN_ROWS,
+                    "plan_summary": self._summarize_plan(root),
+                },
+            )
+        return root
+    
+    def _check_query_plan(self, conn, sql: str, parameters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """EXPLAIN the query and enforce the cost guard. Returns the root plan node, or None if not checked."""
+        if not self._cost_guard_enabled(conn):
+            return None
+        plan = conn.execute(text(self._explain_sql(sql)), parameters).scalar()
+        return self._enforce_plan_limits(plan)
+    
+    async def _acheck_query_plan(self, conn, sql: str, parameters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Async version of _check_query_plan."""
+        if not self._cost_guard_enabled(conn):
+            return None
+        plan = (await conn.execute(text(self._explain_sql(sql)), parameters)).scalar()
+        return self._enforce_plan_limits(plan)
+    
+    def _timeout_error(self, error: SQLAlchemyError) -> Optional[QueryRejectedError]:
+        """Translate a statement_timeout cancellation into a structured rejection."""
+        if "statement timeout" not in str(error).lower():
+            return None
+        return QueryRejectedError(
+            f"Query was cancelled after {settings.SQL_STATEMENT_TIMEOUT_MS} ms. Narrow the time range or aggregate further.",
+            {"type": "statement_timeout", "timeout_ms": settings.SQL_STATEMENT_TIMEOUT_MS},
+        )
+    
+    @staticmethod
+    def _plan_rows(plan: Any) -> Optional[int]:
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        try:
+            return int(plan[0]["Plan"]["Plan Rows"])
+        except (TypeError, KeyError, IndexError, ValueError):
+            return None
+    
+    def _format_results(self, columns: List[str], raw_rows: List[Any], original_sql: str, estimated_total: Optional[int] = None) -> Dict:
+        """Convert fetched rows (at most MAX_ROWS + 1) into the tool's table structure.
         
+        Args:
+            columns: Result column names
+            raw_rows: Fetched rows; a row beyond MAX_ROWS means the result was truncated
+            original_sql: SQL as generated, used to detect COUNT queries
+            estimated_total: Optional planner estimate of the full row count
+            
+        Returns:
+            Table dictionary with `columns`, `rows` and, if truncated, `metadata`
+        """
+        truncated = False
+        
+        # Use original_sql check for COUNT queries because `sql` might have placeholders
+        is_count_query = original_sql.strip().upper().startswith("SELECT COUNT")
+        
+        if not is_count_query and len(raw_rows) > MAX_ROWS:
+            # This acts as a safeguard if the LLM generates a large LIMIT or no LIMIT.
+            truncated = True
+            raw_rows = raw_rows[:MAX_ROWS]
+            logger.warning(f"Query results exceeded {MAX_ROWS} rows. Truncating.")
+        
+        rows = [list(row) for row in raw_rows]
+        
+        if is_count_query:
+             if len(rows) == 1 and len(columns) == 1:
+                 return {"columns": columns, "rows": rows}
+             else:
+                 logger.warning(f"COUNT query returned unexpected structure: {columns}, {rows}")
+                 # Fall through to return structure anyway
+         
+        # Include truncation info if applicable
+        response_data = {"columns": columns, "rows": rows}
+        if truncated:
+            response_data["metadata"] = {"truncated": True, "rows_shown": MAX_ROWS}
+            if estimated_total is not None:
+                response_data["metadata"]["estimated_total_rows"] = max(estimated_total, MAX_ROWS + 1)
+            
+        return response_data
+    
+    def _memoized_watermarks(self, db_name: str, tables: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        """Recently probed watermarks for all tables, or None if any of them must be probed again."""
+        watermarks = {}
+        for table in tables:
+            value = sql_result_cache.watermarks.get(sql_result_cache.watermark_key(db_name, self.organization_id, table))
+            if value is None:
+                return None
+            watermarks[table] = value
+        return watermarks
+    
+    def _probe_watermarks(self, conn, db_name: str, tables: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        """Read the current watermarks of the given tables for this org. Returns None if probing failed."""
+        watermarks = {}
+        try:
+            # Savepoint, so a failed probe does not abort the transaction the query runs in
+            with conn.begin_nested():
+                for table in tables:
+                    row = conn.execute(text(WATERMARK_QUERIES[table]), {"organization_id": self.organization_id}).first()
+                    watermarks[table] = tuple(row) if row is not None else ()
+        except SQLAlchemyError as e:
+            logger.warning(f"Watermark probe failed for org {self.organization_id}, skipping result cache: {str(e)}")
+            return None
+        for table, value in watermarks.items():
+            sql_result_cache.watermarks.set(sql_result_cache.watermark_key(db_name, self.organization_id, table), value)
+        return watermarks
+    
+    async def _aprobe_watermarks(self, conn, db_name: str, tables: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        """Async version of _probe_watermarks."""
+        watermarks = {}
+        try:
+            async with conn.begin_nested():
+                for table in tables:
+                    row = (await conn.execute(text(WATERMARK_QUERIES[table]), {"organization_id": self.organization_id})).first()
+                    watermarks[table] = tuple(row) if row is not None else ()
+        except SQLAlchemyError as e:
+            logger.warning(f"Watermark probe failed for org {self.organization_id}, skipping result cache: {str(e)}")
+            return None
+        for table, value in watermarks.items():
+            sql_result_cache.watermarks.set(sql_result_cache.watermark_key(db_name, self.organization_id, table), value)
+        return watermarks
+    
+    # --- Execution steps shared by _execute_sql and _aexecute_sql ---
+    
+    def _prepare_execution(self, sql: str, parameters: Dict[str, Any], db_name: str) -> Tuple[str, Dict[str, Any], Optional[datetime.datetime]]:
+        """Validate generated SQL and return (SQL to run, its parameters, default window start or None)."""
+        self._validate_sql(sql, parameters)
+        # Cache keys and watermarks follow the generated SQL; the database may answer it from a rollup
+        executed_sql = self._route_to_rollups(sql, parameters, db_name)
+        window_start = None
+        if executed_sql == sql:
+            # Raw event tables are partitioned by month: make sure the planner can prune them
+            executed_sql, parameters, window_start = self._apply_time_window(sql, parameters)
         # Log execution details - be mindful of sensitive data in parameters in production
         logger.debug(f"Executing SQL for org {self.organization_id}: {sql}")
         logger.debug(f"With Parameters: {parameters}") # Ensure datetime objects are handled correctly by logger/SQLAlchemy
+        return executed_sql, parameters, window_start
+    
+    def _cached_results(self, cache_key: str, watermarks: Optional[Dict[str, Any]]) -> Optional[Dict]:
+        """Result cache entry for the query, if the org's event data is unchanged since it was stored."""
+        if watermarks is None:
+            return None
+        cached = sql_result_cache.get(cache_key, watermarks)
+        if cached is not None:
+            logger.debug(f"SQL result cache hit for org {self.organization_id}")
+        return cached
+    
+    @staticmethod
+    def _needs_row_estimate(raw_rows: List[Any]) -> bool:
+        """Whether the results were truncated and their total row count should be estimated."""
+        return len(raw_rows) > MAX_ROWS and settings.SQL_ESTIMATE_TRUNCATED_ROWS
+    
+    def _build_results(
+        self, sql: str, columns: List[str], raw_rows: List[Any], estimated_total: Optional[int],
+        window_start: Optional[datetime.datetime], cache_key: str, watermarks: Optional[Dict[str, Any]]
+    ) -> Dict:
+        """Format fetched rows, note the default time window and store the results in the result cache."""
+        results = self._format_results(columns, raw_rows, sql, estimated_total)
+        if window_start is not None:
+            results.setdefault("metadata", {})["default_time_window_start"] = window_start.isoformat()
+        if watermarks is not None:
+            sql_result_cache.put(cache_key, results, sql, self.organization_id, watermarks)
+        return results
+    
+    def _execution_error(self, error: Exception, sql: str, parameters: Dict[str, Any]) -> Tuple[str, Exception]:
+        """Query log status and the exception to raise for a failed execution."""
+        if isinstance(error, QueryRejectedError):
+            return "rejected", error
+        if isinstance(error, SQLAlchemyError):
+            timeout_error = self._timeout_error(error)
+            if timeout_error:
+                logger.warning(f"SQL for org {self.organization_id} hit the statement timeout: {sql}")
+                return "timeout", timeout_error
+            # Log the specific SQL and params that caused the error
+            logger.error(f"SQL execution error for org {self.organization_id}, query: {sql}, params: {parameters}. Error: {str(error)}", exc_info=True)
+            # Provide a more informative error message
+            return "error", ValueError(f"Database error executing query. Please check query syntax and parameters. Details: {str(error)}")
+        # Other potential errors (like connection issues)
+        logger.error(f"Unexpected error during SQL execution for org {self.organization_id}: {error}", exc_info=True)
+        return "error", ValueError(f"An unexpected error occurred during query execution: {str(error)}")
+    
+    def _execute_sql(self, sql: str, parameters: Dict[str, Any], db_name: str) -> Dict:
+        """Execute SQL with parameters and return results."""
+        executed_sql, parameters, window_start = self._prepare_execution(sql, parameters, db_name)
+        engine = get_db_engine(db_name)
+        if not engine:
+            raise ValueError(f"Database engine for '{db_name}' not found")
+        
+        # Serve repeated queries from the result cache while the org's event data is unchanged
+        cache_key = sql_result_cache.make_key(db_name, sql, parameters)
+        tables = sql_result_cache.watermark_tables(sql)
+        watermarks = self._memoized_watermarks(db_name, tables)
+        cached = self._cached_results(cache_key, watermarks)
+        if cached is not None:
+            return cached
         
+        started = None
+        status, row_count = "error", None
         try:
             with engine.connect() as conn:
-                # Execute with parameters for safety
-                result = conn.execute(text(sql), parameters)
+                # All statements below share one transaction, so the timeout covers probes, EXPLAIN and the query
+                timeout_sql = self._statement_timeout_sql(conn)
+                if timeout_sql:
+                    conn.execute(text(timeout_sql))
+                if watermarks is None:
+                    watermarks = self._probe_watermarks(conn, db_name, tables)
+                    cached = self._cached_results(cache_key, watermarks)
+                    if cached is not None:
+                        return cached
+                # Refuse queries whose estimated plan is too expensive before running them
+                started = time.perf_counter()
+                plan = self._check_query_plan(conn, executed_sql, parameters)
+                # Execute with parameters for safety; never fetch more than MAX_ROWS + 1 rows
+                result = conn.execute(text(self._cap_rows(executed_sql)), parameters)
                 columns = list(result.keys())
-                
-                # Fetch rows
-                raw_rows = result.fetchall() 
-                
-                truncated = False
-                total_count = len(raw_rows)
-                
-                # Use original_sql check for COUNT queries because `sql` might have placeholders
-                is_count_query = original_sql.strip().upper().startswith("SELECT COUNT")
-                
-                if not is_count_query and total_count > MAX_ROWS:
-                    # This acts as a safeguard if the LLM generates a large LIMIT or no LIMIT.
-                    truncated = True
-                    raw_rows = raw_rows[:MAX_ROWS]
-                    logger.warning(f"Query results exceeded {MAX_ROWS} rows. Truncating.")
-                
-                rows = [list(row) for row in raw_rows]
-                
-                if is_count_query:
-                     if len(rows) == 1 and len(columns) == 1:
-                         return {"columns": columns, "rows": rows}
-                     else:
-                         logger.warning(f"COUNT query returned unexpected structure: {columns}, {rows}")
-                         # Fall through to return structure anyway
-                 
-                # Include truncation info if applicable
-                response_data = {"columns": columns, "rows": rows}
-                if truncated:
-                    response_data["metadata"] = {"truncated": True, "total_rows_returned": total_count, "rows_shown": MAX_ROWS}
-                    
-                return response_data
-                
-        except SQLAlchemyError as e:
-            # Log the specific SQL and params that caused the error
-            logger.error(f"SQL execution error for org {self.organization_id}, query: {sql}, params: {parameters}. Error: {str(e)}", exc_info=True)
-            # Provide a more informative error message
-            raise ValueError(f"Database error executing query. Please check query syntax and parameters. Details: {str(e)}")
-        except Exception as e: # Catch other potential errors (like connection issues)
-            logger.error(f"Unexpected error during SQL execution for org {self.organization_id}: {e}", exc_info=True)
-            raise ValueError(f"An unexpected error occurred during query execution: {str(e)}")
+                raw_rows = result.fetchmany(MAX_ROWS + 1)
+                result.close()
+                status, row_count = "ok", len(raw_rows)
+                estimated_total = None
+                if self._needs_row_estimate(raw_rows):
+                    estimated_total = self._plan_rows([{"Plan": plan}]) if plan else self._estimate_row_count(conn, executed_sql, parameters)
+                return self._build_results(sql, columns, raw_rows, estimated_total, window_start, cache_key, watermarks)
+        except Exception as e:
+            status, error = self._execution_error(e, sql, parameters)
+            raise error
+        finally:
+            if started is not None:
+                sql_query_log.record(executed_sql, parameters, db_name, (time.perf_counter() - started) * 1000, status, row_count)
     
-    def _run(
-        self, query_description: str, db_name: Optional[str] = None
-    ) -> str:
-        """Run the tool: generate parameterized SQL, execute, format results."""
-        logger.info(f"Executing SQL query tool for org {self.organization_id} with description: '{query_description}'")
+    async def _aexecute_sql(self, sql: str, parameters: Dict[str, Any], db_name: str) -> Dict:
+        """Execute SQL with parameters on the async (asyncpg) engine and return results."""
+        executed_sql, parameters, window_start = self._prepare_execution(sql, parameters, db_name)
+        engine = get_async_db_engine(db_name)
+        if not engine:
+            raise ValueError(f"Async database engine for '{db_name}' not found")
+        
+        cache_key = sql_result_cache.make_key(db_name, sql, parameters)
+        tables = sql_result_cache.watermark_tables(sql)
+        watermarks = self._memoized_watermarks(db_name, tables)
+        cached = self._cached_results(cache_key, watermarks)
+        if cached is not None:
+            return cached
         
+        started = None
+        status, row_count = "error", None
+        try:
+            async with engine.connect() as conn:
+                timeout_sql = self._statement_timeout_sql(conn)
+                if timeout_sql:
+                    await conn.execute(text(timeout_sql))
+                if watermarks is None:
+                    watermarks = await self._aprobe_watermarks(conn, db_name, tables)
+                    cached = self._cached_results(cache_key, watermarks)
+                    if cached is not None:
+                        return cached
+                started = time.perf_counter()
+                plan = await self._acheck_query_plan(conn, executed_sql, parameters)
+                result = await conn.execute(text(self._cap_rows(executed_sql)), parameters)
+                columns = list(result.keys())
+                raw_rows = result.fetchmany(MAX_ROWS + 1)
+                result.close()
+                status, row_count = "ok", len(raw_rows)
+                estimated_total = None
+                if self._needs_row_estimate(raw_rows):
+                    estimated_total = self._plan_rows([{"Plan": plan}]) if plan else await self._aestimate_row_count(conn, executed_sql, parameters)
+                return self._build_results(sql, columns, raw_rows, estimated_total, window_start, cache_key, watermarks)
+        except Exception as e:
+            status, error = self._execution_error(e, sql, parameters)
+            raise error
+        finally:
+            if started is not None:
+                sql_query_log.record(executed_sql, parameters, db_name, (time.perf_counter() - started) * 1000, status, row_count)
+    
+    def _resolve_target_db(self, db_name: Optional[str]) -> str:
+        """Pick the database to query, falling back to the first defined schema."""
         target_db = db_name or self.selected_db
         if not target_db:
             if not SCHEMA_DEFINITIONS:
@@ -372,50 +793,140 @@ Example (Aggregate Query for the Org):
                  raise ValueError("No database schemas available to select a default.")
 
         self.selected_db = target_db # Store for potential future calls within the same agent run
+        return target_db
+    
+    def _learn_example(
+        self, query_description: str, sql: str, parameters: Dict[str, Any], db_name: str, results: Dict,
+        locations: Optional[List[Tuple[str, str]]] = None
+    ) -> None:
+        """Offer generated SQL that returned rows to the few-shot example library."""
+        if not results.get("rows"):
+            return
+        description, bound_params = self._prepare_description(query_description, locations)
+        template_params = {name: value for name, value in parameters.items() if name not in bound_params}
+        sql_example_library.learn(description, db_name, sql, template_params, self.organization_id)
+    
+    def _format_output(self, results: Dict, query_description: str) -> str:
+        """Serialize query results into the tool's JSON output."""
+        row_count = len(results.get('rows', []))
+        logger.info(f"SQL query returned {row_count} rows for org {self.organization_id}, description: '{query_description}'")
+        
+        text_summary = f"Retrieved {row_count} rows of data matching your query."
+        metadata = results.get("metadata", {})
+        if metadata.get("truncated"):
+            if metadata.get("estimated_total_rows") is not None:
+                text_summary += f" (Results truncated to {metadata['rows_shown']} rows from an estimated {metadata['estimated_total_rows']} total)."
+            else:
+                text_summary += f" (Results truncated to {metadata['rows_shown']} rows; more rows matched)."
+        if metadata.get("default_time_window_start"):
+            text_summary += f" No time range was specified, so only data since {metadata['default_time_window_start'][:10]} was included."
 
-        # Execute the main SQL generation and execution logic
-        try:
-            # Generate SQL and parameters (no dates passed)
-            sql, parameters = self._generate_sql(query_description, target_db)
-            
-            results = self._execute_sql(sql, parameters, target_db)
-            row_count = len(results.get('rows', []))
-            logger.info(f"SQL query returned {row_count} rows for org {self.organization_id}, description: '{query_description}'")
-            
-            text_summary = f"Retrieved {row_count} rows of data matching your query."
-            if results.get("metadata", {}).get("truncated"):
-                text_summary += f" (Results truncated to {results['metadata']['rows_shown']} rows from {results['metadata']['total_rows_returned']} total)."
-
-            output_dict = {
-                "table": results, # Includes potential metadata key
-                "text": text_summary
-            }
-            return json.dumps(output_dict, default=json_default)
-            
-        except ValueError as ve: # Catch generation/execution ValueErrors
-             logger.error(f"SQL Tool failed for org {self.organization_id}, description '{query_description}': {ve}", exc_info=False) # Keep log cleaner
-             # Return structured error message to the agent/user
+        output_dict = {
+            "table": results, # Includes potential metadata key
+            "text": text_summary
+        }
+        return json.dumps(output_dict, default=json_default)
+    
+    def _format_failure(self, error: Exception, query_description: str) -> str:
+        """Structured error output returned to the agent/user instead of raising."""
+        if isinstance(error, QueryRejectedError): # Cost guard / timeout: give the agent what it needs to rewrite
+             logger.warning(f"SQL Tool rejected query for org {self.organization_id}, description '{query_description}': {error}")
+             fallback_output = {
+                 "table": {"columns": ["Error"], "rows": [[f"Query rejected: {error}"]]},
+                 "text": f"The query was rejected: {error} Please rewrite the request more narrowly and try again.",
+                 "error": error.details,
+             }
+        elif isinstance(error, ValueError): # Generation/execution ValueErrors
+             logger.error(f"SQL Tool failed for org {self.organization_id}, description '{query_description}': {error}", exc_info=False) # Keep log cleaner
              fallback_output = {
-                 "table": {"columns": ["Error"], "rows": [[f"Failed to process query: {ve}"]]},
-                 "text": f"Error processing your query: {ve}"
+                 "table": {"columns": ["Error"], "rows": [[f"Failed to process query: {error}"]]},
+                 "text": f"Error processing your query: {error}"
              }
-             return json.dumps(fallback_output, default=json_default)
-        except Exception as e: # Catch other unexpected errors
-            logger.exception(f"Unexpected critical error in SQL Tool for org {self.organization_id}, description '{query_description}': {e}", exc_info=True)
+        else: # Other unexpected errors
+            logger.exception(f"Unexpected critical error in SQL Tool for org {self.organization_id}, description '{query_description}': {error}", exc_info=error)
             fallback_output = {
                  "table": {"columns": ["Error"], "rows": [["An unexpected critical error occurred."]]},
                  "text": f"An unexpected critical error occurred while processing your query."
              }
-            return json.dumps(fallback_output, default=json_default)
+        return json.dumps(fallback_output, default=json_default)
+    
+    # --- Location name resolution ---
+
+    def _resolved_locations(self, resolution: Dict[str, Any], location_names: List[str]) -> Optional[List[Tuple[str, str]]]:
+        """(name, id) pairs if every name resolved unambiguously, otherwise None."""
+        results = resolution.get("resolution_results", {})
+        locations = []
+        for name in dict.fromkeys(location_names):
+            result = results.get(name, {})
+            if result.get("status") != "found":
+                return None
+            locations.append((name, result["id"]))
+        return locations
+
+    def _format_unresolved(self, resolution: Dict[str, Any], location_names: List[str]) -> str:
+        """Output returned to the agent, without querying, when a location name did not resolve to one entry."""
+        results = resolution.get("resolution_results", {})
+        problems = []
+        for name in dict.fromkeys(location_names):
+            result = results.get(name, {})
+            status = result.get("status", "error")
+            if status == "found":
+                continue
+            options = ", ".join(f"'{match['resolved_name']}'" for match in result.get("matches", []))
+            if status == "ambiguous":
+                problems.append(f"'{name}' matches several locations ({options})")
+            elif status == "not_found":
+                problems.append(f"'{name}' was not found" + (f" (closest: {options})" if options else ""))
+            else:
+                problems.append(f"'{name}' could not be resolved ({result.get('error_message', status)})")
+        logger.info(f"SQL query tool did not query for org {self.organization_id}: {'; '.join(problems)}")
+        output = {
+            "text": f"No data was queried because {'; '.join(problems)}. Ask the user which location is meant, or call sql_query again with the exact names.",
+            "hierarchy_resolution": results,
+        }
+        return json.dumps(output, default=json_default)
+
+    def _run(
+        self, query_description: str, db_name: Optional[str] = None, location_names: Optional[List[str]] = None
+    ) -> str:
+        """Run the tool: resolve location names, generate parameterized SQL, execute, format results."""
+        logger.info(f"Executing SQL query tool for org {self.organization_id} with description: '{query_description}'")
+        try:
+            locations = None
+            if location_names:
+                resolution = HierarchyNameResolverTool(organization_id=self.organization_id)._run(location_names)
+                locations = self._resolved_locations(resolution, location_names)
+                if locations is None:
+                    return self._format_unresolved(resolution, location_names)
+            target_db = self._resolve_target_db(db_name)
+            # Generate SQL and parameters (no dates passed)
+            sql, parameters = self._generate_sql(query_description, target_db, locations)
+            results = self._execute_sql(sql, parameters, target_db)
+            self._learn_example(query_description, sql, parameters, target_db, results, locations)
+            return self._format_output(results, query_description)
+        except Exception as e:
+            return self._format_failure(e, query_description)
     
     async def _arun(
-        self, query_description: str, db_name: Optional[str] = None
+        self, query_description: str, db_name: Optional[str] = None, location_names: Optional[List[str]] = None
     ) -> str:
-        """Run the tool asynchronously."""
-        # Still uses run_in_executor for now as core logic is synchronous.
-        # True async requires asyncpg/aiopg integration and async LLM calls.
-        loop = asyncio.get_event_loop()
-        # Ensure _run has access to self correctly
-        db_to_use = db_name or self.selected_db
-        func = functools.partial(self._run, query_description=query_description, db_name=db_to_use)
-        return await loop.run_in_executor(None, func)
+        """Run the tool asynchronously: async LLM call and asyncpg execution, no executor threads.
+
+        Location names are resolved here from the shared hierarchy index (no agent round trip); the agent
+        only gets control back when one of them is ambiguous or not found.
+        """
+        logger.info(f"Executing SQL query tool (async) for org {self.organization_id} with description: '{query_description}'")
+        try:
+            locations = None
+            if location_names:
+                resolution = await HierarchyNameResolverTool(organization_id=self.organization_id)._arun(location_names)
+                locations = self._resolved_locations(resolution, location_names)
+                if locations is None:
+                    return self._format_unresolved(resolution, location_names)
+            target_db = self._resolve_target_db(db_name)
+            sql, parameters = await self._agenerate_sql(query_description, target_db, locations)
+            results = await self._aexecute_sql(sql, parameters, target_db)
+            self._learn_example(query_description, sql, parameters, target_db, results, locations)
+            return self._format_output(results, query_description)
+        except Exception as e:
+            return self._format_failure(e, query_description)
@@ -4,11 +4,11 @@ from typing import Any, Dict, List, Optional, Tuple
 
 from langchain.prompts import PromptTemplate
 from langchain.tools import BaseTool
-from langchain_openai import AzureChatOpenAI
 from sqlalchemy import text
 from langchain_core.output_parsers import StrOutputParser
 
 from app.core.config import settings
+from app.core.llm import SUMMARY_DECOMPOSE_TEMPERATURE, SUMMARY_SYNTHESIS_TEMPERATURE, get_chat_llm
 from app.db.connection import get_db_engine
 from app.langchain.tools.sql_tool import SQLQueryTool
 
@@ -28,15 +28,8 @@ class SummarySynthesizerTool(BaseTool):
     
     def _decompose_query(self, query: str) -> List[str]:
         """Decompose a complex query into subqueries using LLM."""
-        # Create an Azure OpenAI instance
-        llm = AzureChatOpenAI(
-            openai_api_key=settings.AZURE_OPENAI_API_KEY,
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-            openai_api_version=settings.AZURE_OPENAI_API_VERSION,
-            deployment_name=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
-            model_name=settings.LLM_MODEL_NAME,
-            temperature=0.1,
-        )
+        # Get the pooled Azure OpenAI client
+        llm = get_chat_llm(SUMMARY_DECOMPOSE_TEMPERATURE)
         
         # Create prompt template
         template = """
@@ -119,15 +112,8 @@ class SummarySynthesizerTool(BaseTool):
     
     def _synthesize_results(self, query: str, subquery_results: List[Tuple[str, Dict]]) -> str:
         """Synthesize subquery results into a coherent summary."""
-        # Create an Azure OpenAI instance
-        llm = AzureChatOpenAI(
-            openai_api_key=settings.AZURE_OPENAI_API_KEY,
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-            openai_api_version=settings.AZURE_OPENAI_API_VERSION,
-            deployment_name=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
-            model_name=settings.LLM_MODEL_NAME,
-            temperature=0.3,
-        )
+        # Get the pooled Azure OpenAI client
+        llm = get_chat_llm(SUMMARY_SYNTHESIS_TEMPERATURE)
         
         # Convert results to string format, accessing the 'table' within the dict
         results_str = ""
@@ -135,8 +121,8 @@ class SummarySynthesizerTool(BaseTool):
             results_str += f"Subquery: {subquery}\n"
             table_data = result_dict.get("table", {})
             limited_rows = table_data.get("rows", [])[:5]
-            results_str += f"Results (showing up to 5 rows): {json.dumps({"columns": table_data.get("columns", []), "rows": limited_rows}, indent=2)}\n"
-            results_str += f"Total rows in original result: {len(table_data.get("rows", []))}\n\n"
+            results_str += f"Results (showing up to 5 rows): {json.dumps({'columns': table_data.get('columns', []), 'rows': limited_rows}, indent=2)}\n"
+            results_str += f"Total rows in original result: {len(table_data.get('rows', []))}\n\n"
         
         # Create prompt template
         template = """
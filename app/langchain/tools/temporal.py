@@ -0,0 +1,233 @@
+"""
+Deterministic normalization of relative and calendar time expressions in query descriptions.
+
+Phrases like "last week", "yesterday", "this month" or "Q1 2025" are replaced with a reference to
+the bound parameters :start_ts / :end_ts (a half-open, day-aligned range in the organization's time
+zone). The LLM then only has to write `"eventTimestamp" >= :start_ts AND "eventTimestamp" < :end_ts`,
+so the generated SQL no longer depends on the current date and can be cached and reused.
+"""
+import calendar
+import logging
+import re
+from datetime import date, datetime, time, timedelta, tzinfo
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Text that replaces the matched time expression in the description
+RANGE_REFERENCE = "within the time range from :start_ts (inclusive) to :end_ts (exclusive)"
+
+_MONTHS = {
+    name: index
+    for index, names in enumerate(
+        [("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"), ("may",), ("june", "jun"),
+         ("july", "jul"), ("august", "aug"), ("september", "sep", "sept"), ("october", "oct"),
+         ("november", "nov"), ("december", "dec")],
+        start=1,
+    )
+    for name in names
+}
+_MONTH_NAMES = "|".join(sorted(_MONTHS, key=len, reverse=True))
+_UNITS = {"day": "day", "days": "day", "week": "week", "weeks": "week", "month": "month", "months": "month",
+          "year": "year", "years": "year", "quarter": "quarter", "quarters": "quarter"}
+_NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+                 "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "fourteen": 14, "thirty": 30}
+_ORDINAL_QUARTERS = {"first": 1, "1st": 1, "second": 2, "2nd": 2, "third": 3, "3rd": 3, "fourth": 4, "4th": 4}
+
+
+# --- Calendar helpers ---
+
+def _add_months(day: date, months: int) -> date:
+    """Same day of the month, months later/earlier (clamped to the last day: Mar 31 - 1 month = Feb 28)."""
+    month_index = day.year * 12 + (day.month - 1) + months
+    year, month = month_index // 12, month_index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())  # Weeks start on Monday
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _quarter_start(day: date) -> date:
+    return date(day.year, 3 * ((day.month - 1) // 3) + 1, 1)
+
+
+def _shift(day: date, unit: str, amount: int) -> date:
+    if unit == "day":
+        return day + timedelta(days=amount)
+    if unit == "week":
+        return day + timedelta(weeks=amount)
+    if unit == "month":
+        return _add_months(day, amount)
+    if unit == "quarter":
+        return _add_months(day, 3 * amount)
+    return _add_months(day, 12 * amount)
+
+
+def _period_start(day: date, unit: str) -> date:
+    if unit == "day":
+        return day
+    if unit == "week":
+        return _week_start(day)
+    if unit == "month":
+        return _month_start(day)
+    if unit == "quarter":
+        return _quarter_start(day)
+    return date(day.year, 1, 1)
+
+
+def _parse_count(token: str) -> Optional[int]:
+    token = token.lower()
+    if token.isdigit():
+        return int(token)
+    return _NUMBER_WORDS.get(token)
+
+
+# --- Expression rules: each maps a regex match and today's date to a [start, end) date range ---
+
+DateRange = Tuple[date, date]
+
+
+def _rolling_window(today: date, unit: str, count: int) -> DateRange:
+    # Exactly count units of days ending with today: "last 7 days" on Oct 18 is Oct 12 - Oct 18
+    end = today + timedelta(days=1)
+    return _shift(end, unit, -count), end
+
+
+def _rolling(match: re.Match, today: date) -> DateRange:
+    # "last 3 months", "past 7 days", "previous two weeks": rolling window ending with today
+    count = _parse_count(match.group("count"))
+    unit = _UNITS[match.group("unit").lower()]
+    return _rolling_window(today, unit, count)
+
+
+def _rolling_single(match: re.Match, today: date) -> DateRange:
+    # "last week", "past month", "last year": rolling window of one unit ending with today
+    unit = _UNITS[match.group("unit").lower()]
+    return _rolling_window(today, unit, 1)
+
+
+def _current_period(match: re.Match, today: date) -> DateRange:
+    # "this week", "this month", "this quarter", "this year": the whole calendar period
+    unit = _UNITS[match.group("unit").lower()]
+    start = _period_start(today, unit)
+    return start, _shift(start, unit, 1)
+
+
+def _previous_period(match: re.Match, today: date) -> DateRange:
+    # "previous calendar month", "last calendar week": the whole previous calendar period
+    unit = _UNITS[match.group("unit").lower()]
+    end = _period_start(today, unit)
+    return _shift(end, unit, -1), end
+
+
+def _single_day(offset: int) -> Callable[[re.Match, date], DateRange]:
+    def rule(match: re.Match, today: date) -> DateRange:
+        day = today + timedelta(days=offset)
+        return day, day + timedelta(days=1)
+    return rule
+
+
+def _quarter(match: re.Match, today: date) -> DateRange:
+    # "Q1 2025", "Q3", "first quarter of 2024"; without a year the current year is assumed
+    token = (match.group("q") or match.group("ordinal")).lower()
+    quarter = int(token) if token.isdigit() else _ORDINAL_QUARTERS[token]
+    year = int(match.group("year")) if match.group("year") else today.year
+    start = date(year, 3 * (quarter - 1) + 1, 1)
+    return start, _add_months(start, 3)
+
+
+def _month(match: re.Match, today: date) -> DateRange:
+    # "March 2024", "in June"; without a year the current year is assumed
+    month = _MONTHS[match.group("month").lower()]
+    year = int(match.group("year")) if match.group("year") else today.year
+    start = date(year, month, 1)
+    return start, _add_months(start, 1)
+
+
+def _year(match: re.Match, today: date) -> DateRange:
+    year = int(match.group("year"))
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+_COUNT = r"(?P<count>\d+|" + "|".join(_NUMBER_WORDS) + r")"
+_UNIT = r"(?P<unit>days?|weeks?|months?|quarters?|years?)"
+_YEAR = r"(?P<year>20\d{2})"
+
+# Order matters: more specific phrases are tried first
+_RULES: List[Tuple[re.Pattern, Callable[[re.Match, date], DateRange]]] = [
+    (re.compile(rf"\b(?:in |over |during |for )?(?:the )?(?:last|past|previous) {_COUNT} {_UNIT}\b", re.I), _rolling),
+    (re.compile(rf"\b(?:in |during |for )?(?:the )?(?:previous|last) calendar {_UNIT}\b", re.I), _previous_period),
+    (re.compile(rf"\b(?:in |over |during |for )?(?:the )?(?:last|past) {_UNIT}\b", re.I), _rolling_single),
+    (re.compile(rf"\b(?:in |during |for )?this {_UNIT}\b", re.I), _current_period),
+    (re.compile(r"\b(?:for |on )?yesterday\b", re.I), _single_day(-1)),
+    (re.compile(r"\b(?:for |on )?today\b", re.I), _single_day(0)),
+    (re.compile(rf"\b(?:in |during |for )?(?:the )?(?:q(?P<q>[1-4])|(?P<ordinal>first|1st|second|2nd|third|3rd|fourth|4th) quarter)(?:,? (?:of )?{_YEAR})?\b", re.I), _quarter),
+    (re.compile(rf"\b(?:in |during |for )?(?P<month>{_MONTH_NAMES}),? {_YEAR}\b", re.I), _month),
+    # A bare month name needs a preposition so words like "may" are not mistaken for months
+    (re.compile(rf"\b(?:in|during|for) (?P<month>{_MONTH_NAMES})(?P<year>)\b(?! \d{{1,2}}\b)", re.I), _month),
+    (re.compile(rf"\b(?:in |during |for )(?:the year )?{_YEAR}\b", re.I), _year),
+]
+
+
+def get_org_timezone(organization_id: Optional[str]) -> tzinfo:
+    """Time zone used for an organization's calendar boundaries (ORG_TIMEZONES override, else ORG_DEFAULT_TIMEZONE)."""
+    name = settings.ORG_TIMEZONES.get(organization_id or "", settings.ORG_DEFAULT_TIMEZONE)
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning(f"Unknown time zone '{name}' for org {organization_id}, using UTC.")
+        return ZoneInfo("UTC")
+
+
+def normalize_time_expressions(
+    query_description: str,
+    tz: tzinfo,
+    now: Optional[datetime] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """Replace a single time expression in a description with :start_ts/:end_ts parameters.
+
+    Args:
+        query_description: Natural language query description
+        tz: Time zone whose midnight boundaries delimit days
+        now: Current time, defaults to datetime.now(tz)
+
+    Returns:
+        Tuple of (rewritten description, {"start_ts": ..., "end_ts": ...} as tz-aware datetimes).
+        If no expression, or more than one, is found the description is returned unchanged with no parameters.
+    """
+    today = (now.astimezone(tz) if now else datetime.now(tz)).date()
+
+    matches = []
+    for pattern, rule in _RULES:
+        for match in pattern.finditer(query_description):
+            if any(match.start() < end and start < match.end() for start, end, _, _ in matches):
+                continue
+            matches.append((match.start(), match.end(), match, rule))
+
+    if len(matches) != 1:
+        if matches:
+            logger.debug(f"Found {len(matches)} time expressions in '{query_description}', leaving them to the LLM")
+        return query_description, {}
+
+    start, end, match, rule = matches[0]
+    try:
+        start_day, end_day = rule(match, today)
+    except (ValueError, TypeError, KeyError) as e:
+        logger.debug(f"Could not normalize time expression '{match.group(0)}': {str(e)}")
+        return query_description, {}
+
+    rewritten = f"{query_description[:start]}{RANGE_REFERENCE}{query_description[end:]}"
+    params = {
+        "start_ts": datetime.combine(start_day, time.min, tzinfo=tz),
+        "end_ts": datetime.combine(end_day, time.min, tzinfo=tz),
+    }
+    logger.debug(f"Normalized time expression '{match.group(0)}' to [{params['start_ts']}, {params['end_ts']})")
+    return rewritten, params
@@ -10,7 +10,15 @@ from fastapi.staticfiles import StaticFiles
 
 from app.api import chat, health
 from app.core.config import settings
+from app.core.llm import close_llm_clients, warm_llm_clients
 from app.core.logging import setup_logging
+from app.db.connection import dispose_async_engines
+from app.db.partitions import partition_maintainer
+from app.db.rollups import rollup_manager
+from app.langchain.tools.chart_pool import chart_pool
+from app.langchain.tools.chart_store import ChartStaticFiles, chart_store
+from app.langchain.tools.hierarchy_index import hierarchy_index
+from app.langchain.tools.sql_examples import sql_example_library
 
 # Setup logging
 setup_logging()
@@ -34,8 +42,24 @@ origins = [
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting up Bibliotheca Chatbot API")
+    await warm_llm_clients()
+    sql_example_library.load()
+    await hierarchy_index.start()
+    await chart_pool.start()
+    await chart_store.start(settings.CHART_STORE_SWEEP_INTERVAL_SECONDS)
+    if settings.ROLLUPS_ENABLED:
+        await rollup_manager.start()
+    if settings.PARTITION_MAINTENANCE_ENABLED:
+        await partition_maintainer.start()
     yield
     logger.info("Shutting down Bibliotheca Chatbot API")
+    await hierarchy_index.stop()
+    await partition_maintainer.stop()
+    await rollup_manager.stop()
+    await chart_store.stop()
+    chart_pool.shutdown()
+    await close_llm_clients()
+    await dispose_async_engines()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -46,6 +70,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Mount chart directory (before /static so chart requests are recorded by the chart store)
+app.mount(settings.CHART_URL_BASE, ChartStaticFiles(directory=settings.CHART_DIR, store=chart_store), name="charts")
+
 # Mount static files directory
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -0,0 +1,119 @@
+"""
+Benchmark of hierarchy name matching at 100 / 1k / 10k hierarchy sizes.
+
+Compares the previous per-candidate `fuzzywuzzy.process.extractOne` loop (when fuzzywuzzy is
+installed) with a full rapidfuzz `cdist`, the NumPy trigram scorer, and `match_names` as the resolver
+calls it (trigram shortlist + WRatio for large hierarchies). No database is needed; hierarchies are
+synthetic.
+
+    python -m benchmarks.hierarchy_matcher [--sizes 100 1000 10000] [--candidates 5] [--repeat 20]
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import Callable, List, Optional
+
+from app.langchain.tools import hierarchy_matcher
+from app.langchain.tools.hierarchy_index import OrgHierarchy
+
+PLACES = [
+    "Argyle", "Maxville", "Riverside", "Hillcrest", "Oakwood", "Kingsbury", "Elmhurst", "Westfield", "Northgate",
+    "Brookside", "Fairview", "Lakeside", "Ashford", "Cedar Grove", "Millbrook", "Stonebridge", "Harbour", "Greenhill",
+]
+KINDS = ["Library", "Branch", "Branch Library", "Community Library", "Learning Centre", "Annex", "Reading Room"]
+
+
+def synthetic_hierarchy(size: int, seed: int = 7) -> OrgHierarchy:
+    """An organization with `size` locations named like "Riverside North Branch 12"."""
+    rng = random.Random(seed)
+    rows = [("org", "Example Library System", None, None)]
+    for number in range(size - 1):
+        name = f"{rng.choice(PLACES)} {rng.choice(['', 'North ', 'South ', 'East ', 'West '])}{rng.choice(KINDS)} {number}"
+        rows.append((f"loc-{number}", name, "org", None))
+    return OrgHierarchy.from_rows("org", rows, watermark=())
+
+
+def user_candidates(hierarchy: OrgHierarchy, count: int, seed: int = 11) -> List[str]:
+    """Misspelled / abbreviated versions of random names, as users type them."""
+    rng = random.Random(seed)
+    candidates = []
+    for name in rng.sample(hierarchy.names, min(count, len(hierarchy))):
+        words = name.split()
+        word = rng.randrange(len(words))
+        if len(words[word]) > 3:
+            position = rng.randrange(1, len(words[word]) - 1)
+            words[word] = words[word][:position] + words[word][position + 1:]
+        candidates.append(" ".join(words).lower())
+    return candidates
+
+
+def timed(function: Callable[[], object], repeat: int) -> float:
+    """Median wall time of function in milliseconds."""
+    function()  # Warm-up (builds the lazily derived matcher state)
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def fuzzywuzzy_loop(hierarchy: OrgHierarchy, candidates: List[str]) -> Optional[Callable[[], object]]:
+    try:
+        from fuzzywuzzy import process
+    except ImportError:
+        return None
+    choices = dict(enumerate(hierarchy.names))
+    return lambda: [process.extractOne(candidate, choices, score_cutoff=85) for candidate in candidates]
+
+
+def batch(hierarchy: OrgHierarchy, candidates: List[str], backend: str) -> Optional[Callable[[], object]]:
+    if backend == "match_names":
+        return lambda: hierarchy_matcher.match_names(hierarchy, candidates)
+    if backend == "rapidfuzz":
+        if hierarchy_matcher.process is None:
+            return None
+        score = hierarchy_matcher._rapidfuzz_scores
+    else:
+        score = hierarchy_matcher._ngram_scores
+    return lambda: score(hierarchy, candidates)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--candidates", type=int, default=5, help="Names resolved per call")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'size':>7} {'fuzzywuzzy loop':>16} {'rapidfuzz cdist':>16} {'numpy trigrams':>15} {'match_names':>12}   (median ms per call, {args.candidates} names)")
+    for size in args.sizes:
+        hierarchy = synthetic_hierarchy(size)
+        candidates = user_candidates(hierarchy, args.candidates)
+        cells = []
+        for runner in (
+            fuzzywuzzy_loop(hierarchy, candidates),
+            batch(hierarchy, candidates, "rapidfuzz"),
+            batch(hierarchy, candidates, "ngram"),
+            batch(hierarchy, candidates, "match_names"),
+        ):
+            cells.append(f"{timed(runner, args.repeat):.3f}" if runner else "n/a")
+        print(f"{size:>7} {cells[0]:>16} {cells[1]:>16} {cells[2]:>15} {cells[3]:>12}")
+
+    # How often the faster scorers pick the same best name as a full WRatio pass
+    if hierarchy_matcher.process is not None:
+        hierarchy = synthetic_hierarchy(args.sizes[-1])
+        candidates = user_candidates(hierarchy, 50)
+        full = hierarchy_matcher._rapidfuzz_scores(hierarchy, candidates).max(axis=1)
+        for label, scores in (
+            ("numpy trigrams", hierarchy_matcher._ngram_scores(hierarchy, candidates)),
+            ("match_names", hierarchy_matcher.score_matrix(hierarchy, candidates)),
+        ):
+            best = hierarchy_matcher._rapidfuzz_scores(hierarchy, candidates)[range(len(candidates)), scores.argmax(axis=1)]
+            agreement = (best == full).mean()
+            print(f"Best match as good as full WRatio at {args.sizes[-1]} names, {label}: {agreement:.0%}")
+
+
+if __name__ == "__main__":
+    main()
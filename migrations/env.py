@@ -0,0 +1,45 @@
+"""
+Alembic environment. Migrations are hand-written SQL (the schema is described in
+app/db/schema_definitions.py, not in SQLAlchemy models), so there is no target metadata.
+"""
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+from app.core.config import settings
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = None
+
+
+def get_database_url() -> str:
+    """URL of the database selected with `-x db=<name>` (default report_management) from DATABASE_URLS."""
+    db_name = context.get_x_argument(as_dictionary=True).get("db", "report_management")
+    for server in settings.POSTGRES_SERVERS:
+        if server["name"] == db_name:
+            return server["url"]
+    raise RuntimeError(f"Database '{db_name}' is not configured in DATABASE_URLS")
+
+
+def run_migrations_offline() -> None:
+    context.configure(url=get_database_url(), target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    engine = create_engine(get_database_url(), poolclass=pool.NullPool)
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
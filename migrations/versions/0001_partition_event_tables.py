@@ -0,0 +1,185 @@
+"""Convert event tables "5" and "8" to monthly range partitions on "eventTimestamp"
+
+The existing table is renamed to "<table>_legacy" and attached, without copying, as the partition
+for everything before the cutover (the first month after both today and its newest row). Monthly
+partitions "<table>_pYYYYMM" are created from the cutover on, plus a DEFAULT partition; the
+partition maintenance task (app/db/partitions.py) keeps creating future months.
+
+Attaching requires "eventTimestamp" to be NOT NULL in every existing row; the CHECK constraint added
+first makes the migration fail early if it is not. Building the parent indexes scans the legacy
+partition, so run this in a maintenance window.
+
+`LIKE` copies only columns, defaults and CHECK constraints, so the rest is carried over explicitly:
+grants are re-issued on the new table, the primary key becomes (<old key>, "eventTimestamp") (a
+partitioned table's unique keys must include the partition key), foreign keys are re-added on the
+parent (PostgreSQL reuses the legacy table's equivalent ones), and row triggers move from the legacy
+table to the parent, which clones them to every partition.
+
+Deliberate limitation: the history stays in one "<table>_legacy" partition instead of being split
+into months, since splitting would copy every row. Retention (PARTITION_RETENTION_MONTHS) therefore
+retires it only as a whole, once its newest month is past the retention cutoff; until then old rows
+stay in place and queries still prune it when their time range starts after the cutover.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from datetime import date, datetime, timezone
+
+from alembic import context, op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = ("event_partitions",)
+depends_on = None
+
+EVENT_TABLES = ("5", "8")
+INITIAL_MONTHS = 3
+
+
+def _next_month(day: date) -> date:
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def _bound(day: date) -> str:
+    return f"'{day.isoformat()} 00:00:00+00'"
+
+
+def _sequence_name(table: str, column: str) -> str:
+    return f"{table}_{column}_partitioned_seq"
+
+
+def _identity_columns(conn, table: str) -> list:
+    return conn.execute(sa.text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_name = :table AND table_schema = current_schema() AND is_identity = 'YES'"
+    ), {"table": table}).scalars().all()
+
+
+def _triggers(conn, table: str) -> list:
+    # Definitions name the table as it is called now, so they can be replayed on a table renamed to it later
+    return conn.execute(sa.text(
+        "SELECT tgname, pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = CAST(:table AS regclass) AND NOT tgisinternal"
+    ), {"table": f'"{table}"'}).fetchall()
+
+
+def _upgrade_table(conn, table: str) -> None:
+    legacy = f"{table}_legacy"
+    newest = conn.execute(sa.text(f'SELECT max("eventTimestamp") FROM "{table}"')).scalar()
+    today = datetime.now(timezone.utc).date()
+    cutover = _next_month(max(today, newest.astimezone(timezone.utc).date() if newest else today))
+
+    # Everything LIKE does not copy, read before the rename
+    grants = conn.execute(sa.text(
+        "SELECT CASE WHEN acl.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(acl.grantee)) END, "
+        "string_agg(acl.privilege_type, ', ') "
+        "FROM pg_class c CROSS JOIN LATERAL aclexplode(c.relacl) acl "
+        "WHERE c.oid = CAST(:table AS regclass) AND acl.grantee <> c.relowner GROUP BY acl.grantee"
+    ), {"table": f'"{table}"'}).fetchall()
+    primary_key = conn.execute(sa.text(
+        "SELECT a.attname FROM pg_index i "
+        "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+        "WHERE i.indrelid = CAST(:table AS regclass) AND i.indisprimary "
+        "ORDER BY array_position(CAST(i.indkey AS int2[]), a.attnum)"
+    ), {"table": f'"{table}"'}).scalars().all()
+    foreign_keys = conn.execute(sa.text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'"
+    ), {"table": f'"{table}"'}).fetchall()
+    triggers = _triggers(conn, table)
+    # Built by migration 0004 when that ran first; renamed with the table so the parent can reuse the name
+    watermark_index = conn.execute(sa.text("SELECT to_regclass(:index) IS NOT NULL"),
+                                   {"index": f'"{table}_org_updated_at_idx"'}).scalar()
+
+    op.execute(f'ALTER TABLE "{table}" RENAME TO "{legacy}"')
+    if watermark_index:
+        op.execute(f'ALTER INDEX "{table}_org_updated_at_idx" RENAME TO "{legacy}_org_updated_at_idx"')
+    op.execute(
+        f'CREATE TABLE "{table}" (LIKE "{legacy}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        f'PARTITION BY RANGE ("eventTimestamp")'
+    )
+    # Identity columns are not copied by LIKE. The new table gets its own sequence, continuing the
+    # legacy one, because the legacy identity sequence is dropped with that partition on retirement
+    for column in _identity_columns(conn, legacy):
+        sequence = conn.execute(sa.text("SELECT pg_get_serial_sequence(:table, :column)"),
+                                {"table": f'"{legacy}"', "column": column}).scalar()
+        op.execute(f'CREATE SEQUENCE "{_sequence_name(table, column)}" OWNED BY "{table}"."{column}"')
+        op.execute(f"""SELECT setval('"{_sequence_name(table, column)}"', last_value, is_called) FROM {sequence}""")
+        op.execute(f"""ALTER TABLE "{table}" ALTER COLUMN "{column}" SET DEFAULT nextval('"{_sequence_name(table, column)}"')""")
+
+    # A validated CHECK lets ATTACH PARTITION skip its own full scan
+    op.execute(
+        f'ALTER TABLE "{legacy}" ADD CONSTRAINT "{legacy}_partition_range" '
+        f'CHECK ("eventTimestamp" IS NOT NULL AND "eventTimestamp" < {_bound(cutover)})'
+    )
+    op.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{legacy}" FOR VALUES FROM (MINVALUE) TO ({_bound(cutover)})')
+
+    month = cutover
+    for _ in range(INITIAL_MONTHS):
+        following = _next_month(month)
+        op.execute(
+            f'CREATE TABLE "{table}_p{month:%Y%m}" PARTITION OF "{table}" '
+            f'FOR VALUES FROM ({_bound(month)}) TO ({_bound(following)})'
+        )
+        month = following
+    op.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+
+    # Partitioned indexes cascade to every partition, including ones created later; an equivalent
+    # existing index on the legacy partition is attached instead of being rebuilt
+    op.execute(f'CREATE INDEX "{table}_org_event_ts_idx" ON "{table}" ("organizationId", "eventTimestamp")')
+    op.execute(f'CREATE INDEX "{table}_hierarchy_event_ts_idx" ON "{table}" ("hierarchyId", "eventTimestamp")')
+    op.execute(f'CREATE INDEX "{table}_updated_at_idx" ON "{table}" ("updatedAt")')
+    # The result cache's watermark index is migration 0004's (built concurrently); it is carried over
+    # only if it already exists, otherwise 0004 builds it partition by partition later
+    if watermark_index:
+        op.execute(f'CREATE INDEX "{table}_org_updated_at_idx" ON "{table}" ("organizationId", "updatedAt")')
+
+    for grantee, privileges in grants:
+        op.execute(f'GRANT {privileges} ON "{table}" TO {grantee}')
+    if primary_key:
+        columns = list(primary_key) + (["eventTimestamp"] if "eventTimestamp" not in primary_key else [])
+        quoted = ", ".join(f'"{column}"' for column in columns)
+        op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_partitioned_pkey" PRIMARY KEY ({quoted})')
+    for name, definition in foreign_keys:
+        op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+    # A trigger created on the parent is cloned to every partition, so the legacy copy is dropped first
+    for name, definition in triggers:
+        op.execute(f'DROP TRIGGER "{name}" ON "{legacy}"')
+        op.execute(definition)
+
+
+def _downgrade_table(conn, table: str) -> None:
+    legacy = f"{table}_legacy"
+    # Detaching removes the trigger clones from the legacy table; they are recreated once it is renamed back
+    triggers = _triggers(conn, table)
+    op.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{legacy}"')
+    op.execute(f'ALTER TABLE "{legacy}" DROP CONSTRAINT IF EXISTS "{legacy}_partition_range"')
+    # Rows written to the monthly/default partitions after the upgrade move back into the plain table
+    op.execute(f'INSERT INTO "{legacy}" SELECT * FROM "{table}"')
+    # The identity sequences continue from the ids handed out while partitioned
+    for column in _identity_columns(conn, legacy):
+        sequence = conn.execute(sa.text("SELECT pg_get_serial_sequence(:table, :column)"),
+                                {"table": f'"{legacy}"', "column": column}).scalar()
+        op.execute(f"SELECT setval('{sequence}', last_value, is_called) FROM \"{_sequence_name(table, column)}\"")
+    op.execute(f'DROP TABLE "{table}"')
+    # Indexes built on the legacy partition stay on the restored table
+    op.execute(f'ALTER TABLE "{legacy}" RENAME TO "{table}"')
+    op.execute(f'ALTER INDEX IF EXISTS "{legacy}_org_updated_at_idx" RENAME TO "{table}_org_updated_at_idx"')
+    for name, definition in triggers:
+        op.execute(f'DROP TRIGGER IF EXISTS "{name}" ON "{table}"')
+        op.execute(definition)
+
+
+def upgrade() -> None:
+    if context.is_offline_mode():
+        raise RuntimeError("This migration inspects the live tables and cannot run in offline (--sql) mode")
+    conn = op.get_bind()
+    for table in EVENT_TABLES:
+        _upgrade_table(conn, table)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    for table in EVENT_TABLES:
+        _downgrade_table(conn, table)
@@ -0,0 +1,44 @@
+"""Trigram index on hierarchyCaches names for server-side fuzzy name matching
+
+Enables the pg_trgm extension and builds a GIN trigram index on lower("name") of the live (not
+soft-deleted) rows. The hierarchy name resolver uses it for organizations with more hierarchy
+entries than HIERARCHY_SERVER_MATCH_MIN_ENTRIES, whose names are matched in Postgres instead of in
+memory (app/langchain/tools/hierarchy_trigram.py).
+
+The index is built CONCURRENTLY (outside the migration transaction), so writes to "hierarchyCaches"
+are not blocked while it builds. Creating the extension needs a role allowed to do so.
+
+The hierarchy migrations form their own branch ("hierarchy"), independent of the event table
+partitioning, so they can be applied without the maintenance window that one needs.
+
+Revision ID: 0002
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = None
+branch_labels = ("hierarchy",)
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS "hierarchyCaches_name_trgm_idx" '
+            'ON "hierarchyCaches" USING gin (lower("name") gin_trgm_ops) WHERE "deletedAt" IS NULL'
+        )
+        # Scope filter of the matching query (the organization and its direct children)
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS "hierarchyCaches_parent_id_idx" '
+            'ON "hierarchyCaches" ("parentId") WHERE "deletedAt" IS NULL'
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS "hierarchyCaches_parent_id_idx"')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS "hierarchyCaches_name_trgm_idx"')
+    # The extension is left installed; other objects may depend on it
@@ -0,0 +1,140 @@
+"""Closure table "hierarchyClosure" of the hierarchyCaches tree, maintained by triggers
+
+One row per (ancestor, descendant) pair, including every node with itself at depth 0, so "everything
+under node X" is a single indexed join instead of a recursive query:
+
+    JOIN "hierarchyClosure" hcl ON hcl."descendantId" = e."hierarchyId" WHERE hcl."ancestorId" = :hierarchy_id
+
+The table is filled from "parentId" (the authoritative link; "path" is not used) and kept up to date
+row by row: inserts link the new node under its parent's ancestors and adopt already-present children
+(so rows may arrive in any order), "parentId" updates move the whole subtree, and deletes detach the
+node's subtree from the node's former ancestors and drop the node's own pairs. Soft-deleted rows stay in the closure; queries filter "deletedAt" on "hierarchyCaches".
+"hierarchyClosure_rebuild"() recomputes the table from scratch if it is ever suspected to be out of sync.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE "hierarchyClosure" (
+            "ancestorId" uuid NOT NULL,
+            "descendantId" uuid NOT NULL,
+            "depth" integer NOT NULL,
+            PRIMARY KEY ("ancestorId", "descendantId")
+        )
+    """)
+    op.execute('CREATE INDEX "hierarchyClosure_descendant_idx" ON "hierarchyClosure" ("descendantId", "ancestorId", "depth")')
+
+    # Full recompute (also used to fill the table now); cycles in parentId are cut by the depth limit
+    op.execute("""
+        CREATE FUNCTION "hierarchyClosure_rebuild"() RETURNS void LANGUAGE plpgsql AS $$
+        BEGIN
+            DELETE FROM "hierarchyClosure";
+            INSERT INTO "hierarchyClosure" ("ancestorId", "descendantId", "depth")
+            WITH RECURSIVE tree ("ancestorId", "descendantId", "depth") AS (
+                SELECT "id", "id", 0 FROM "hierarchyCaches"
+                UNION ALL
+                SELECT parent."parentId", tree."descendantId", tree."depth" + 1
+                FROM tree JOIN "hierarchyCaches" parent ON parent."id" = tree."ancestorId"
+                WHERE parent."parentId" IS NOT NULL AND tree."depth" < 64
+            )
+            SELECT "ancestorId", "descendantId", min("depth") FROM tree GROUP BY "ancestorId", "descendantId";
+        END
+        $$
+    """)
+
+    op.execute("""
+        CREATE FUNCTION "hierarchyClosure_on_insert"() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO "hierarchyClosure" VALUES (NEW."id", NEW."id", 0) ON CONFLICT DO NOTHING;
+            -- Under the parent's ancestors
+            INSERT INTO "hierarchyClosure"
+            SELECT "ancestorId", NEW."id", "depth" + 1 FROM "hierarchyClosure" WHERE "descendantId" = NEW."parentId"
+            ON CONFLICT DO NOTHING;
+            -- Children inserted before their parent: their subtrees go under the new node's ancestors
+            INSERT INTO "hierarchyClosure"
+            SELECT above."ancestorId", below."descendantId", above."depth" + below."depth" + 1
+            FROM "hierarchyClosure" above
+            CROSS JOIN "hierarchyCaches" child
+            JOIN "hierarchyClosure" below ON below."ancestorId" = child."id"
+            WHERE above."descendantId" = NEW."id" AND child."parentId" = NEW."id" AND child."id" <> NEW."id"
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$
+    """)
+
+    op.execute("""
+        CREATE FUNCTION "hierarchyClosure_on_move"() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            -- Detach the subtree from its old ancestors (pairs within the subtree stay)
+            DELETE FROM "hierarchyClosure" link
+            USING "hierarchyClosure" below
+            WHERE below."ancestorId" = NEW."id"
+              AND link."descendantId" = below."descendantId"
+              AND link."ancestorId" IN (
+                  SELECT "ancestorId" FROM "hierarchyClosure" WHERE "descendantId" = NEW."id" AND "ancestorId" <> NEW."id"
+              );
+            -- Attach it under the new parent's ancestors
+            INSERT INTO "hierarchyClosure"
+            SELECT above."ancestorId", below."descendantId", above."depth" + below."depth" + 1
+            FROM "hierarchyClosure" above
+            CROSS JOIN "hierarchyClosure" below
+            WHERE above."descendantId" = NEW."parentId" AND below."ancestorId" = NEW."id"
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$
+    """)
+
+    op.execute("""
+        CREATE FUNCTION "hierarchyClosure_on_delete"() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            -- Detach the subtree from the deleted node's ancestors, as a move does
+            DELETE FROM "hierarchyClosure" link
+            USING "hierarchyClosure" below
+            WHERE below."ancestorId" = OLD."id"
+              AND link."descendantId" = below."descendantId"
+              AND link."ancestorId" IN (
+                  SELECT "ancestorId" FROM "hierarchyClosure" WHERE "descendantId" = OLD."id" AND "ancestorId" <> OLD."id"
+              );
+            DELETE FROM "hierarchyClosure" WHERE "ancestorId" = OLD."id" OR "descendantId" = OLD."id";
+            RETURN NULL;
+        END
+        $$
+    """)
+
+    op.execute("""
+        CREATE TRIGGER "hierarchyClosure_insert" AFTER INSERT ON "hierarchyCaches"
+        FOR EACH ROW EXECUTE FUNCTION "hierarchyClosure_on_insert"()
+    """)
+    op.execute("""
+        CREATE TRIGGER "hierarchyClosure_move" AFTER UPDATE OF "parentId" ON "hierarchyCaches"
+        FOR EACH ROW WHEN (OLD."parentId" IS DISTINCT FROM NEW."parentId") EXECUTE FUNCTION "hierarchyClosure_on_move"()
+    """)
+    op.execute("""
+        CREATE TRIGGER "hierarchyClosure_delete" AFTER DELETE ON "hierarchyCaches"
+        FOR EACH ROW EXECUTE FUNCTION "hierarchyClosure_on_delete"()
+    """)
+
+    op.execute('SELECT "hierarchyClosure_rebuild"()')
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER IF EXISTS "hierarchyClosure_delete" ON "hierarchyCaches"')
+    op.execute('DROP TRIGGER IF EXISTS "hierarchyClosure_move" ON "hierarchyCaches"')
+    op.execute('DROP TRIGGER IF EXISTS "hierarchyClosure_insert" ON "hierarchyCaches"')
+    op.execute('DROP FUNCTION IF EXISTS "hierarchyClosure_on_delete"()')
+    op.execute('DROP FUNCTION IF EXISTS "hierarchyClosure_on_move"()')
+    op.execute('DROP FUNCTION IF EXISTS "hierarchyClosure_on_insert"()')
+    op.execute('DROP FUNCTION IF EXISTS "hierarchyClosure_rebuild"()')
+    op.execute('DROP TABLE IF EXISTS "hierarchyClosure"')
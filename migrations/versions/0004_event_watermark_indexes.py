@@ -0,0 +1,84 @@
+"""("organizationId", "updatedAt") indexes on event tables "5" and "8" for the SQL result cache
+
+The result cache probes max("updatedAt") per organization before reusing a cached result
+(app/langchain/tools/sql_result_cache.py); without these indexes every probe scans the organization's
+events.
+
+The indexes are built CONCURRENTLY, so writes to the event tables are not blocked while they build,
+and the migration forms its own branch ("event_watermarks") that can be applied before or after the
+partitioning migration 0001:
+
+- on a plain table the index is built directly; 0001 later carries it over to the partitioned table.
+- on a partitioned table (CREATE INDEX CONCURRENTLY is not supported there) an invalid index is
+  created on the parent only, each partition gets its own index built concurrently and attached,
+  and the parent index becomes valid once every partition has one. Partitions created afterwards
+  get theirs from the parent.
+
+Revision ID: 0004
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = None
+branch_labels = ("event_watermarks",)
+depends_on = None
+
+EVENT_TABLES = ("5", "8")
+
+
+def _index_name(table: str) -> str:
+    return f"{table}_org_updated_at_idx"
+
+
+def _is_partitioned(conn, table: str) -> bool:
+    return conn.execute(sa.text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = CAST(:table AS regclass)"
+    ), {"table": f'"{table}"'}).scalar()
+
+
+def _unindexed_partitions(conn, table: str) -> list:
+    # Partitions with no index attached to the parent index yet (ones created after it already have one)
+    return conn.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits p JOIN pg_class c ON c.oid = p.inhrelid "
+        "WHERE p.inhparent = CAST(:table AS regclass) AND NOT EXISTS ("
+        "    SELECT 1 FROM pg_inherits pi JOIN pg_index i ON i.indexrelid = pi.inhrelid "
+        "    WHERE pi.inhparent = CAST(:index AS regclass) AND i.indrelid = c.oid) "
+        "ORDER BY c.relname"
+    ), {"table": f'"{table}"', "index": f'"{_index_name(table)}"'}).scalars().all()
+
+
+def _upgrade_table(conn, table: str) -> None:
+    index = _index_name(table)
+    if not _is_partitioned(conn, table):
+        op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index}" ON "{table}" ("organizationId", "updatedAt")')
+        return
+    op.execute(f'CREATE INDEX IF NOT EXISTS "{index}" ON ONLY "{table}" ("organizationId", "updatedAt")')
+    for partition in _unindexed_partitions(conn, table):
+        op.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{_index_name(partition)}" '
+            f'ON "{partition}" ("organizationId", "updatedAt")'
+        )
+        op.execute(f'ALTER INDEX "{index}" ATTACH PARTITION "{_index_name(partition)}"')
+
+
+def upgrade() -> None:
+    if context.is_offline_mode():
+        raise RuntimeError("This migration inspects the live tables and cannot run in offline (--sql) mode")
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        for table in EVENT_TABLES:
+            _upgrade_table(conn, table)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        for table in EVENT_TABLES:
+            if _is_partitioned(conn, table):
+                # Dropping the parent index drops the attached partition indexes with it
+                op.execute(f'DROP INDEX IF EXISTS "{_index_name(table)}"')
+            else:
+                op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{_index_name(table)}"')
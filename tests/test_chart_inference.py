@@ -0,0 +1,88 @@
+import pytest
+
+from app.core.config import settings
+from app.langchain.tools.chart_inference import infer_chart_metadata
+
+THRESHOLD = settings.CHART_INFERENCE_MIN_CONFIDENCE
+
+
+def test_hourly_totals_from_json_floats_are_a_line_over_hours():
+    # EXTRACT(HOUR ...) and SUM(...) come back as Decimal and reach the chart tool as JSON floats
+    metadata, confidence = infer_chart_metadata(
+        ["Hour", "Total Entries"], [[8.0, 120.0], [9.0, 310.0], [10.0, 255.0], [11.0, 198.0]]
+    )
+    assert metadata["chart_type"] == "line"
+    assert (metadata["x_column"], metadata["y_column"]) == ("Hour", "Total Entries")
+    assert confidence >= THRESHOLD
+
+
+def test_fractional_values_in_time_named_column_are_numeric():
+    metadata, confidence = infer_chart_metadata(
+        ["Avg Visit Hours", "Total Entries"], [[1.5, 120.0], [2.25, 310.0], [0.75, 255.0]]
+    )
+    assert metadata["chart_type"] == "scatter"
+    assert confidence < THRESHOLD
+
+
+def test_daily_trend_split_by_location():
+    rows = [[f"2026-10-{day:02d}", location, float(day * 10)] for day in (12, 13, 14) for location in ("Argyle", "Main")]
+    metadata, confidence = infer_chart_metadata(["Day", "Location", "Total Borrows"], rows)
+    assert metadata["chart_type"] == "line"
+    assert (metadata["x_column"], metadata["y_column"], metadata["color_column"]) == ("Day", "Total Borrows", "Location")
+    assert confidence >= THRESHOLD
+
+
+def test_single_measure_per_location_is_a_confident_bar():
+    metadata, confidence = infer_chart_metadata(
+        ["Location", "Total Borrows"], [["Argyle", 120.0], ["Main", 340.0], ["Westside", 90.0], ["Harbour", 75.0]]
+    )
+    assert metadata["chart_type"] == "bar"
+    assert (metadata["x_column"], metadata["y_column"]) == ("Location", "Total Borrows")
+    assert confidence >= THRESHOLD
+
+
+def test_several_measures_per_location_keep_the_first_and_defer_to_the_llm():
+    metadata, confidence = infer_chart_metadata(
+        ["Location", "Total Borrows", "Total Returns"], [["Argyle", 120.0, 98.0], ["Main", 340.0, 301.0]]
+    )
+    assert metadata["y_column"] == "Total Borrows"
+    assert confidence < THRESHOLD
+
+
+def test_one_row_of_two_totals_is_not_a_scatter():
+    metadata, confidence = infer_chart_metadata(["Successful Renewals", "Failed Renewals"], [[412.0, 17.0]])
+    assert metadata is None and confidence == 0.0
+
+
+def test_scatter_of_two_measures_defers_to_the_llm():
+    rows = [[float(n), float(n * 3)] for n in range(1, 6)]
+    metadata, confidence = infer_chart_metadata(["Total Borrows", "Total Returns"], rows)
+    assert metadata["chart_type"] == "scatter"
+    assert confidence < THRESHOLD
+
+
+def test_shares_summing_to_100_are_a_pie():
+    metadata, confidence = infer_chart_metadata(
+        ["Event Type", "Percentage"], [["Borrows", 55.0], ["Returns", 30.0], ["Renewals", 15.0]]
+    )
+    assert metadata["chart_type"] == "pie"
+    assert confidence >= THRESHOLD
+
+
+@pytest.mark.parametrize("query, chart_type", [
+    ("show it as a pie chart", "pie"),
+    ("bar chart please", "bar"),
+])
+def test_requested_chart_type_wins(query, chart_type):
+    metadata, _ = infer_chart_metadata(["Location", "Total Borrows"], [["Argyle", 120.0], ["Main", 340.0]], query)
+    assert metadata["chart_type"] == chart_type
+
+
+def test_identifier_columns_are_not_measures():
+    metadata, confidence = infer_chart_metadata(["hierarchyId", "Total Entries"], [[1, 10.0], [2, 20.0], [3, 30.0]])
+    assert metadata is None and confidence == 0.0
+
+
+@pytest.mark.parametrize("columns, rows", [([], []), (["Location", "Total"], []), (["Location"], [["Argyle"]])])
+def test_nothing_to_chart(columns, rows):
+    assert infer_chart_metadata(columns, rows) == (None, 0.0)
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.db.partitions import WINDOW_START_PARAM, apply_default_time_window
+
+NOW = datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("where", [
+    '"organizationId" = :organization_id AND "eventTimestamp" >= :start_ts',
+    '("organizationId" = :organization_id AND "eventTimestamp" >= :start_ts)',
+    '("organizationId" = :organization_id AND ("eventTimestamp" >= :start_ts))',
+    '"organizationId" = :organization_id AND "eventTimestamp" < \'2024-01-01\'',
+    ':end_ts > "eventTimestamp" AND "organizationId" = :organization_id',
+    '("eventTimestamp" BETWEEN :start_ts AND :end_ts AND "organizationId" = :organization_id)',
+])
+def test_bounded_queries_are_left_unchanged(where):
+    sql = f'SELECT SUM("39") FROM "8" WHERE {where}'
+    assert apply_default_time_window(sql, {}, 365, now=NOW) == (sql, {}, None)
+
+
+@pytest.mark.parametrize("where", [
+    '"organizationId" = :organization_id',
+    '("organizationId" = :organization_id)',
+    '"organizationId" = :organization_id AND ("eventTimestamp" >= :start_ts OR "hierarchyId" = :location_1)',
+    '"organizationId" = :organization_id AND NOT ("eventTimestamp" < :start_ts)',
+])
+def test_unbounded_queries_get_the_default_window(where):
+    sql, parameters, window_start = apply_default_time_window(f'SELECT SUM("39") FROM "8" WHERE {where}', {}, 365, now=NOW)
+    assert window_start == datetime(2025, 10, 18, tzinfo=timezone.utc)
+    assert parameters == {WINDOW_START_PARAM: window_start}
+    assert f'FROM (SELECT * FROM "8" WHERE "eventTimestamp" >= :{WINDOW_START_PARAM}) AS "8"' in sql
+
+
+def test_only_the_unbounded_reference_is_restricted():
+    sql = ('SELECT COUNT(*) FROM "5" e JOIN "8" f ON f."hierarchyId" = e."hierarchyId" '
+           'WHERE (e."eventTimestamp" >= :start_ts AND e."organizationId" = :organization_id)')
+    rewritten, _, window_start = apply_default_time_window(sql, {}, 365, now=NOW)
+    assert window_start is not None
+    assert 'FROM "5" e JOIN (SELECT * FROM "8" WHERE' in rewritten
@@ -0,0 +1,110 @@
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from app.langchain.tools.temporal import RANGE_REFERENCE, _add_months, normalize_time_expressions
+
+TZ = ZoneInfo("Europe/Berlin")
+NOW = datetime(2026, 10, 18, 12, 0, tzinfo=TZ)  # A Sunday
+
+
+def _range(description, now=NOW):
+    rewritten, params = normalize_time_expressions(description, TZ, now=now)
+    assert RANGE_REFERENCE in rewritten
+    assert params["start_ts"].tzinfo is TZ and params["end_ts"].tzinfo is TZ
+    return params["start_ts"].date(), params["end_ts"].date()
+
+
+@pytest.mark.parametrize("phrase, start, end", [
+    ("in the last 7 days", date(2026, 10, 12), date(2026, 10, 19)),
+    ("over the past 30 days", date(2026, 9, 19), date(2026, 10, 19)),
+    ("in the last two weeks", date(2026, 10, 5), date(2026, 10, 19)),
+    ("in the past 3 months", date(2026, 7, 19), date(2026, 10, 19)),
+    ("in the last 2 quarters", date(2026, 4, 19), date(2026, 10, 19)),
+    ("in the last 2 years", date(2024, 10, 19), date(2026, 10, 19)),
+])
+def test_rolling_count_is_exactly_n_units_ending_today(phrase, start, end):
+    assert _range(f"Total visits {phrase}") == (start, end)
+
+
+@pytest.mark.parametrize("phrase, start, end", [
+    ("in the last day", date(2026, 10, 18), date(2026, 10, 19)),
+    ("over the past week", date(2026, 10, 12), date(2026, 10, 19)),
+    ("in the last month", date(2026, 9, 19), date(2026, 10, 19)),
+    ("in the last quarter", date(2026, 7, 19), date(2026, 10, 19)),
+    ("in the past year", date(2025, 10, 19), date(2026, 10, 19)),
+])
+def test_rolling_single_unit_keeps_day_of_month(phrase, start, end):
+    assert _range(f"Total visits {phrase}") == (start, end)
+
+
+def test_rolling_month_clamps_to_month_end():
+    assert _range("Total visits in the last month", now=datetime(2026, 3, 30, 9, 0, tzinfo=TZ)) == (
+        date(2026, 2, 28), date(2026, 3, 31))
+
+
+@pytest.mark.parametrize("phrase, start, end", [
+    ("in the previous calendar week", date(2026, 10, 5), date(2026, 10, 12)),
+    ("in the last calendar month", date(2026, 9, 1), date(2026, 10, 1)),
+    ("in the previous calendar quarter", date(2026, 7, 1), date(2026, 10, 1)),
+    ("in the previous calendar year", date(2025, 1, 1), date(2026, 1, 1)),
+])
+def test_previous_calendar_period(phrase, start, end):
+    assert _range(f"Total visits {phrase}") == (start, end)
+
+
+@pytest.mark.parametrize("phrase, start, end", [
+    ("this week", date(2026, 10, 12), date(2026, 10, 19)),
+    ("this month", date(2026, 10, 1), date(2026, 11, 1)),
+    ("this quarter", date(2026, 10, 1), date(2027, 1, 1)),
+    ("this year", date(2026, 1, 1), date(2027, 1, 1)),
+])
+def test_current_calendar_period(phrase, start, end):
+    assert _range(f"Total visits {phrase}") == (start, end)
+
+
+@pytest.mark.parametrize("phrase, start, end", [
+    ("yesterday", date(2026, 10, 17), date(2026, 10, 18)),
+    ("today", date(2026, 10, 18), date(2026, 10, 19)),
+])
+def test_single_day(phrase, start, end):
+    assert _range(f"Total visits {phrase}") == (start, end)
+
+
+@pytest.mark.parametrize("phrase, start, end", [
+    ("in Q1 2025", date(2025, 1, 1), date(2025, 4, 1)),
+    ("in Q3", date(2026, 7, 1), date(2026, 10, 1)),
+    ("in the fourth quarter of 2024", date(2024, 10, 1), date(2025, 1, 1)),
+])
+def test_quarter(phrase, start, end):
+    assert _range(f"Total visits {phrase}") == (start, end)
+
+
+@pytest.mark.parametrize("phrase, start, end", [
+    ("in March 2024", date(2024, 3, 1), date(2024, 4, 1)),
+    ("in September", date(2026, 9, 1), date(2026, 10, 1)),
+    ("in February 2024", date(2024, 2, 1), date(2024, 3, 1)),
+])
+def test_month(phrase, start, end):
+    assert _range(f"Total visits {phrase}") == (start, end)
+
+
+def test_year():
+    assert _range("Total visits in 2024") == (date(2024, 1, 1), date(2025, 1, 1))
+
+
+def test_no_or_several_expressions_are_left_unchanged():
+    for description in ("Total visits per zone", "Visits yesterday compared with this month"):
+        assert normalize_time_expressions(description, TZ, now=NOW) == (description, {})
+
+
+def test_bare_may_is_not_a_month():
+    description = "Zones that may be overcrowded"
+    assert normalize_time_expressions(description, TZ, now=NOW) == (description, {})
+
+
+def test_add_months_clamps_day():
+    assert _add_months(date(2024, 3, 31), -1) == date(2024, 2, 29)
+    assert _add_months(date(2026, 1, 31), 3) == date(2026, 4, 30)
+    assert _add_months(date(2026, 10, 18), -12) == date(2025, 10, 18)